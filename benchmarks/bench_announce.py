@@ -0,0 +1,80 @@
+"""Micro-benchmark of the per-announce hot path on a single core.
+
+Announces are sent through `httpx.MockTransport`, so the numbers cover
+request construction, httpx's client overhead, response handling and
+logging, but no network I/O.
+
+    $ python -m benchmarks.bench_announce -n 5000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+import flatbencode
+import httpx
+
+from ghostseeder.ghostseeder import TorrentSpoofer
+
+METAINFO = {
+    b"announce": b"https://tracker.example/0123456789abcdef/announce",
+    b"info": {
+        b"length": 500000,
+        b"name": b"Torrent for benchmarking",
+        b"piece length": 32768,
+        b"pieces": b"\x00" * 20 * 16,
+        b"private": 1,
+    },
+}
+RESPONSE = flatbencode.encode(
+    {b"complete": 1965, b"incomplete": 29, b"interval": 1800, b"peers": b""}
+)
+
+
+def make_torrent(folder: str, announce_url: Optional[str] = None) -> TorrentSpoofer:
+    filepath = os.path.join(folder, "bench.torrent")
+    metainfo = dict(METAINFO)
+    if announce_url is not None:
+        metainfo[b"announce"] = announce_url.encode()
+    with open(filepath, "wb") as f:
+        f.write(flatbencode.encode(metainfo))
+    return TorrentSpoofer(filepath, "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+
+
+async def bench_announce(torrent: TorrentSpoofer, n: int) -> float:
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=RESPONSE)
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        start = time.process_time()
+        for _ in range(n):
+            await torrent.announce_once(client, 6881)
+        return n / (time.process_time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=5000, help="Announces per run")
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Runs to take the best of"
+    )
+    args = parser.parse_args()
+
+    # Production logs at INFO, so DEBUG messages are dropped. Discard INFO
+    # output as well so the terminal isn't part of the measurement:
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as folder:
+        torrent = make_torrent(folder)
+        rate = max(
+            asyncio.run(bench_announce(torrent, args.n)) for _ in range(args.repeat)
+        )
+    print(f"announce_once: {rate:,.0f} announces/sec per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""End-to-end load test of loading and announcing a large torrent folder.
+
+For each corpus size a folder of synthetic torrents is generated and loaded
+the same way `ghostseed()` does it (process pool parsing streamed into the
+`AnnounceScheduler`) against local mock trackers. The mock trackers run in
+a separate process so they don't compete with ghostseeder for CPU, and every
+size runs in a fresh process so peak RSS is measured per size.
+
+Reported per size:
+
+- startup: seconds until every torrent has been announced once
+- announces/sec: over the whole run, including startup
+- latency p50/p99: time for `announce_once` to complete
+- lag p50/p99: how late announces were sent relative to when they were due,
+  including time spent waiting on per-tracker limits
+- shutdown: seconds to send the final `stopped` announces
+- peak RSS of the ghostseeder process
+
+`--transport` and `--loop` select the HTTP client and event loop, see
+`ghostseeder.transport`.
+
+    $ python -m benchmarks.bench_load --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import queue
+import resource
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer
+from ghostseeder.tracker import Tracker, TrackerPool
+from ghostseeder.transport import EVENT_LOOPS, TRANSPORTS, run
+
+from . import mock_tracker
+from .corpus import generate_corpus
+
+PEER_ID = "-qB4450-McTfgDArNMzY"
+USERAGENT = "qBittorrent/4.4.5"
+
+
+class InstrumentedScheduler(AnnounceScheduler):
+    """Records the latency and lag of every announce"""
+
+    def __init__(self, trackers: TrackerPool, port: int, max_workers: int, size: int):
+        super().__init__(trackers, port, max_workers)
+        self.size = size
+        self.latencies: list[float] = []
+        self.lags: list[float] = []
+        self.due_at: dict[str, float] = {}
+        self.announced: set[str] = set()
+        self.first_round = asyncio.Event()
+
+    def schedule(self, torrent: TorrentSpoofer, delay: float = 0) -> None:
+        self.due_at[torrent.filepath] = time.monotonic() + delay
+        super().schedule(torrent, delay)
+
+    async def _announce(self, tracker: Tracker, torrent: TorrentSpoofer) -> None:
+        start = time.monotonic()
+        self.lags.append(start - self.due_at[torrent.filepath])
+        try:
+            await super()._announce(tracker, torrent)
+        finally:
+            self.latencies.append(time.monotonic() - start)
+            self.announced.add(torrent.filepath)
+            if len(self.announced) == self.size:
+                self.first_round.set()
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def load(folder: str, size: int, args: argparse.Namespace) -> dict:
+    executor = concurrent.futures.ProcessPoolExecutor()
+    start = time.monotonic()
+    startup: Optional[float] = None
+    try:
+        async with TrackerPool(
+            args.max_requests, args.max_connections, transport=args.transport
+        ) as trackers:
+            scheduler = InstrumentedScheduler(trackers, 6881, args.workers, size)
+            torrents = TorrentSpoofer.stream_torrents(
+                folder, PEER_ID, USERAGENT, executor
+            )
+            scheduler.spawn(scheduler.add_from(torrents))
+            runner = asyncio.create_task(scheduler.run())
+
+            first_round = asyncio.create_task(scheduler.first_round.wait())
+            await asyncio.wait(
+                [runner, first_round],
+                timeout=args.timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if first_round.done():
+                startup = time.monotonic() - start
+                await asyncio.wait([runner], timeout=args.duration)
+            first_round.cancel()
+            if runner.done():
+                # The scheduler only returns early on an unexpected error:
+                runner.result()
+            elapsed = time.monotonic() - start
+
+            stopping = time.monotonic()
+            runner.cancel()
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+            shutdown = time.monotonic() - stopping
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        "size": size,
+        "startup": startup,
+        "rate": len(scheduler.latencies) / elapsed,
+        "latency_p50": percentile(scheduler.latencies, 0.50),
+        "latency_p99": percentile(scheduler.latencies, 0.99),
+        "lag_p50": percentile(scheduler.lags, 0.50),
+        "lag_p99": percentile(scheduler.lags, 0.99),
+        "shutdown": shutdown,
+        # Kilobytes on Linux, bytes on macOS:
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        * (1 if sys.platform == "darwin" else 1024),
+    }
+
+
+def run_load(folder: str, size: int, args: argparse.Namespace, results) -> None:
+    # Keep INFO messages formatted as in production but don't write them out,
+    # so the terminal isn't part of the measurement:
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.INFO)
+    results.put(run(load(folder, size, args), args.loop))
+
+
+def run_trackers(args: argparse.Namespace, ports, stop) -> None:
+    async def serve():
+        tracker = mock_tracker.from_arguments(args)
+        for _ in range(args.trackers):
+            ports.put(await tracker.serve())
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        await tracker.aclose()
+
+    asyncio.run(serve())
+
+
+def format_row(result: dict) -> str:
+    startup = result["startup"]
+    return (
+        f"{result['size']:>9,}"
+        f"{'timeout' if startup is None else f'{startup:.1f}s':>10}"
+        f"{result['rate']:>13,.0f}"
+        f"{result['latency_p50'] * 1000:>10.1f}ms{result['latency_p99'] * 1000:>8.1f}ms"
+        f"{result['lag_p50']:>9.2f}s{result['lag_p99']:>8.2f}s"
+        f"{result['shutdown']:>10.1f}s"
+        f"{result['peak_rss'] / 2**20:>9.0f}MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Numbers of torrents to test with",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30,
+        help="Seconds to keep announcing after every torrent has started",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for every torrent to start",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=float,
+        default=10000,
+        help="Announces per second allowed per tracker",
+    )
+    parser.add_argument(
+        "--max-connections", type=int, default=16, help="Connections per tracker"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=64, help="Max announces in flight"
+    )
+    parser.add_argument(
+        "--transport", choices=TRANSPORTS, default="httpx", help="HTTP client"
+    )
+    parser.add_argument(
+        "--loop", choices=EVENT_LOOPS, default="asyncio", help="Event loop"
+    )
+    mock_tracker.add_arguments(parser)
+    parser.set_defaults(interval=30)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    ports, stop = context.Queue(), context.Event()
+    trackers = context.Process(target=run_trackers, args=(args, ports, stop))
+    trackers.start()
+    try:
+        announce_urls = [
+            f"http://127.0.0.1:{ports.get(timeout=30)}/0123456789abcdef/announce"
+            for _ in range(args.trackers)
+        ]
+        print(
+            f"{'torrents':>9}{'startup':>10}{'announces/s':>13}"
+            f"{'latency p50':>12}{'p99':>10}{'lag p50':>10}{'p99':>9}"
+            f"{'shutdown':>11}{'peak RSS':>12}"
+        )
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as folder:
+                generate_corpus(folder, size, announce_urls)
+                results = context.Queue()
+                process = context.Process(
+                    target=run_load, args=(folder, size, args, results)
+                )
+                process.start()
+                while True:
+                    try:
+                        result = results.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not process.is_alive():
+                            sys.exit(f"Load test with {size:,} torrents crashed")
+                process.join()
+            print(format_row(result), flush=True)
+    finally:
+        stop.set()
+        trackers.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measures the memory retained per loaded torrent.
+
+Torrents are built from in-memory metainfo the same way `stream_torrents`
+builds them from parsed files: every torrent gets its own announce url
+string, like it would when parsed from its own file, spread over a few
+trackers. Memory is measured with `tracemalloc` after the metainfo has been
+dropped, so only what `TorrentSpoofer` and the scheduler retain is counted.
+
+    $ python -m benchmarks.bench_memory -n 100000
+"""
+import argparse
+import asyncio
+import gc
+import hashlib
+import tracemalloc
+
+from ghostseeder.bencode import Metainfo
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer
+from ghostseeder.tracker import TrackerPool
+
+PEER_ID = "-qB4450-McTfgDArNMzY"
+USERAGENT = "qBittorrent/4.4.5"
+TRACKERS = 4
+
+
+def make_metainfo(i: int) -> Metainfo:
+    return Metainfo(
+        hashlib.sha1(i.to_bytes(8, "big")).digest(),
+        f"https://tracker{i % TRACKERS}.example/0123456789abcdef/announce",
+        [],
+        f"Torrent for benchmarking {i}",
+    )
+
+
+async def measure(n: int) -> tuple[float, float]:
+    """Returns the bytes retained per torrent, by the torrents alone and
+    once they are registered with a scheduler
+    """
+    async with TrackerPool(1) as trackers:
+        gc.collect()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        torrents = [
+            TorrentSpoofer(f"/torrents/{i:07d}.torrent", PEER_ID, USERAGENT, metainfo)
+            for i, metainfo in ((i, make_metainfo(i)) for i in range(n))
+        ]
+        gc.collect()
+        loaded = tracemalloc.get_traced_memory()[0]
+
+        scheduler = AnnounceScheduler(trackers, 6881)
+        for torrent in torrents:
+            scheduler.add(torrent, delay=3600)
+        gc.collect()
+        scheduled = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return (loaded - start) / n, (scheduled - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=100000, help="Number of torrents")
+    args = parser.parse_args()
+
+    torrent, scheduled = asyncio.run(measure(args.n))
+    print(f"TorrentSpoofer: {torrent:,.0f} bytes per torrent")
+    print(f"With scheduler: {scheduled:,.0f} bytes per torrent")
+    print(f"500k torrents:  {scheduled * 500000 / 2**20:,.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Compares the HTTP transports and event loops on real connections.
+
+Announces are sent to a local mock tracker running in a separate process,
+with a fixed number in flight at once. Each combination of transport and
+event loop runs in a fresh process and reports its announce rate and the
+CPU time it spent per announce.
+
+    $ python -m benchmarks.bench_transport -n 20000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import tempfile
+import time
+
+from ghostseeder.ghostseeder import TorrentSpoofer
+from ghostseeder.tracker import TrackerPool
+from ghostseeder.transport import EVENT_LOOPS, TRANSPORTS, run
+
+from . import mock_tracker
+from .bench_announce import make_torrent
+
+
+async def bench_transport(
+    torrent: TorrentSpoofer, transport: str, n: int, concurrency: int
+) -> tuple[float, float]:
+    async with TrackerPool(1e9, concurrency, concurrency, transport) as trackers:
+        client = trackers.get(torrent.announce_url).client
+        remaining = iter(range(n))
+
+        async def announce():
+            for _ in remaining:
+                response = await torrent.announce(client, 6881)
+                response.raise_for_status()
+
+        start, cpu_start = time.monotonic(), time.process_time()
+        await asyncio.gather(*(announce() for _ in range(concurrency)))
+        elapsed, cpu = time.monotonic() - start, time.process_time() - cpu_start
+    return n / elapsed, cpu / n
+
+
+def run_bench(announce_url: str, transport: str, loop: str, args, results) -> None:
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.INFO)
+    with tempfile.TemporaryDirectory() as folder:
+        torrent = make_torrent(folder, announce_url)
+        results.put(
+            run(bench_transport(torrent, transport, args.n, args.concurrency), loop)
+        )
+
+
+def run_tracker(args: argparse.Namespace, ports, stop) -> None:
+    async def serve():
+        tracker = mock_tracker.from_arguments(args)
+        ports.put(await tracker.serve())
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        await tracker.aclose()
+
+    asyncio.run(serve())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=20000, help="Announces per run")
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Announces in flight at once"
+    )
+    mock_tracker.add_arguments(parser)
+    args = parser.parse_args()
+
+    loops = [
+        loop
+        for loop in EVENT_LOOPS
+        if loop == "asyncio" or importlib.util.find_spec(loop) is not None
+    ]
+    context = multiprocessing.get_context("spawn")
+    ports, stop = context.Queue(), context.Event()
+    tracker = context.Process(target=run_tracker, args=(args, ports, stop))
+    tracker.start()
+    try:
+        port = ports.get(timeout=30)
+        announce_url = f"http://127.0.0.1:{port}/0123456789abcdef/announce"
+        print(f"{'transport':<10}{'loop':<9}{'announces/s':>12}{'CPU/announce':>14}")
+        for transport in TRANSPORTS:
+            for loop in loops:
+                results = context.Queue()
+                process = context.Process(
+                    target=run_bench,
+                    args=(announce_url, transport, loop, args, results),
+                )
+                process.start()
+                rate, cpu = results.get()
+                process.join()
+                print(
+                    f"{transport:<10}{loop:<9}{rate:>12,.0f}{cpu * 1e6:>12.0f}us",
+                    flush=True,
+                )
+    finally:
+        stop.set()
+        tracker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Generates a folder of synthetic `.torrent` files for load testing.
+
+Torrents have the same shape as the `valid_singlefile_metainfo` and
+`valid_multifile_metainfo` test fixtures, alternating between the two. Each
+one gets a unique name, and therefore a unique infohash, and is assigned to
+one of the given announce urls round-robin.
+
+    $ python -m benchmarks.corpus -n 10000 /tmp/corpus http://127.0.0.1:8080/announce
+"""
+import argparse
+import os
+from collections import OrderedDict
+from typing import Sequence
+
+import flatbencode
+
+# Files per subdirectory, so no single directory gets unrealistically large:
+FILES_PER_FOLDER = 1000
+
+
+# fmt: off
+def singlefile_metainfo(announce: str, name: str) -> OrderedDict:
+    return OrderedDict([
+        (b'announce', announce.encode()),
+        (b'comment', b'Test comment'),
+        (b'created by', b'Author'),
+        (b'creation date', 1677139471),
+        (b'info', OrderedDict([
+            (b'length', 500000),
+            (b'name', name.encode()),
+            (b'piece length', 32768),
+            (b'pieces', b'\x00' * 20 * 16),
+            (b'private', 1)
+        ]))
+    ])
+
+
+def multifile_metainfo(announce: str, name: str) -> OrderedDict:
+    return OrderedDict([
+        (b'announce', announce.encode()),
+        (b'comment', b'Test comment'),
+        (b'created by', b'Author'),
+        (b'creation date', 1677139471),
+        (b'info', OrderedDict([
+            (b'files', [{b'length': 123, b'path': [b'A file']},
+                        {b'length': 456, b'path': [b'Another file']},
+                        {b'length': 789, b'path': [b'A', b'third', b'file in a subdir']}]),
+            (b'name', name.encode()),
+            (b'piece length', 32768),
+            (b'pieces', b'\x00' * 20),
+            (b'private', 1)
+        ]))
+    ])
+# fmt: on
+
+
+def generate_corpus(folderpath: str, n: int, announce_urls: Sequence[str]) -> int:
+    """Writes `n` torrent files under `folderpath` and returns the total
+    number of bytes written
+    """
+    total = 0
+    for i in range(n):
+        folder = os.path.join(folderpath, f"{i // FILES_PER_FOLDER:04d}")
+        if i % FILES_PER_FOLDER == 0:
+            os.makedirs(folder, exist_ok=True)
+        announce = announce_urls[i % len(announce_urls)]
+        shape = singlefile_metainfo if i % 2 == 0 else multifile_metainfo
+        contents = flatbencode.encode(shape(announce, f"Torrent for testing {i}"))
+        with open(os.path.join(folder, f"{i:06d}.torrent"), "wb") as f:
+            f.write(contents)
+        total += len(contents)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder", help="Folder to write torrent files to")
+    parser.add_argument("announce", nargs="+", help="Announce urls to assign")
+    parser.add_argument("-n", type=int, default=1000, help="Number of torrents")
+    args = parser.parse_args()
+
+    total = generate_corpus(args.folder, args.n, args.announce)
+    print(f"Wrote {args.n:,} torrent files ({total / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
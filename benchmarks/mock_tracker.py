@@ -0,0 +1,144 @@
+"""A minimal local HTTP tracker for load testing.
+
+Speaks just enough HTTP/1.1 (with keep-alive) to answer announces with a
+bencoded response. Latency, error rate and the intervals handed out are
+configurable so the client can be tested against slow or flaky trackers.
+Several trackers can be served at once, one per port, since ghostseeder
+pools connections and rate limits per `host:port`.
+
+    $ python -m benchmarks.mock_tracker --trackers 4 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+from typing import Optional
+
+import flatbencode
+
+_ERROR = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n"
+
+
+class MockTracker:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        interval: int = 1800,
+        min_interval: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        body = {
+            b"complete": 1965,
+            b"incomplete": 29,
+            b"interval": interval,
+            b"peers": b"",
+        }
+        if min_interval is not None:
+            body[b"min interval"] = min_interval
+        body = flatbencode.encode(body)
+        self._response = (
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain\r\n"
+            b"Content-Length: %d\r\n"
+            b"\r\n" % len(body)
+        ) + body
+        self.announces = 0
+        self.errors = 0
+        self._servers: list[asyncio.AbstractServer] = []
+
+    async def _handle(self, reader: asyncio.StreamReader, writer):
+        try:
+            while True:
+                # Announces are GET requests, so there is never a body:
+                try:
+                    await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                delay = self.latency + random.uniform(0, self.jitter)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if random.random() < self.error_rate:
+                    self.errors += 1
+                    writer.write(_ERROR)
+                else:
+                    self.announces += 1
+                    writer.write(self._response)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Starts listening on `host:port` and returns the bound port"""
+        server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        self._servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def aclose(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--trackers", type=int, default=1, help="Number of trackers to serve"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to each response"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Up to this many extra seconds added at random",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of announces answered with 503",
+    )
+    parser.add_argument(
+        "--interval", type=int, default=1800, help="Announce interval handed out"
+    )
+    parser.add_argument(
+        "--min-interval", type=int, default=None, help="Minimum announce interval"
+    )
+
+
+def from_arguments(args: argparse.Namespace) -> MockTracker:
+    return MockTracker(
+        args.latency, args.jitter, args.error_rate, args.interval, args.min_interval
+    )
+
+
+async def serve_forever(args: argparse.Namespace) -> None:
+    tracker = from_arguments(args)
+    for _ in range(args.trackers):
+        port = await tracker.serve(args.host, 0 if args.trackers > 1 else args.port)
+        print(f"Serving announces on http://{args.host}:{port}/announce", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await tracker.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, default=8080, help="Port used when serving one tracker"
+    )
+    add_arguments(parser)
+    try:
+        asyncio.run(serve_forever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 __version__ = "0.1.0"
 
-from .ghostseeder import ghostseed
+from .ghostseeder import ghostseed, ghostseed_profiles
+from .profiles import Profile, load_profiles
@@ -1,7 +1,11 @@
 import argparse
-import asyncio
 
-from ghostseeder import ghostseed
+from ghostseeder import ghostseed, ghostseed_profiles, load_profiles
+from ghostseeder.cache import default_cache_path
+from ghostseeder.logs import SUMMARY_INTERVAL, background_logging
+from ghostseeder.state import default_state_path
+from ghostseeder.supervisor import supervise
+from ghostseeder.transport import EVENT_LOOPS, TRANSPORTS, run
 
 
 def cli():
@@ -12,8 +16,12 @@ def cli():
         "-f",
         "--folder",
         type=str,
-        required=True,
-        help="A directory containing `.torrent` files. Torrent files should be from a private tracker and the announce url should contain your unique passkey",
+        help="A directory containing `.torrent` files. Torrent files should be from a private tracker and the announce url should contain your unique passkey. Required unless profiles are given with `--config`",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        help="INI file declaring several profiles to serve from one process, one section per profile with its own `folder`, `port`, `version` and `max_requests`. `-p`, `-v`, `-r` and `-s` apply to profiles that don't set them. Optional",
     )
     parser.add_argument(
         "-p",
@@ -35,7 +43,7 @@ def cli():
         "-r",
         "--max-requests",
         type=int,
-        help="Maximum number of allowed HTTP announces per second. Useful especially at startup to mitigate sending a large burst of announces at once.",
+        help="Maximum number of allowed HTTP announces per second to each tracker. Useful especially at startup to mitigate sending a large burst of announces at once.",
     )
     parser.add_argument(
         "-s",
@@ -43,11 +51,184 @@ def cli():
         type=int,
         help="Optional random seed used to make peer-id generation deterministic",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Maximum number of announces allowed to be in flight at once. Optional, defaults to `64`",
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=str,
+        default=default_cache_path(),
+        help="Where to cache metadata parsed from torrent files so unchanged files aren't re-read on every start. Optional, defaults to `~/.cache/ghostseeder/metainfo.sqlite`",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Parse every torrent file on startup without using the metadata cache",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        help="Maximum number of open connections to each tracker. Concurrency adapts to the tracker's latency up to this limit. Optional, defaults to `16`",
+    )
+    parser.add_argument(
+        "--no-watch",
+        action="store_true",
+        help="Don't watch the folder for added or removed torrent files while running",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on this port at `/metrics`. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the metrics endpoint listens on. Optional, defaults to `127.0.0.1`",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        default=default_state_path(),
+        help="Where to record when each torrent was last announced so that after a restart torrents resume at their remaining interval instead of all re-announcing at once. Optional, defaults to `~/.local/state/ghostseeder/announces.sqlite`",
+    )
+    parser.add_argument(
+        "--no-state",
+        action="store_true",
+        help="Announce every torrent right away on startup without using the recorded announce state",
+    )
+    parser.add_argument(
+        "--stop-timeout",
+        type=float,
+        help="Seconds allowed on shutdown for telling trackers we stopped seeding. Announces not sent by then are skipped. Optional, defaults to `8`",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes to spread torrents over. Limits set with `-r`, `-w` and `--max-connections` are shared by all workers. With metrics enabled, worker `i` also serves its own metrics on the metrics port + 1 + `i`. Optional, defaults to `1`",
+    )
+    parser.add_argument(
+        "--profile",
+        type=float,
+        metavar="SECONDS",
+        help="Record a CPU profile of the first SECONDS after startup and write it to `--profile-dir` as a pstats file. Send SIGUSR2 to toggle all diagnostics while running. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=str,
+        default=".",
+        help="Directory CPU profiles are written to. Optional, defaults to the current directory",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        type=float,
+        metavar="SECONDS",
+        help="Trace memory allocations and log the largest changes every SECONDS. Slows down every allocation while enabled. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--slow-callback",
+        type=float,
+        metavar="MILLISECONDS",
+        help="Warn about event loop callbacks that block for longer than MILLISECONDS. Runs the event loop in debug mode. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--admin-socket",
+        type=str,
+        help="Serve the admin API on this Unix socket, for adding and removing torrents, forcing announces, pausing trackers and changing rate limits while running. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--admin-port",
+        type=int,
+        help="Serve the admin API on this port on `127.0.0.1` instead of a Unix socket. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORTS,
+        default="httpx",
+        help="HTTP client to announce with. `stream` is a lighter client that pipelines announces over fewer connections and caches DNS lookups. Optional, defaults to `httpx`",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=EVENT_LOOPS,
+        default="asyncio",
+        help="Event loop to run on. `uvloop` is faster but must be installed separately, e.g. with `pip install ghostseeder[uvloop]`. Optional, defaults to `asyncio`",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        metavar="SECONDS",
+        help="Move each torrent's next announce back to the start of its tracker's current window of SECONDS, never sooner than the tracker's `min interval`, so announces go out in bursts over warm connections. Should be well below the announce interval. Optional, disabled by default",
+    )
+    parser.add_argument(
+        "--log-summary",
+        type=float,
+        default=SUMMARY_INTERVAL,
+        metavar="SECONDS",
+        help="Log how many torrents were announced to each tracker every SECONDS instead of a line per announce. Set to `0` to log every announce. Optional, defaults to `60`",
+    )
+    parser.add_argument(
+        "--log-json",
+        action="store_true",
+        help="Write logs as JSON lines",
+    )
     args = parser.parse_args()
+    if args.folder is None and args.config is None:
+        parser.error("one of the arguments -f/--folder --config is required")
+    if args.folder is not None and args.config is not None:
+        parser.error("argument -f/--folder: not allowed with argument --config")
 
-    asyncio.run(
-        ghostseed(args.folder, args.port, args.version, args.max_requests, args.seed)
+    if args.config is not None:
+        try:
+            profiles = load_profiles(
+                args.config,
+                port=args.port,
+                version=args.version,
+                max_requests=args.max_requests,
+                seed=args.seed,
+            )
+        except (OSError, ValueError) as exc:
+            parser.error(str(exc))
+        main = ghostseed_profiles
+        options = dict(profiles=profiles)
+    else:
+        main = ghostseed
+        options = dict(
+            filepath=args.folder,
+            port=args.port,
+            version=args.version,
+            max_requests=args.max_requests,
+            seed=args.seed,
+        )
+    options.update(
+        max_workers=args.workers,
+        cache_path=None if args.no_cache else args.cache_file,
+        max_connections=args.max_connections,
+        watch=not args.no_watch,
+        metrics_port=args.metrics_port,
+        metrics_host=args.metrics_host,
+        state_path=None if args.no_state else args.state_file,
+        stop_timeout=args.stop_timeout,
+        profile_duration=args.profile,
+        profile_dir=args.profile_dir,
+        tracemalloc_interval=args.tracemalloc,
+        slow_callback_duration=(
+            args.slow_callback / 1000 if args.slow_callback is not None else None
+        ),
+        admin_socket=args.admin_socket,
+        admin_port=args.admin_port,
+        transport=args.transport,
+        summary_interval=args.log_summary or None,
+        coalesce_window=args.coalesce,
     )
+    with background_logging(args.log_json):
+        if args.processes > 1:
+            run(supervise(args.processes, event_loop=args.loop, **options), args.loop)
+        else:
+            run(main(**options), args.loop)
 
 
 if __name__ == "__main__":
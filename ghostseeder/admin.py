@@ -0,0 +1,318 @@
+"""Local control API for changing what a running instance announces.
+
+A small JSON over HTTP interface served on a Unix socket or a localhost
+port. Torrents are identified by the path of their file or their hex
+infohash, which must be url encoded if it contains slashes. Every change
+applies to the torrents in memory, nothing is reloaded:
+
+    GET    /torrents                       state of every loaded torrent
+    GET    /torrents/<torrent>             state of one torrent
+    POST   /torrents                       {"path": ...} loads a torrent file,
+                                           {"infohash": ...} restores a torrent
+                                           removed through this API
+    DELETE /torrents/<torrent>             stops announcing a torrent
+    POST   /torrents/<torrent>/announce    announces a torrent right away
+    GET    /trackers                       state of every tracker
+    POST   /trackers/pause                 {"tracker": "https://host:port"}
+    POST   /trackers/resume                {"tracker": "https://host:port"}
+    POST   /trackers/rate                  {"rate": 2, "tracker": ...} changes
+                                           the announces per second allowed to
+                                           one tracker, or to all if omitted
+
+For example:
+
+    $ curl --unix-socket admin.sock http://localhost/torrents
+    $ curl --unix-socket admin.sock -X POST -d '{"rate": 5}' \\
+        -H 'Content-Type: application/json' http://localhost/trackers/rate
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import stat
+from typing import TYPE_CHECKING, Callable, Optional
+from urllib.parse import unquote
+
+import flatbencode
+
+if TYPE_CHECKING:
+    from .ghostseeder import AnnounceScheduler, TorrentSpoofer
+    from .tracker import Tracker
+
+# Largest request body accepted:
+MAX_BODY_SIZE = 64 * 1024
+
+_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+}
+
+# Names a browser could be tricked into sending requests to this API with,
+# through DNS rebinding, are not among these:
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "[::1]"}
+
+
+class AdminError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def torrent_state(torrent: "TorrentSpoofer", due_in: Optional[float]) -> dict:
+    """due_in: Seconds until the torrent's next announce if scheduled"""
+    return {
+        "infohash": torrent.infohash,
+        "path": str(torrent.filepath),
+        # Only the host, announce urls contain passkeys:
+        "tracker": torrent.tracker_key,
+        "announces": torrent.num_announces,
+        "next_due": None if due_in is None else round(due_in, 1),
+        "last_interval": torrent.last_interval,
+        "failures": torrent.failures,
+        "last_error": None if torrent.last_error is None else repr(torrent.last_error),
+    }
+
+
+def tracker_state(tracker: "Tracker") -> dict:
+    return {
+        "tracker": tracker.key,
+        "paused": tracker.paused,
+        "rate": tracker.limit.rate,
+        "waiting": len(tracker.due),
+        "in_flight": tracker.concurrency.in_flight,
+        "concurrency": int(tracker.concurrency.limit),
+        "breaker": tracker.breaker.state.value,
+    }
+
+
+class AdminAPI:
+    def __init__(
+        self,
+        scheduler: "AnnounceScheduler",
+        load: Callable[[str], "TorrentSpoofer"],
+    ):
+        """load: Creates the torrent for a torrent file path"""
+        self.scheduler = scheduler
+        self.load = load
+        # Torrents removed through the API by hex infohash, so they can be
+        # restored without their file:
+        self.removed: dict[str, "TorrentSpoofer"] = {}
+
+    def handle(self, method: str, path: str, body: bytes) -> tuple[int, object]:
+        """Runs a request and returns its status code and JSON response"""
+        parts = path.split("?", 1)[0].strip("/").split("/", 1)
+        resource, rest = parts[0], parts[1] if len(parts) > 1 else ""
+        if resource == "torrents":
+            if not rest:
+                if method == "GET":
+                    return 200, self.list_torrents()
+                if method == "POST":
+                    return self.add_torrent(_parse_body(body))
+            elif rest.endswith("/announce"):
+                if method == "POST":
+                    return 200, self.announce(unquote(rest[: -len("/announce")]))
+            elif method == "GET":
+                torrent = self._find(unquote(rest))
+                return 200, torrent_state(torrent, self._due_time(torrent))
+            elif method == "DELETE":
+                return 200, self.remove_torrent(unquote(rest))
+            raise AdminError(405, f"{method} is not supported on {path}")
+        if resource == "trackers":
+            if not rest and method == "GET":
+                return 200, [
+                    tracker_state(tracker) for tracker in self.scheduler.trackers
+                ]
+            if rest in ("pause", "resume", "rate") and method == "POST":
+                return 200, self.change_tracker(rest, _parse_body(body))
+            raise AdminError(405, f"{method} is not supported on {path}")
+        raise AdminError(404, f"No such resource: {path}")
+
+    def _find(self, key: str) -> "TorrentSpoofer":
+        torrent = self.scheduler.find(key)
+        if torrent is None:
+            raise AdminError(404, f"No torrent with path or infohash '{key}'")
+        return torrent
+
+    def _due_time(self, torrent: "TorrentSpoofer") -> Optional[float]:
+        due = self.scheduler.due_times().get(torrent)
+        return None if due is None else due - self.scheduler.clock()
+
+    def list_torrents(self) -> list[dict]:
+        due_times = self.scheduler.due_times()
+        now = self.scheduler.clock()
+        return [
+            torrent_state(
+                torrent,
+                due_times[torrent] - now if torrent in due_times else None,
+            )
+            for torrent in self.scheduler.torrents.values()
+        ]
+
+    def add_torrent(self, request: dict) -> tuple[int, dict]:
+        if "infohash" in request:
+            torrent = self.removed.get(str(request["infohash"]).lower())
+            if torrent is None:
+                raise AdminError(404, "No removed torrent with that infohash")
+            # The tracker was told we stopped, so start over:
+            torrent.num_announces = 0
+        elif "path" in request:
+            try:
+                torrent = self.load(str(request["path"]))
+            except (OSError, flatbencode.DecodingError) as exc:
+                raise AdminError(400, f"Unable to read torrent file: {exc}")
+        else:
+            raise AdminError(400, "Expected a `path` or an `infohash`")
+        existing = self.scheduler.torrents.get(torrent.filepath)
+        if existing is not None and existing.infohash == torrent.infohash:
+            raise AdminError(409, "Torrent is already loaded")
+        self.scheduler.add(torrent)
+        if self.scheduler.torrents.get(torrent.filepath) is not torrent:
+            raise AdminError(409, "Torrent isn't in this process's shard")
+        # Only forgotten once it's announced again, so a rejected restore can
+        # be retried:
+        self.removed.pop(torrent.infohash, None)
+        logging.info(f"Torrent added through the admin API: {torrent.filepath}")
+        return 201, torrent_state(torrent, self._due_time(torrent))
+
+    def remove_torrent(self, key: str) -> dict:
+        torrent = self.scheduler.remove(self._find(key).filepath)
+        self.removed[torrent.infohash] = torrent
+        logging.info(f"Torrent removed through the admin API: {torrent.filepath}")
+        return torrent_state(torrent, None)
+
+    def announce(self, key: str) -> dict:
+        torrent = self._find(key)
+        if not self.scheduler.announce_now(torrent):
+            raise AdminError(409, "Torrent is already being announced")
+        return torrent_state(torrent, self._due_time(torrent))
+
+    def change_tracker(self, action: str, request: dict) -> list[dict]:
+        key = request.get("tracker")
+        if key is None and action == "rate":
+            trackers = list(self.scheduler.trackers)
+        elif key is None:
+            raise AdminError(400, "Expected a `tracker`")
+        else:
+            tracker = self.scheduler.trackers.trackers.get(str(key))
+            if tracker is None:
+                raise AdminError(404, f"No tracker '{key}'")
+            trackers = [tracker]
+
+        if action == "rate":
+            rate = request.get("rate")
+            if not isinstance(rate, (int, float)) or rate <= 0:
+                raise AdminError(400, "`rate` must be a positive number")
+            if key is None:
+                self.scheduler.trackers.set_max_requests(rate)
+            else:
+                tracker.limit.rate = rate
+            logging.info(f"Rate limit of {key or 'all trackers'} set to {rate}/sec")
+        for tracker in trackers:
+            if action == "pause":
+                tracker.resumed.clear()
+                logging.info(f"Announces to {tracker.key} paused")
+            elif action == "resume":
+                tracker.resumed.set()
+                logging.info(f"Announces to {tracker.key} resumed")
+        return [tracker_state(tracker) for tracker in trackers]
+
+
+def _parse_body(body: bytes) -> dict:
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError as exc:
+        raise AdminError(400, f"Invalid JSON: {exc}")
+    if not isinstance(request, dict):
+        raise AdminError(400, "Expected a JSON object")
+    return request
+
+
+def _check_headers(headers: dict[str, str], length: int) -> None:
+    """Rejects requests a web page may have made: those to a host other than
+    localhost, from another origin, or with a body that isn't JSON, which
+    browsers can send without asking the server first
+    """
+    host = headers.get("host", "")
+    if host.rsplit(":", 1)[0] not in _LOCAL_HOSTS and host not in _LOCAL_HOSTS:
+        raise AdminError(403, f"Host must be localhost, not '{host}'")
+    if "origin" in headers:
+        raise AdminError(403, "Requests from web pages are not allowed")
+    content_type = headers.get("content-type", "").split(";", 1)[0].strip()
+    if length and content_type.lower() != "application/json":
+        raise AdminError(415, "Content-Type must be application/json")
+
+
+async def _handle(api: AdminAPI, reader: asyncio.StreamReader, writer) -> None:
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = request_line.split(" ", 2)
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        try:
+            _check_headers(headers, length)
+            if length > MAX_BODY_SIZE:
+                raise AdminError(413, "Request body too large")
+            body = await reader.readexactly(length)
+            status, response = api.handle(method, path, body)
+        except AdminError as exc:
+            status, response = exc.status, {"error": str(exc)}
+        payload = json.dumps(response, indent=2).encode() + b"\n"
+        writer.write(
+            b"HTTP/1.1 %d %s\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Content-Length: %d\r\n"
+            b"Connection: close\r\n"
+            b"\r\n" % (status, _REASONS[status].encode(), len(payload))
+        )
+        writer.write(payload)
+        await writer.drain()
+    except (
+        asyncio.IncompleteReadError,
+        asyncio.LimitOverrunError,
+        ConnectionError,
+        ValueError,
+    ):
+        # Malformed request or the client went away:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_admin(
+    api: AdminAPI,
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: Optional[int] = None,
+) -> asyncio.AbstractServer:
+    """Serves `api` on the Unix socket at `socket_path`, which only the
+    current user may connect to, or else on `host:port`
+    """
+    handler = functools.partial(_handle, api)
+    if socket_path is not None:
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            # Left behind by an instance that didn't shut down cleanly:
+            os.unlink(socket_path)
+        # Created readable and writable only by us, rather than changed
+        # after binding when others could already have connected:
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(handler, socket_path)
+        finally:
+            os.umask(umask)
+        logging.info(f"Serving the admin API on unix socket '{socket_path}'")
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        logging.info(f"Serving the admin API on http://{host}:{port}")
+    return server
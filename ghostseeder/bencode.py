@@ -0,0 +1,247 @@
+"""Targeted bencode scanning for torrent metainfo files.
+
+`flatbencode.decode` builds the full object tree for a torrent, including
+the `pieces` blob which is by far the largest part of the file. Ghostseeder
+only ever needs a handful of fields plus the SHA1 of the `info` dictionary,
+so this module walks the raw bytes instead: byte strings that aren't needed
+are skipped by jumping over their declared length and the infohash is
+computed directly over the original byte span of `info`.
+
+Hashing the original bytes (rather than re-encoding a decoded dict) also
+means the infohash matches what the tracker computed when the torrent was
+uploaded, even if the file isn't canonically encoded.
+
+Tracker responses are scanned the same way, reading only the keys ghostseeder
+acts on and skipping over `peers` without copying it.
+
+The scanner works over anything that supports `find`, integer indexing and
+slicing to bytes, i.e. `bytes` or `mmap.mmap`.
+"""
+
+import hashlib
+import mmap
+import os
+from typing import NamedTuple, Optional, Union
+
+from flatbencode import DecodingError
+
+Buffer = Union[bytes, mmap.mmap]
+
+_INTEGER = ord("i")
+_LIST = ord("l")
+_DICT = ord("d")
+_END = ord("e")
+_DIGITS = range(ord("0"), ord("9") + 1)
+# Deepest nesting `decode` accepts. Only small values like `announce-list`
+# are decoded, so anything deeper is malformed or malicious:
+MAX_DECODE_DEPTH = 32
+
+
+class Metainfo(NamedTuple):
+    infohash: bytes
+    announce: str
+    announce_list: list[list[str]]
+    name: str
+
+
+class AnnounceResponse(NamedTuple):
+    interval: Optional[int] = None
+    min_interval: Optional[int] = None
+    failure_reason: Optional[str] = None
+    warning_message: Optional[str] = None
+    # Number of seeders and leechers:
+    complete: Optional[int] = None
+    incomplete: Optional[int] = None
+
+
+_RESPONSE_INTEGERS = {
+    b"interval": "interval",
+    b"min interval": "min_interval",
+    b"complete": "complete",
+    b"incomplete": "incomplete",
+}
+_RESPONSE_STRINGS = {
+    b"failure reason": "failure_reason",
+    b"warning message": "warning_message",
+}
+
+
+def _string_bounds(buf: Buffer, pos: int) -> tuple[int, int]:
+    """Returns the (start, end) offsets of the byte string beginning at `pos`"""
+    colon = buf.find(b":", pos)
+    if colon < 0:
+        raise DecodingError(f"Unterminated string length at offset {pos}")
+    try:
+        length = int(buf[pos:colon])
+    except ValueError:
+        raise DecodingError(f"Invalid string length at offset {pos}") from None
+    start = colon + 1
+    end = start + length
+    if length < 0 or end > len(buf):
+        raise DecodingError(f"String at offset {pos} runs past end of data")
+    return start, end
+
+
+def _integer_end(buf: Buffer, pos: int) -> int:
+    end = buf.find(b"e", pos)
+    if end < 0:
+        raise DecodingError(f"Unterminated integer at offset {pos}")
+    return end
+
+
+def skip(buf: Buffer, pos: int) -> int:
+    """Returns the offset just past the bencoded value starting at `pos`
+    without materializing it
+    """
+    # Iterative, so no amount of nesting (e.g. in a hostile tracker response)
+    # can exhaust the stack. Only the number of open lists and dictionaries
+    # needs to be tracked:
+    depth = 0
+    while True:
+        token = buf[pos]
+        if token in _DIGITS:
+            pos = _string_bounds(buf, pos)[1]
+        elif token == _INTEGER:
+            pos = _integer_end(buf, pos) + 1
+        elif token == _LIST or token == _DICT:
+            depth += 1
+            pos += 1
+        elif token == _END and depth:
+            depth -= 1
+            pos += 1
+        else:
+            raise DecodingError(f"Unexpected token {chr(token)!r} at offset {pos}")
+        if not depth:
+            return pos
+
+
+def decode(buf: Buffer, pos: int, depth: int = 0) -> tuple[object, int]:
+    """Fully decodes the (small) bencoded value starting at `pos`. Returns
+    the value and the offset just past it
+    """
+    if depth > MAX_DECODE_DEPTH:
+        raise DecodingError(f"Value nested too deeply at offset {pos}")
+    token = buf[pos]
+    if token in _DIGITS:
+        start, end = _string_bounds(buf, pos)
+        return buf[start:end], end
+    if token == _INTEGER:
+        end = _integer_end(buf, pos)
+        try:
+            return int(buf[pos + 1 : end]), end + 1
+        except ValueError:
+            raise DecodingError(f"Invalid integer at offset {pos}") from None
+    if token == _LIST:
+        items = []
+        pos += 1
+        while buf[pos] != _END:
+            item, pos = decode(buf, pos, depth + 1)
+            items.append(item)
+        return items, pos + 1
+    if token == _DICT:
+        items = {}
+        pos += 1
+        while buf[pos] != _END:
+            key, pos = decode(buf, pos, depth + 1)
+            items[key], pos = decode(buf, pos, depth + 1)
+        return items, pos + 1
+    raise DecodingError(f"Unexpected token {chr(token)!r} at offset {pos}")
+
+
+def iter_dict(buf: Buffer, pos: int):
+    """Yields `(key, value_offset)` for each entry of the dictionary starting
+    at `pos`. Callers must not resume the iterator after consuming a value;
+    values are skipped automatically
+    """
+    if buf[pos] != _DICT:
+        raise DecodingError(f"Expected a dictionary at offset {pos}")
+    pos += 1
+    while buf[pos] != _END:
+        start, end = _string_bounds(buf, pos)
+        yield buf[start:end], end
+        pos = skip(buf, end)
+
+
+def _find_name(buf: Buffer, pos: int) -> str:
+    for key, value_pos in iter_dict(buf, pos):
+        if key == b"name":
+            start, end = _string_bounds(buf, value_pos)
+            return buf[start:end].decode()
+    raise DecodingError("Torrent info dictionary has no `name`")
+
+
+def scan_metainfo(buf: Buffer) -> Metainfo:
+    """Extracts the fields ghostseeder needs from a bencoded torrent file"""
+    announce = None
+    announce_list: list[list[str]] = []
+    info_span = None
+    name = None
+    try:
+        for key, pos in iter_dict(buf, 0):
+            if key == b"announce":
+                value, _ = decode(buf, pos)
+                announce = value.decode()
+            elif key == b"announce-list":
+                value, _ = decode(buf, pos)
+                announce_list = [[url.decode() for url in tier] for tier in value]
+            elif key == b"info":
+                info_span = (pos, skip(buf, pos))
+                name = _find_name(buf, pos)
+    except (IndexError, TypeError, AttributeError, UnicodeDecodeError) as exc:
+        raise DecodingError(f"Malformed torrent metainfo: {exc}") from None
+
+    if info_span is None:
+        raise DecodingError("Torrent has no `info` dictionary")
+    if announce is None:
+        if not announce_list or not announce_list[0]:
+            raise DecodingError("Torrent has no announce url")
+        announce = announce_list[0][0]
+
+    start, end = info_span
+    with memoryview(buf) as view, view[start:end] as info:
+        infohash = hashlib.sha1(info).digest()
+    return Metainfo(infohash, announce, announce_list, name)
+
+
+def read_metainfo(filepath: Union[str, os.PathLike]) -> Metainfo:
+    """Memory-maps a `.torrent` file and scans it without reading the whole
+    file into memory
+    """
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise DecodingError(f"Empty torrent file: {filepath}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return scan_metainfo(buf)
+
+
+def read_name(filepath: Union[str, os.PathLike]) -> str:
+    """Reads only the torrent's name from a `.torrent` file"""
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise DecodingError(f"Empty torrent file: {filepath}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            try:
+                for key, pos in iter_dict(buf, 0):
+                    if key == b"info":
+                        return _find_name(buf, pos)
+            except (IndexError, TypeError, AttributeError, UnicodeDecodeError) as exc:
+                raise DecodingError(f"Malformed torrent metainfo: {exc}") from None
+    raise DecodingError("Torrent has no `info` dictionary")
+
+
+def scan_announce_response(buf: Buffer) -> AnnounceResponse:
+    """Reads the fields ghostseeder acts on from a bencoded tracker response.
+    Everything else, notably the peer list, is skipped without being decoded
+    """
+    fields = {}
+    try:
+        for key, pos in iter_dict(buf, 0):
+            if key in _RESPONSE_INTEGERS and buf[pos] == _INTEGER:
+                fields[_RESPONSE_INTEGERS[key]], _ = decode(buf, pos)
+            elif key in _RESPONSE_STRINGS and buf[pos] in _DIGITS:
+                start, end = _string_bounds(buf, pos)
+                value = buf[start:end].decode(errors="replace")
+                fields[_RESPONSE_STRINGS[key]] = value
+    except IndexError:
+        raise DecodingError("Truncated tracker response") from None
+    return AnnounceResponse(**fields)
@@ -0,0 +1,125 @@
+"""On-disk cache of parsed torrent metainfo.
+
+Torrent files almost never change once they're in the folder, so the fields
+ghostseeder extracts from them are stored in a SQLite database keyed by the
+file's path, size and modification time. Unchanged files are loaded straight
+from the cache on the next start instead of being parsed again.
+"""
+import json
+import logging
+import os
+import sqlite3
+from typing import Iterable, Optional
+
+from .bencode import Metainfo
+
+# Bump whenever the table layout or the meaning of a column changes so stale
+# caches are discarded rather than misread:
+SCHEMA_VERSION = 1
+
+
+def default_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "ghostseeder", "metainfo.sqlite")
+
+
+class MetainfoCache:
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # Worker processes share the database, so let readers and a writer
+        # proceed concurrently and wait out each other's write locks:
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS metainfo")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS metainfo (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                infohash BLOB NOT NULL,
+                announce TEXT NOT NULL,
+                announce_list TEXT NOT NULL,
+                name TEXT NOT NULL
+            )"""
+        )
+        self.connection.commit()
+
+        # The whole table is read once up front; lookups then never touch disk:
+        self._entries = {
+            path: (
+                size,
+                mtime_ns,
+                Metainfo(infohash, announce, json.loads(tiers), name),
+            )
+            for path, size, mtime_ns, infohash, announce, tiers, name in (
+                self.connection.execute("SELECT * FROM metainfo")
+            )
+        }
+        logging.info(f"Loaded {len(self._entries)} cached torrents from '{path}'")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __enter__(self) -> "MetainfoCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get(self, path: str, size: int, mtime_ns: int) -> Optional[Metainfo]:
+        """Returns the cached metainfo for `path` if the file hasn't changed"""
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None or entry[:2] != (size, mtime_ns):
+            return None
+        return entry[2]
+
+    def put_many(self, entries: Iterable[tuple[str, int, int, Metainfo]]) -> None:
+        """Stores `(path, size, mtime_ns, metainfo)` entries"""
+        rows = []
+        for path, size, mtime_ns, metainfo in entries:
+            path = os.path.abspath(path)
+            self._entries[path] = (size, mtime_ns, metainfo)
+            rows.append(
+                (
+                    path,
+                    size,
+                    mtime_ns,
+                    metainfo.infohash,
+                    metainfo.announce,
+                    json.dumps(metainfo.announce_list),
+                    metainfo.name,
+                )
+            )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO metainfo VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.connection.commit()
+
+    def evict_missing(self, folderpath: str, seen: Iterable[str]) -> int:
+        """Deletes entries under `folderpath` for files that weren't `seen`
+        during the last scan of that folder. Returns the number evicted
+        """
+        prefix = os.path.join(os.path.abspath(folderpath), "")
+        seen = set(os.path.abspath(path) for path in seen)
+        missing = [
+            path
+            for path in self._entries
+            if path.startswith(prefix) and path not in seen
+        ]
+        for path in missing:
+            del self._entries[path]
+        self.connection.executemany(
+            "DELETE FROM metainfo WHERE path = ?", ((path,) for path in missing)
+        )
+        self.connection.commit()
+        return len(missing)
@@ -6,26 +6,82 @@ with few seeders. But trackers don't have an explicit way to verify you
 actually have the files
 """
 import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import enum
+import functools
 import hashlib
+import heapq
+import itertools
 import logging
 import os
 import random
+import signal
 import ssl
 import string
-from typing import Optional
-from urllib.parse import urlencode
+import time
+import zlib
+from typing import (
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Optional,
+    Union,
+)
+from urllib.parse import quote_plus
 
 import flatbencode
 import httpx
 import semver
 from asynciolimiter import StrictLimiter
 
+from . import logs, metrics
+from .admin import AdminAPI, serve_admin
+from .bencode import (
+    AnnounceResponse,
+    Metainfo,
+    read_metainfo,
+    read_name,
+    scan_announce_response,
+)
+from .cache import MetainfoCache
+from .profiles import Profile
+from .profiling import Diagnostics
+from .state import AnnounceJournal
+from .tracker import (
+    MAX_CONNECTIONS_PER_TRACKER,
+    BreakerState,
+    Tracker,
+    TrackerClients,
+    TrackerPool,
+    tracker_key,
+)
+from .transport import StreamClient, StreamResponse
+from .udp import UDPTrackerClient, UDPTrackerError
+from .watch import InotifyWatcher, PollingWatcher, scan_torrent_files, watch_folder
+
 DEBUG = False
 MAX_REQUESTS_PER_SECOND = 1
 # Default time in between announces unless tracker provides an
 # interval (3600 seconds = 1 hour):
 DEFAULT_SLEEP_INTERVAL = 3600
+# Failed announces are retried with exponential backoff starting from
+# this many seconds, up to `DEFAULT_SLEEP_INTERVAL`:
+MIN_RETRY_INTERVAL = 60
+# Maximum number of announces allowed to be in flight at once. Bounds the
+# number of worker tasks regardless of how many torrents are loaded:
+MAX_CONCURRENT_ANNOUNCES = 64
+# Number of torrent files handed to a parser process at a time when
+# loading a folder. Small enough that the first announces go out quickly:
+PARSE_BATCH_SIZE = 32
+# Seconds allowed for sending the final `stopped` announces on shutdown.
+# Comfortably inside the 10 second grace period of `docker stop`:
+STOP_TIMEOUT = 8
+# Number of torrent names kept in memory after being read for logging:
+NAME_CACHE_SIZE = 1024
 
 
 logging.basicConfig(
@@ -56,10 +112,11 @@ def generate_peer_id(
     # But this is complicated to deal with so artificially prevent any 2-digit numbers:
     if version.major > 9 or version.minor > 9 or version.patch > 9:
         raise ValueError("Version numbers must be single digits only: {}")
-    if seed is not None:
-        random.seed(seed)
+    # A seeded generator of its own, so the jitter and shuffles drawn from
+    # `random` later on don't all become deterministic too:
+    rng = random.Random(seed) if seed is not None else random
     random_hash = "".join(
-        random.choices(string.ascii_uppercase + string.ascii_lowercase, k=12)
+        rng.choices(string.ascii_uppercase + string.ascii_lowercase, k=12)
     )
     peer_id = (
         f"-{client.value}{version.major}{version.minor}{version.patch}0-{random_hash}"
@@ -79,86 +136,379 @@ class TrackerRequestEvent(enum.Enum):
     COMPLETED = "completed"
 
 
+def event_label(event: Optional[TrackerRequestEvent]) -> str:
+    """Names the event of an announce in metrics. Regular announces have none"""
+    return "regular" if event is None else event.value
+
+
+def find_torrent_files(folderpath: str) -> Iterator[str]:
+    """Recursively yield the path of every `.torrent` file under `folderpath`"""
+    for entry in scan_torrent_files(folderpath):
+        yield entry.path
+
+
+def read_metainfo_batch(
+    filepaths: list[str],
+) -> list[tuple[str, Optional[Metainfo], Optional[str]]]:
+    """Parse a batch of torrent files. Runs inside a worker process so errors
+    are returned as strings alongside the filepath instead of being raised
+    """
+    results = []
+    for filepath in filepaths:
+        try:
+            results.append((filepath, read_metainfo(filepath), None))
+        except (OSError, flatbencode.DecodingError) as exc:
+            results.append((filepath, None, str(exc)))
+    return results
+
+
+def shard_of(infohash: bytes, num_shards: int) -> int:
+    """Assigns a torrent to one of `num_shards` shards. Infohashes are SHA1
+    digests, so their leading bytes are already uniformly distributed
+    """
+    return int.from_bytes(infohash[:8], "big") % num_shards
+
+
+class TrackerFailure(Exception):
+    """The tracker responded but rejected the announce with a `failure reason`"""
+
+
+class AnnounceTarget:
+    """The parts of an announce url that are the same for every torrent
+    announcing to it. Shared through `announce_target()`, so its health is
+    shared too: once an announce to the url fails without a response, every
+    torrent skips it for `MIN_RETRY_INTERVAL` seconds if it has another one
+    """
+
+    __slots__ = ("url", "tracker_key", "base", "query", "down_until")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.tracker_key = tracker_key(url)
+        # The url is parsed only once and announces only swap in the query
+        # string. Any query the url already has (e.g. a passkey) is kept:
+        self.base = httpx.URL(url)
+        self.query = f"{self.base.query.decode()}&" if self.base.query else ""
+        # Time on the scheduler's clock until which the url is considered down:
+        self.down_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"AnnounceTarget({self.url!r})"
+
+
+class AnnounceTiers:
+    """The tiers of announce urls of a torrent (BEP 12). Urls are shuffled
+    within each tier and one that gets a response is moved to the front of
+    its tier. Shared by every torrent with the same `announce-list`, so the
+    order learned by one torrent is used by all of them
+    """
+
+    __slots__ = ("tiers",)
+
+    def __init__(self, tiers: Iterable[Iterable[str]]):
+        self.tiers: list[list[AnnounceTarget]] = []
+        for tier in tiers:
+            targets = [announce_target(url) for url in tier]
+            random.shuffle(targets)
+            self.tiers.append(targets)
+
+    def __iter__(self) -> Iterator[AnnounceTarget]:
+        return itertools.chain.from_iterable(self.tiers)
+
+    def __len__(self) -> int:
+        return sum(len(tier) for tier in self.tiers)
+
+    def select(self, usable: Callable[[AnnounceTarget], bool]) -> AnnounceTarget:
+        """Returns the first url in tier order that is `usable`, or the very
+        first url if none are
+        """
+        return next((target for target in self if usable(target)), self.tiers[0][0])
+
+    def promote(self, target: AnnounceTarget) -> None:
+        for tier in self.tiers:
+            if target in tier:
+                if tier[0] is not target:
+                    tier.remove(target)
+                    tier.insert(0, target)
+                return
+
+
+# Interned announce urls, announce-list tiers, request headers, encoded
+# peer ids and UDP announce keys. Every torrent on a tracker points to the
+# same objects instead of its own copies:
+_targets: dict[str, AnnounceTarget] = {}
+_tiers: dict[tuple, AnnounceTiers] = {}
+_headers: dict[str, dict[str, str]] = {}
+_peer_ids: dict[str, str] = {}
+_announce_keys: dict[str, int] = {}
+
+
+def announce_target(url: str) -> AnnounceTarget:
+    target = _targets.get(url)
+    if target is None:
+        target = _targets[url] = AnnounceTarget(url)
+    return target
+
+
+def quoted_peer_id(peer_id: str) -> str:
+    quoted = _peer_ids.get(peer_id)
+    if quoted is None:
+        quoted = _peer_ids[peer_id] = quote_plus(peer_id)
+    return quoted
+
+
+def announce_key(peer_id: str) -> int:
+    """The key sent with UDP announces as `peer_id`, one per peer id so that
+    profiles sharing a client aren't tied together by it
+    """
+    key = _announce_keys.get(peer_id)
+    if key is None:
+        key = _announce_keys[peer_id] = random.getrandbits(32)
+    return key
+
+
+def announce_tiers(announce: str, announce_list: list[list[str]]) -> AnnounceTiers:
+    """Per BEP 12 `announce` is only used if there is no `announce-list`"""
+    key = tuple(tuple(tier) for tier in announce_list if tier) or ((announce,),)
+    tiers = _tiers.get(key)
+    if tiers is None:
+        tiers = _tiers[key] = AnnounceTiers(key)
+    return tiers
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def read_torrent_name(filepath: str) -> str:
+    """Names aren't kept in memory but read from the torrent file when a
+    message that needs one is logged. Falls back to the file name
+    """
+    try:
+        return read_name(filepath)
+    except (OSError, flatbencode.DecodingError):
+        return os.path.basename(filepath)
+
+
 class TorrentSpoofer:
-    def __init__(self, filepath: str, peer_id: str, useragent: str):
+    # Hundreds of thousands of these can be loaded at once, so each keeps
+    # only what is unique to it. Everything else is shared or derived
+    __slots__ = (
+        "filepath",
+        "peer_id",
+        "useragent",
+        "encoded_infohash",
+        "quoted_infohash",
+        "quoted_peer_id",
+        "target",
+        "tiers",
+        "num_announces",
+        "last_error",
+        "failures",
+        "last_interval",
+        "min_interval",
+    )
+
+    def __init__(
+        self,
+        filepath: str,
+        peer_id: str,
+        useragent: str,
+        metainfo: Optional[Metainfo] = None,
+    ):
         self.filepath = filepath
-        with open(filepath, "rb") as f:
-            contents = f.read()
-        torrent_info = flatbencode.decode(contents)
+        if metainfo is None:
+            metainfo = read_metainfo(filepath)
         self.peer_id = peer_id
         self.useragent = useragent
-        self.announce_url = torrent_info[b"announce"].decode()
-        self.name = torrent_info[b"info"][b"name"].decode()
-        self.infohash = hashlib.sha1(
-            flatbencode.encode(torrent_info[b"info"])
-        ).hexdigest()
-        self.encoded_infohash = bytes.fromhex(self.infohash)
+        self.encoded_infohash = metainfo.infohash
+        # Url-encoded once instead of on every announce. The peer id is the
+        # same for every torrent, so they all share one copy of it:
+        self.quoted_infohash = quote_plus(metainfo.infohash)
+        self.quoted_peer_id = quoted_peer_id(peer_id)
+        self.tiers = announce_tiers(metainfo.announce, metainfo.announce_list)
+        # The url currently announced to. Picked from `tiers` by the scheduler
+        self.target = self.tiers.tiers[0][0]
         self.num_announces = 0
+        self.last_error: Optional[Exception] = None
+        self.failures = 0
+        # Seconds the last regular announce asked us to wait:
+        self.last_interval: Optional[float] = None
+        # The tracker's `min interval` from the last successful announce:
+        self.min_interval: Optional[int] = None
+
+    def __str__(self) -> str:
+        # Lets log calls pass the torrent itself so its name is only read
+        # if the message is emitted
+        return self.name
+
+    @property
+    def name(self) -> str:
+        return read_torrent_name(self.filepath)
+
+    @property
+    def infohash(self) -> str:
+        return self.encoded_infohash.hex()
+
+    @property
+    def announce_url(self) -> str:
+        return self.target.url
+
+    @property
+    def announce_list(self) -> list[list[str]]:
+        return [[target.url for target in tier] for tier in self.tiers.tiers]
+
+    @property
+    def tracker_key(self) -> str:
+        return self.target.tracker_key
+
+    @property
+    def headers(self) -> dict[str, str]:
+        headers = _headers.get(self.useragent)
+        if headers is None:
+            headers = _headers[self.useragent] = {"User-Agent": self.useragent}
+        return headers
 
     async def announce(
         self,
-        client: httpx.AsyncClient,
+        client: Union[httpx.AsyncClient, StreamClient, UDPTrackerClient],
         port: int,
         uploaded: int = 0,
         downloaded: int = 0,
         left: int = 0,
         compact: bool = True,
         event: Optional[TrackerRequestEvent] = None,
-    ) -> httpx.Response:
-        headers = {"User-Agent": self.useragent}
-        params = {
-            "info_hash": self.encoded_infohash,
-            "peer_id": self.peer_id,
-            "uploaded": uploaded,
-            "downloaded": downloaded,
-            "left": left,
-            # This is a boolean that is sent as '0' or '1'.
-            # See: https://wiki.theory.org/BitTorrentSpecification#Tracker_Request_Parameters
-            "compact": int(compact),
-            "port": port,
-        }
+    ) -> Union[httpx.Response, StreamResponse, AnnounceResponse]:
         if event is not None:
             assert isinstance(event, TrackerRequestEvent)
-            params["event"] = event.value
+        metrics.ANNOUNCES.labels(self.tracker_key, event_label(event)).inc()
+        # Log calls on this path pass arguments instead of f-strings so the
+        # message is only formatted if it is actually emitted
+        if isinstance(client, UDPTrackerClient):
+            logs.ANNOUNCES.info("Announcing %s", self)
+            start = time.monotonic()
+            response = await client.announce(
+                self.announce_url,
+                self.encoded_infohash,
+                self.peer_id,
+                port,
+                uploaded,
+                downloaded,
+                left,
+                event.value if event is not None else None,
+                announce_key(self.peer_id),
+            )
+            metrics.ANNOUNCE_LATENCY.labels(self.tracker_key).observe(
+                time.monotonic() - start
+            )
+            logs.ANNOUNCES.debug(
+                "For %s announcement (%s) server returned response: %s",
+                self,
+                self.announce_url,
+                response,
+            )
+            self.num_announces += 1
+            return response
 
+        # `compact` is a boolean that is sent as '0' or '1'.
+        # See: https://wiki.theory.org/BitTorrentSpecification#Tracker_Request_Parameters
         # I'm manually urlencoding the query parameters because httpx doesn't
         # seem to encode the infohash bytestring correctly...
-        url = f"{self.announce_url}?{urlencode(params)}"
-        logging.info(f"Announcing {self.name}")
-        response = await client.get(url, headers=headers)
-        logging.debug(
-            f"For {self.name} announcement ({url}) server returned response:\n\n {response.content}"
+        query = (
+            f"{self.target.query}info_hash={self.quoted_infohash}"
+            f"&peer_id={self.quoted_peer_id}&uploaded={uploaded:d}&downloaded={downloaded:d}"
+            f"&left={left:d}&compact={compact:d}&port={port:d}"
+        )
+        if event is not None:
+            query += f"&event={event.value}"
+        # Much cheaper than having httpx parse and re-encode a full url string:
+        url = self.target.base.copy_with(query=query.encode())
+
+        logs.ANNOUNCES.info("Announcing %s", self)
+        start = time.monotonic()
+        response = await client.get(url, headers=self.headers)
+        metrics.ANNOUNCE_LATENCY.labels(self.tracker_key).observe(
+            time.monotonic() - start
+        )
+        logs.ANNOUNCES.debug(
+            "For %s announcement (%s) server returned response:\n\n %s",
+            self,
+            url,
+            response.content,
         )
         self.num_announces += 1
         return response
 
+    async def announce_once(
+        self,
+        client: Union[httpx.AsyncClient, StreamClient, UDPTrackerClient],
+        port: int,
+    ) -> int:
+        """Send the next regular announce for this torrent and return the
+        number of seconds to wait before announcing again
+        """
+        if self.num_announces == 0:
+            event = TrackerRequestEvent.STARTED
+        else:
+            event = None
+
+        try:
+            response = await self.announce(client, port, event=event)
+            if not isinstance(response, AnnounceResponse):
+                response.raise_for_status()
+                response = parse_response(response.content, self)
+            # Re-announce again at the given time provided by tracker
+            sleep = next_interval(response, self)
+            self.min_interval = response.min_interval
+        except (httpx.HTTPError, ssl.SSLError, UDPTrackerError, TrackerFailure) as exc:
+            self.last_error = exc
+            self.failures += 1
+            metrics.ANNOUNCE_FAILURES.labels(self.tracker_key, event_label(event)).inc()
+            sleep = self.retry_interval()
+            logs.ANNOUNCES.warning(
+                "Unable to complete request for %s exception occurred: %r", self, exc
+            )
+        else:
+            self.last_error = None
+            self.failures = 0
+        logs.ANNOUNCES.info(
+            "Re-announcing (#%d) %s in %s seconds...",
+            self.num_announces,
+            self,
+            sleep,
+        )
+        self.last_interval = sleep
+        return sleep
+
+    def retry_interval(self) -> float:
+        """Exponential backoff with jitter based on the number of consecutive
+        failed announces
+        """
+        backoff = min(
+            MIN_RETRY_INTERVAL * 2 ** (self.failures - 1), DEFAULT_SLEEP_INTERVAL
+        )
+        return round(random.uniform(backoff / 2, backoff), 1)
+
+    @property
+    def tracker_unreachable(self) -> bool:
+        """Whether the last announce failed without a response from the tracker.
+        A `failure reason` means the tracker is up but rejected this torrent
+        """
+        return self.last_error is not None and not isinstance(
+            self.last_error, TrackerFailure
+        )
+
     async def announce_forever(
         self, client: httpx.AsyncClient, limit: StrictLimiter, port: int
     ):
         try:
             while True:
-                if self.num_announces == 0:
-                    event = TrackerRequestEvent.STARTED
-                else:
-                    event = None
-
+                start = time.monotonic()
                 await limit.wait()
-                try:
-                    response = await self.announce(client, port, event=event)
-                except (httpx.HTTPError, ssl.SSLError) as exc:
-                    logging.warning(
-                        f"Unable to complete request for {self.name} exception occurred: {exc}"
-                    )
-                    sleep = DEFAULT_SLEEP_INTERVAL
-                else:
-                    # Re-announce again at the given time provided by tracker
-                    sleep = parse_interval(response.content, self.name)
-                logging.info(
-                    f"Re-announcing (#{self.num_announces}) {self.name} in {sleep} seconds..."
+                metrics.LIMITER_WAIT.labels(self.tracker_key).observe(
+                    time.monotonic() - start
                 )
+                sleep = await self.announce_once(client, port)
                 await asyncio.sleep(sleep)
         finally:
-            logging.info(
+            logs.ANNOUNCES.info(
                 f"Received shutdown signal...sending final announce: {self.name}"
             )
             await self.announce(client, port, event=TrackerRequestEvent.STOPPED)
@@ -176,55 +526,1033 @@ class TorrentSpoofer:
         logging.info(f"Searching for torrent files located under '{folderpath}'")
 
         torrents = []
-        for root, dirs, files in os.walk(folderpath):
-            for file in files:
-                if file.endswith(".torrent"):
-                    filepath = os.path.join(root, file)
-
-                    logging.debug(f"Found {filepath}")
-                    torrents.append(filepath)
+        for filepath in find_torrent_files(folderpath):
+            logging.debug(f"Found {filepath}")
+            torrents.append(filepath)
 
         logging.info(f"Found {len(torrents)} torrent files")
         logging.info("Reading and parsing torrent files...")
         return [cls(filepath, peer_id, useragent) for filepath in torrents]
 
+    @classmethod
+    async def stream_torrents(
+        cls,
+        folderpath: str,
+        peer_id: str,
+        useragent: str,
+        executor: Optional[concurrent.futures.Executor] = None,
+        cache: Optional[MetainfoCache] = None,
+    ) -> AsyncIterator["TorrentSpoofer"]:
+        """Like `load_torrents` but parses files in batches on `executor` and
+        yields each torrent as soon as its batch is ready, so announces can
+        begin while the rest of the folder is still loading. Unreadable
+        torrent files are logged and skipped
 
-def parse_interval(response_bytes: bytes, torrent_name: str) -> int:
+        cache: Optional metainfo cache. Unchanged files are loaded from it
+            without being parsed, parsed files are added to it, and entries
+            for files no longer in the folder are evicted
+        """
+        logging.info(f"Searching for torrent files located under '{folderpath}'")
+        loop = asyncio.get_running_loop()
+        # Keep a couple of batches queued per CPU:
+        max_pending = 2 * (os.cpu_count() or 1)
+        pending: set[asyncio.Future] = set()
+        stats: dict[str, os.stat_result] = {}
+        seen = []
+        num_cached = 0
+
+        def parsed(futures):
+            torrents = []
+            parsed_entries = []
+            for future in futures:
+                for filepath, metainfo, error in future.result():
+                    stat = stats.pop(filepath, None)
+                    if metainfo is None:
+                        logging.warning(
+                            f"Unable to read torrent file {filepath}: {error}"
+                        )
+                        continue
+                    torrents.append(cls(filepath, peer_id, useragent, metainfo))
+                    if stat is not None:
+                        parsed_entries.append(
+                            (filepath, stat.st_size, stat.st_mtime_ns, metainfo)
+                        )
+            if cache is not None and parsed_entries:
+                cache.put_many(parsed_entries)
+            return torrents
+
+        batch = []
+        for entry in scan_torrent_files(folderpath):
+            filepath = entry.path
+            logging.debug(f"Found {filepath}")
+            seen.append(filepath)
+            if cache is not None:
+                stat = entry.stat()
+                metainfo = cache.get(filepath, stat.st_size, stat.st_mtime_ns)
+                if metainfo is not None:
+                    num_cached += 1
+                    yield cls(filepath, peer_id, useragent, metainfo)
+                    continue
+                stats[filepath] = stat
+
+            batch.append(filepath)
+            if len(batch) < PARSE_BATCH_SIZE:
+                continue
+            pending.add(loop.run_in_executor(executor, read_metainfo_batch, batch))
+            batch = []
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for torrent in parsed(done):
+                    yield torrent
+            else:
+                # Yield to the event loop so announces aren't held up by the
+                # directory walk:
+                await asyncio.sleep(0)
+
+        if batch:
+            pending.add(loop.run_in_executor(executor, read_metainfo_batch, batch))
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for torrent in parsed(done):
+                yield torrent
+
+        logging.info(
+            f"Finished reading in {len(seen)} torrent files ({num_cached} from cache)"
+        )
+        if cache is not None:
+            evicted = cache.evict_missing(folderpath, seen)
+            logging.debug(f"Evicted {evicted} deleted torrent files from cache")
+
+
+def torrent_key(torrent: TorrentSpoofer) -> bytes:
+    """Torrents with the same key are copies of one another, announced only
+    once and journaled as one. The same infohash on other trackers, as when
+    cross-seeding, is announced and journaled separately
+    """
+    urls = sorted(url for tier in torrent.announce_list for url in tier)
+    return torrent.encoded_infohash + hashlib.sha1("\n".join(urls).encode()).digest()
+
+
+class AnnounceScheduler:
+    """Drives announces for every loaded torrent from a single timer queue.
+
+    Torrents are kept in a heap ordered by the time their next announce is
+    due. One dispatcher pops due torrents and queues them on their tracker,
+    where a per-tracker task waits on that tracker's rate limiter and
+    concurrency limit before starting the announce. A global cap bounds the
+    number of announces in flight, so memory and event loop overhead grow
+    with in-flight requests rather than with the number of torrents.
+
+    If a `journal` is given, the state of every announce is recorded in it and
+    torrents found in it resume at their remaining due time when added.
+
+    If `shard` is given as `(index, num_shards)`, only torrents whose infohash
+    falls into that shard are added and all others are ignored.
+
+    If a `summary` is given, every regular announce is counted in it.
+
+    If a `coalesce_window` is given, the next announce after a successful
+    one is moved earlier to the start of its tracker's current window of
+    that many seconds, but never sooner than the tracker's `min interval`.
+    Announces to a tracker then go out in bursts that reuse warm keep-alive
+    connections, instead of drifting into an even spread that needs a new
+    connection for nearly every request.
+    """
+
+    def __init__(
+        self,
+        trackers: TrackerPool,
+        port: int,
+        max_workers: int = MAX_CONCURRENT_ANNOUNCES,
+        journal: Optional[AnnounceJournal] = None,
+        stop_timeout: float = STOP_TIMEOUT,
+        shard: Optional[tuple[int, int]] = None,
+        summary: Optional[logs.AnnounceSummary] = None,
+        coalesce_window: Optional[float] = None,
+    ):
+        self.trackers = trackers
+        self.port = port
+        self.max_workers = max_workers
+        self.journal = journal
+        self.stop_timeout = stop_timeout
+        self.shard = shard
+        self.summary = summary
+        self.coalesce_window = coalesce_window
+        # Time source of due times. Replaced by the event loop's clock when
+        # simulating, see `simulation`:
+        self.clock: Callable[[], float] = time.monotonic
+        self.torrents: dict[str, TorrentSpoofer] = {}
+        # Registered torrents by `torrent_key`:
+        self._originals: dict[bytes, TorrentSpoofer] = {}
+        # Torrents already announced from another file, in the order they
+        # were added:
+        self._duplicates: dict[bytes, list[TorrentSpoofer]] = {}
+        self._queue: list[tuple[float, int, TorrentSpoofer]] = []
+        # Due time of each torrent's entry in `_queue`. Other entries of a
+        # torrent are stale and skipped:
+        self._due: dict[TorrentSpoofer, float] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._workers = asyncio.Semaphore(max_workers)
+        self._draining: dict[Tracker, asyncio.Task] = {}
+        self._in_flight: set[asyncio.Task] = set()
+        # Start time of each regular announce in flight:
+        self._announcing: dict[TorrentSpoofer, float] = {}
+        self._failed: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, torrent: TorrentSpoofer, delay: float = 0) -> None:
+        """Register a new torrent and schedule its first announce. Replaces
+        any different torrent previously loaded from the same file. A torrent
+        already announced from another file is only announced in its place
+        once that file is removed
+        """
+        if self.shard is not None:
+            index, num_shards = self.shard
+            if shard_of(torrent.encoded_infohash, num_shards) != index:
+                return
+        existing = self.torrents.get(torrent.filepath)
+        if existing is not None:
+            if existing.encoded_infohash != torrent.encoded_infohash:
+                self.remove(torrent.filepath)
+            elif existing.announce_list == torrent.announce_list:
+                return
+            else:
+                # Rewritten with other announce urls, e.g. a new passkey. The
+                # tracker already counts us as seeding, so carry on where the
+                # torrent left off:
+                logging.info(f"Announce urls of {torrent.filepath} changed")
+                torrent.num_announces = existing.num_announces
+                torrent.min_interval = existing.min_interval
+                remaining = self._remaining(existing)
+                delay = delay or remaining
+                del self.torrents[existing.filepath]
+                if (
+                    not self._hand_over(existing, remaining)
+                    and self.journal is not None
+                ):
+                    self.journal.forget(torrent_key(existing))
+        else:
+            self._forget_duplicate(torrent.filepath)
+        key = torrent_key(torrent)
+        original = self._originals.get(key)
+        if original is not None:
+            logging.info(
+                f"Skipping {torrent.filepath}, the same torrent as {original.filepath}"
+            )
+            self._duplicates.setdefault(key, []).append(torrent)
+            return
+        self.torrents[torrent.filepath] = torrent
+        self._originals[key] = torrent
+        if self.journal is not None and not delay:
+            delay = self._resume(torrent)
+        self.schedule(torrent, delay)
+
+    def _forget_duplicate(self, filepath: str) -> None:
+        for key, duplicates in self._duplicates.items():
+            for duplicate in duplicates:
+                if duplicate.filepath == filepath:
+                    duplicates.remove(duplicate)
+                    if not duplicates:
+                        del self._duplicates[key]
+                    return
+
+    def _resume(self, torrent: TorrentSpoofer) -> float:
+        """Restores the journaled announce state of `torrent`. Returns the
+        number of seconds left until its next announce is due
+        """
+        state = self.journal.get(torrent_key(torrent))
+        if state is None:
+            return 0
+        if state.event != TrackerRequestEvent.STOPPED.value:
+            # The tracker still counts us as seeding, so carry on with
+            # regular announces instead of starting over:
+            torrent.num_announces = state.num_announces
+        # Clamped in case the clock changed while we weren't running:
+        return min(max(state.due_at - time.time(), 0), state.interval)
+
+    def remove(self, filepath: str) -> Optional[TorrentSpoofer]:
+        """Unregister the torrent loaded from `filepath` and tell its tracker
+        we stopped seeding it
+        """
+        torrent = self.torrents.pop(filepath, None)
+        if torrent is None:
+            self._forget_duplicate(filepath)
+            return None
+        if self._hand_over(torrent, self._remaining(torrent)):
+            # Another file of the same torrent takes over its announces, so
+            # the tracker isn't told we stopped:
+            return torrent
+        if self.journal is not None:
+            self.journal.forget(torrent_key(torrent))
+        # Entries already in the heap or a tracker queue are skipped once
+        # they come up since the torrent is no longer registered
+        if torrent.num_announces:
+            task = asyncio.create_task(self._announce_stopped(torrent))
+            task.add_done_callback(self._in_flight.discard)
+            self._in_flight.add(task)
+        return torrent
+
+    def _hand_over(self, torrent: TorrentSpoofer, remaining: float) -> bool:
+        """Passes the schedule of `torrent`, which was just unregistered and
+        was due in `remaining` seconds, on to the next file of the same
+        torrent. Returns `False` if there is none
+        """
+        key = torrent_key(torrent)
+        del self._originals[key]
+        duplicates = self._duplicates.pop(key, None)
+        if not duplicates:
+            return False
+        replacement = duplicates.pop(0)
+        if duplicates:
+            self._duplicates[key] = duplicates
+        replacement.num_announces = torrent.num_announces
+        self.add(replacement, remaining)
+        return True
+
+    def _remaining(self, torrent: TorrentSpoofer) -> float:
+        """Takes `torrent` out of the queue. Returns the seconds until its
+        next announce was due, or 0 if it wasn't waiting in the queue
+        """
+        due = self._due.pop(torrent, None)
+        return max(due - self.clock(), 0) if due is not None else 0
+
+    def _is_registered(self, torrent: TorrentSpoofer) -> bool:
+        return self.torrents.get(torrent.filepath) is torrent
+
+    async def _announce_stopped(self, torrent: TorrentSpoofer) -> None:
+        tracker = self.trackers.get(torrent.announce_url)
+        await tracker.limit.wait()
+        logging.info(f"Torrent file removed...sending final announce: {torrent.name}")
+        try:
+            await torrent.announce(
+                tracker.client, self.port, event=TrackerRequestEvent.STOPPED
+            )
+        except (httpx.HTTPError, ssl.SSLError, UDPTrackerError) as exc:
+            metrics.ANNOUNCE_FAILURES.labels(
+                torrent.tracker_key, event_label(TrackerRequestEvent.STOPPED)
+            ).inc()
+            logging.warning(
+                f"Unable to send final announce for {torrent.name} exception occurred: {exc!r}"
+            )
+
+    async def add_from(self, torrents: AsyncIterator[TorrentSpoofer]) -> None:
+        """Register torrents as they are produced, e.g. by
+        `TorrentSpoofer.stream_torrents`
+        """
+        async for torrent in torrents:
+            self.add(torrent)
+
+    def schedule(self, torrent: TorrentSpoofer, delay: float = 0) -> None:
+        """Schedule the next announce of `torrent` in `delay` seconds"""
+        due = self._due[torrent] = self.clock() + delay
+        # The counter breaks ties so torrents themselves are never compared:
+        heapq.heappush(self._queue, (due, next(self._counter), torrent))
+        self._wakeup.set()
+
+    async def _next_due(self) -> tuple[float, TorrentSpoofer]:
+        while True:
+            if self._queue:
+                due, _, torrent = self._queue[0]
+                timeout = due - self.clock()
+                if timeout <= 0:
+                    heapq.heappop(self._queue)
+                    if self._due.get(torrent) != due:
+                        continue
+                    del self._due[torrent]
+                    if not self._is_registered(torrent):
+                        continue
+                    return due, torrent
+            else:
+                timeout = None
+
+            # Sleep until the earliest announce is due or a new torrent is
+            # scheduled, whichever comes first:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _propagate_error(self, task: asyncio.Task) -> None:
+        # Unexpected (non-HTTP) errors in background tasks stop the scheduler
+        # instead of being silently dropped:
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._failed is None:
+            self._failed = asyncio.get_running_loop().create_future()
+        if not self._failed.done():
+            self._failed.set_exception(task.exception())
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Run `coro` alongside the scheduler. It is cancelled when the
+        scheduler stops and any unexpected error it raises stops the scheduler
+        """
+        task = asyncio.create_task(coro)
+        task.add_done_callback(self._in_flight.discard)
+        task.add_done_callback(self._propagate_error)
+        self._in_flight.add(task)
+        return task
+
+    async def _dispatch(self) -> None:
+        while True:
+            due, torrent = await self._next_due()
+            torrent.target = torrent.tiers.select(self._usable)
+            tracker = self.trackers.get(torrent.announce_url)
+            tracker.due.append((due, torrent))
+            if tracker not in self._draining:
+                task = asyncio.create_task(self._drain(tracker))
+                task.add_done_callback(self._propagate_error)
+                self._draining[tracker] = task
+
+    async def _drain(self, tracker: Tracker) -> None:
+        try:
+            while tracker.due:
+                if not self._is_registered(tracker.due[0][1]):
+                    tracker.due.popleft()
+                    continue
+                start = self.clock()
+                await tracker.resumed.wait()
+                await tracker.breaker.acquire()
+                try:
+                    await tracker.limit.wait()
+                    await tracker.concurrency.acquire()
+                    await self._workers.acquire()
+                except asyncio.CancelledError:
+                    tracker.breaker.cancel_probe()
+                    raise
+                now = self.clock()
+                due, torrent = tracker.due.popleft()
+                metrics.LIMITER_WAIT.labels(tracker.key).observe(now - start)
+                metrics.SCHEDULER_LAG.observe(now - due)
+                if not self._is_registered(torrent):
+                    # Removed while waiting on the limits. If it was to be
+                    # the breaker's probe, the next torrent probes instead:
+                    tracker.concurrency.release()
+                    self._workers.release()
+                    tracker.breaker.cancel_probe()
+                    continue
+                task = asyncio.create_task(self._announce(tracker, torrent))
+                task.add_done_callback(self._in_flight.discard)
+                task.add_done_callback(self._propagate_error)
+                self._in_flight.add(task)
+        finally:
+            del self._draining[tracker]
+
+    async def _announce(self, tracker: Tracker, torrent: TorrentSpoofer) -> None:
+        event = TrackerRequestEvent.STARTED if torrent.num_announces == 0 else None
+        start = self._announcing[torrent] = self.clock()
+        try:
+            sleep = await torrent.announce_once(tracker.client, self.port)
+        finally:
+            del self._announcing[torrent]
+            tracker.concurrency.release(
+                self.clock() - start, not torrent.tracker_unreachable
+            )
+            self._workers.release()
+        if self.summary is not None:
+            self.summary.record(tracker.key, torrent.last_error)
+        tracker.breaker.record(not torrent.tracker_unreachable)
+        target = torrent.target
+        if not torrent.tracker_unreachable:
+            target.down_until = 0.0
+            torrent.tiers.promote(target)
+            if self.coalesce_window and torrent.last_error is None:
+                sleep = self._coalesce(torrent, sleep)
+        elif len(torrent.tiers) > 1:
+            target.down_until = self.clock() + MIN_RETRY_INTERVAL
+            if self._usable(torrent.tiers.select(self._usable)):
+                # Fail over to the next url right away instead of waiting
+                # out the backoff:
+                logs.ANNOUNCES.info(
+                    "Tracker %s is unreachable, failing over %s", target.url, torrent
+                )
+                sleep = 0
+        if not self._is_registered(torrent):
+            # Removed while being announced, which already dropped it from the
+            # journal:
+            return
+        if self.journal is not None:
+            self.journal.record(
+                torrent_key(torrent),
+                sleep,
+                torrent.num_announces,
+                event_label(event),
+            )
+        self.schedule(torrent, sleep)
+
+    def _coalesce(self, torrent: TorrentSpoofer, sleep: float) -> float:
+        """Returns the seconds until the start of the window `sleep` seconds
+        from now falls into, or `sleep` if that is sooner than the tracker's
+        `min interval`
+        """
+        window = self.coalesce_window
+        now = self.clock()
+        due = now + sleep
+        # Windows of different trackers are staggered so their bursts don't
+        # all start at once:
+        offset = zlib.crc32(torrent.tracker_key.encode()) % 1000 / 1000 * window
+        start = due - (due - offset) % window
+        if start <= now or (
+            torrent.min_interval is not None and start - now < torrent.min_interval
+        ):
+            return sleep
+        return start - now
+
+    def _usable(self, target: AnnounceTarget) -> bool:
+        """Whether `target` isn't known to be down, either from a recent
+        failed announce to it or by its tracker's circuit breaker, and its
+        tracker isn't paused
+        """
+        now = self.clock()
+        if target.down_until > now:
+            return False
+        tracker = self.trackers.trackers.get(target.tracker_key)
+        if tracker is not None and tracker.paused:
+            return False
+        return (
+            tracker is None
+            or tracker.breaker.state is not BreakerState.OPEN
+            # Let the breaker's probe through once its cooldown is over:
+            or tracker.breaker.reopens_at <= asyncio.get_running_loop().time()
+        )
+
+    def find(self, key: str) -> Optional[TorrentSpoofer]:
+        """Returns the registered torrent loaded from the file at path `key`
+        or with the hex infohash `key`
+        """
+        torrent = self.torrents.get(key)
+        if torrent is not None:
+            return torrent
+        try:
+            infohash = bytes.fromhex(key)
+        except ValueError:
+            return None
+        for torrent in self.torrents.values():
+            if torrent.encoded_infohash == infohash:
+                return torrent
+        return None
+
+    def due_times(self) -> dict[TorrentSpoofer, float]:
+        """Returns the time on `clock` at which each scheduled torrent's
+        next announce is due. Torrents waiting on their tracker or being
+        announced aren't included
+        """
+        return {
+            torrent: due
+            for torrent, due in self._due.items()
+            if self._is_registered(torrent)
+        }
+
+    def announce_now(self, torrent: TorrentSpoofer) -> bool:
+        """Moves the next announce of `torrent` up to now. Returns `False` if
+        it is already waiting on its tracker or being announced
+        """
+        entries = [entry for entry in self._queue if entry[2] is not torrent]
+        if len(entries) == len(self._queue):
+            return False
+        self._queue[:] = entries
+        heapq.heapify(self._queue)
+        self.schedule(torrent)
+        return True
+
+    def overdue(self) -> int:
+        """Returns the number of torrents whose announce is past due"""
+        now = self.clock()
+        waiting = sum(
+            self._is_registered(torrent)
+            for torrent, due in self._due.items()
+            if due <= now
+        )
+        for tracker in self.trackers:
+            waiting += sum(self._is_registered(torrent) for _, torrent in tracker.due)
+        return waiting
+
+    def describe(self, limit: int = 20) -> str:
+        """Returns a readable summary of the announce queue, the announces in
+        flight and each tracker's backlog, listing up to `limit` of the
+        longest running announces
+        """
+        now = self.clock()
+        lines = [
+            f"Torrents: {len(self.torrents)} loaded, {len(self._queue)} scheduled, "
+            f"{self.overdue()} overdue"
+        ]
+        if self._queue:
+            lines.append(f"Next announce due in {self._queue[0][0] - now:.1f} seconds")
+        lines.append(
+            f"Announces in flight: {len(self._announcing)} of {self.max_workers}"
+        )
+        longest = sorted(self._announcing.items(), key=lambda item: item[1])
+        for torrent, start in longest[:limit]:
+            lines.append(
+                f"  {torrent} ({torrent.tracker_key}) for {now - start:.1f} seconds"
+            )
+        for tracker in self.trackers:
+            lines.append(
+                f"Tracker {tracker.key}: {len(tracker.due)} waiting, "
+                f"{tracker.concurrency.in_flight} in flight "
+                f"(limit {int(tracker.concurrency.limit)}), "
+                f"{tracker.limit.rate:g} requests/sec, "
+                f"breaker {tracker.breaker.state.value}"
+            )
+        return "\n".join(lines)
+
+    async def run(self) -> None:
+        """Announce all scheduled torrents until cancelled, then send a final
+        `STOPPED` announce for every torrent that was started
+        """
+        if self._failed is None:
+            self._failed = asyncio.get_running_loop().create_future()
+        dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            done, _ = await asyncio.wait(
+                [dispatcher, self._failed], return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                future.result()
+        finally:
+            tasks = [dispatcher, *self._draining.values(), *self._in_flight]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.stop()
+
+    async def stop(self) -> None:
+        """Send a final `STOPPED` announce for every started torrent. Each
+        tracker's announces go out in parallel up to its connection limit
+        and rate limit, and whatever hasn't been sent after `stop_timeout`
+        seconds is given up on
+        """
+        by_tracker: dict[Tracker, list[TorrentSpoofer]] = collections.defaultdict(list)
+        for torrent in self.torrents.values():
+            if torrent.num_announces:
+                by_tracker[self.trackers.get(torrent.announce_url)].append(torrent)
+        total = sum(len(torrents) for torrents in by_tracker.values())
+        logging.info(
+            f"Received shutdown signal...sending final announce for {total} torrents "
+            f"to {len(by_tracker)} trackers"
+        )
+        if not total:
+            return
+
+        workers = asyncio.Semaphore(self.max_workers)
+        summary = {tracker: collections.Counter() for tracker in by_tracker}
+        tasks = [
+            asyncio.create_task(
+                self._stop_tracker(tracker, torrents, workers, summary[tracker])
+            )
+            for tracker, torrents in by_tracker.items()
+        ]
+        _, pending = await asyncio.wait(tasks, timeout=self.stop_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        sent = failed = 0
+        for tracker, torrents in by_tracker.items():
+            counts = summary[tracker]
+            undelivered = len(torrents) - counts["sent"] - counts["failed"]
+            message = (
+                f"Final announces to {tracker.key}: {counts['sent']} sent, "
+                f"{counts['failed']} failed, {undelivered} not sent"
+            )
+            if counts["failed"] or undelivered:
+                logging.warning(message)
+            else:
+                logging.info(message)
+            sent += counts["sent"]
+            failed += counts["failed"]
+        if pending:
+            logging.warning(
+                f"Gave up on final announces after {self.stop_timeout} seconds"
+            )
+        logging.info(
+            f"Sent {sent} of {total} final announces ({failed} failed, "
+            f"{total - sent - failed} not sent)"
+        )
+
+    async def _stop_tracker(
+        self,
+        tracker: Tracker,
+        torrents: list[TorrentSpoofer],
+        workers: asyncio.Semaphore,
+        summary: collections.Counter,
+    ) -> None:
+        if tracker.breaker.state is BreakerState.OPEN:
+            # Don't spend the shutdown deadline on a tracker that is down:
+            logging.warning(
+                f"Tracker {tracker.key} is down, skipping {len(torrents)} final announces"
+            )
+            return
+        stopped = event_label(TrackerRequestEvent.STOPPED)
+        remaining = iter(torrents)
+
+        async def send():
+            # Workers share the iterator, so each torrent is sent exactly once:
+            for torrent in remaining:
+                await tracker.limit.wait()
+                async with workers:
+                    try:
+                        response = await torrent.announce(
+                            tracker.client,
+                            self.port,
+                            event=TrackerRequestEvent.STOPPED,
+                        )
+                        if not isinstance(response, AnnounceResponse):
+                            response.raise_for_status()
+                    except (httpx.HTTPError, ssl.SSLError, UDPTrackerError) as exc:
+                        summary["failed"] += 1
+                        metrics.ANNOUNCE_FAILURES.labels(
+                            torrent.tracker_key, stopped
+                        ).inc()
+                        logs.ANNOUNCES.debug(
+                            "Unable to send final announce for %s: %r",
+                            torrent,
+                            exc,
+                        )
+                        continue
+                summary["sent"] += 1
+                if self.journal is not None:
+                    self.journal.mark_stopped(torrent_key(torrent))
+
+        await asyncio.gather(
+            *(send() for _ in range(min(len(torrents), tracker.concurrency.maximum)))
+        )
+
+
+async def follow_folder(
+    scheduler: AnnounceScheduler,
+    watcher: Union[InotifyWatcher, PollingWatcher],
+    peer_id: str,
+    useragent: str,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> None:
+    """Add and remove torrents as their files appear in and disappear from
+    the watched folder
+    """
+    loop = asyncio.get_running_loop()
+    async for added, removed in watcher.changes():
+        for filepath in removed:
+            torrent = scheduler.remove(filepath)
+            if torrent is not None:
+                logging.info(f"Torrent file removed: {filepath}")
+        if not added:
+            continue
+        results = await loop.run_in_executor(
+            executor, read_metainfo_batch, sorted(added)
+        )
+        for filepath, metainfo, error in results:
+            if metainfo is None:
+                logging.warning(f"Unable to read torrent file {filepath}: {error}")
+                continue
+            logging.info(f"Torrent file added: {filepath}")
+            scheduler.add(TorrentSpoofer(filepath, peer_id, useragent, metainfo))
+
+
+def parse_response(response_bytes: bytes, torrent_name: object) -> AnnounceResponse:
+    """Reads the fields we act on from a bencoded tracker response. An empty
+    `AnnounceResponse` is returned if the response can't be parsed
+    """
     try:
-        data = flatbencode.decode(response_bytes)
+        return scan_announce_response(response_bytes)
     except flatbencode.DecodingError:
         logging.warning(
             f"Unable to parse server response for {torrent_name}:\n{response_bytes}"
         )
+        return AnnounceResponse()
+
+
+def next_interval(response: AnnounceResponse, torrent_name: object) -> int:
+    """Returns the number of seconds to wait before the next announce. Honors
+    the tracker's `min interval` and raises `TrackerFailure` if the tracker
+    returned a `failure reason`
+    """
+    if response.failure_reason is not None:
+        raise TrackerFailure(response.failure_reason)
+    if response.warning_message is not None:
+        logging.warning(
+            f"Tracker warning for {torrent_name}: {response.warning_message}"
+        )
+
+    sleep = response.interval
+    if sleep is None or sleep <= 0:
         sleep = DEFAULT_SLEEP_INTERVAL
-    else:
-        sleep = data.get(b"interval", DEFAULT_SLEEP_INTERVAL)
+    if response.min_interval is not None:
+        sleep = max(sleep, response.min_interval)
     return sleep
 
 
+def parse_interval(response_bytes: bytes, torrent_name: str) -> int:
+    return next_interval(parse_response(response_bytes, torrent_name), torrent_name)
+
+
 async def ghostseed(
     filepath: str,
     port: int,
     version: str,
-    max_requests: Optional[int] = None,
+    max_requests: Optional[float] = None,
     seed: Optional[int] = None,
+    peer_id: Optional[str] = None,
+    **options,
 ) -> None:
-    version_info = semver.VersionInfo.parse(version)
-    peer_id = generate_peer_id(TorrentClient.qBittorrent, version_info, seed)
-    useragent = generate_useragent(TorrentClient.qBittorrent, version_info)
-
-    torrents = TorrentSpoofer.load_torrents(filepath, peer_id, useragent)
-    logging.info("Finished reading in torrent files")
-    logging.info(
-        f"Tracker announces will use the following settings: (port={port}, peer_id='{peer_id}', user-agent='{useragent}')"
-    )
+    """Announce every torrent under `filepath` until cancelled. The other
+    `options` are those of `ghostseed_profiles()`
+
+    peer_id: Use this peer id instead of generating one, e.g. so that all
+        worker processes announce as the same client
+    """
+    profile = Profile("default", filepath, port, version, max_requests, seed, peer_id)
+    await ghostseed_profiles([profile], **options)
+
+
+def profile_path(path: str, profile: Profile, profiles: list[Profile]) -> str:
+    """Returns `path` with the name of `profile` appended if there are
+    several `profiles`, so each one keeps its own file
+    """
+    return path if len(profiles) == 1 else f"{path}.{profile.name}"
+
+
+async def run_schedulers(schedulers: list[AnnounceScheduler]) -> None:
+    """Runs every scheduler until cancelled or until one of them fails, then
+    stops all of them
+    """
+    tasks = [asyncio.create_task(scheduler.run()) for scheduler in schedulers]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Each scheduler sends its final announces when cancelled:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        task.result()
+
+
+async def ghostseed_profiles(
+    profiles: list[Profile],
+    max_workers: Optional[int] = None,
+    cache_path: Optional[str] = None,
+    max_connections: Optional[int] = None,
+    watch: bool = True,
+    metrics_port: Optional[int] = None,
+    metrics_host: str = "127.0.0.1",
+    state_path: Optional[str] = None,
+    stop_timeout: Optional[float] = None,
+    shard: Optional[tuple[int, int]] = None,
+    parse_processes: Optional[int] = None,
+    profile_duration: Optional[float] = None,
+    profile_dir: str = ".",
+    tracemalloc_interval: Optional[float] = None,
+    slow_callback_duration: Optional[float] = None,
+    admin_socket: Optional[str] = None,
+    admin_port: Optional[int] = None,
+    transport: str = "httpx",
+    summary_interval: Optional[float] = None,
+    coalesce_window: Optional[float] = None,
+) -> None:
+    """Announce the torrents of every profile until cancelled, each with its
+    own folder, port, identity and rate limit, see `profiles`. All profiles
+    run in this event loop and share the connections to trackers, the DNS
+    and TLS session caches and the processes and cache parsing torrent files.
+
+    max_workers: Announces in flight at once, for each profile
+    state_path: Where announce state is journaled. With several profiles,
+        each uses its own file named after the profile
+    shard: `(index, num_shards)` to only announce the torrents in one shard
+    parse_processes: Number of processes used to parse torrent files.
+        Defaults to the number of CPUs
+    profile_duration, profile_dir, tracemalloc_interval, slow_callback_duration:
+        Diagnostics to run from the start, see `profiling.Diagnostics`
+    admin_socket, admin_port: Serve the admin API on this Unix socket or on
+        this port on localhost, see `admin`. With several profiles, each
+        serves its own on a socket named after the profile or on the next
+        port
+    transport: HTTP client announces are sent with, `httpx` or `stream`. See
+        `transport`
+    summary_interval: Log a summary of the announces to each tracker every
+        this many seconds instead of a line per announce, see `logs`
+    coalesce_window: Align announces to each tracker to windows of this many
+        seconds, see `AnnounceScheduler`
+    """
+    if max_workers is None:
+        max_workers = MAX_CONCURRENT_ANNOUNCES
+    if max_connections is None:
+        max_connections = MAX_CONNECTIONS_PER_TRACKER
+    if stop_timeout is None:
+        stop_timeout = STOP_TIMEOUT
 
-    if max_requests is None:
-        max_requests = MAX_REQUESTS_PER_SECOND
-    limit = StrictLimiter(max_requests)
+    executor = concurrent.futures.ProcessPoolExecutor(parse_processes)
+    cache = MetainfoCache(cache_path) if cache_path is not None else None
+    watchers: list[Union[InotifyWatcher, PollingWatcher]] = []
+    journals: list[AnnounceJournal] = []
+    metrics_server = None
+    # Admin servers and the Unix sockets they listen on:
+    admin_servers: list[tuple[asyncio.AbstractServer, Optional[str]]] = []
+    try:
+        async with contextlib.AsyncExitStack() as stack:
+            clients = TrackerClients(max_connections, transport=transport)
+            # Closed after every profile's final announces:
+            stack.push_async_callback(clients.aclose)
+            summary = (
+                logs.AnnounceSummary(summary_interval)
+                if summary_interval is not None
+                else None
+            )
+            schedulers: list[AnnounceScheduler] = []
+            for index, profile in enumerate(profiles):
+                version_info = semver.VersionInfo.parse(profile.version)
+                peer_id = profile.peer_id
+                if peer_id is None:
+                    peer_id = generate_peer_id(
+                        TorrentClient.qBittorrent, version_info, profile.seed
+                    )
+                useragent = generate_useragent(TorrentClient.qBittorrent, version_info)
+                name = f"Profile '{profile.name}': t" if len(profiles) > 1 else "T"
+                logging.info(
+                    f"{name}racker announces will use the following settings: (port={profile.port}, peer_id='{peer_id}', user-agent='{useragent}')"
+                )
 
-    async with httpx.AsyncClient() as client:
-        announces = []
-        for torrent in torrents:
-            announces.append(torrent.announce_forever(client, limit, port))
-        await asyncio.gather(*announces)
+                trackers = await stack.enter_async_context(
+                    TrackerPool(
+                        profile.max_requests or MAX_REQUESTS_PER_SECOND,
+                        max_connections,
+                        clients=clients,
+                    )
+                )
+                journal = None
+                if state_path is not None:
+                    journal = AnnounceJournal(
+                        profile_path(state_path, profile, profiles)
+                    )
+                    journals.append(journal)
+                scheduler = AnnounceScheduler(
+                    trackers,
+                    profile.port,
+                    max_workers,
+                    journal,
+                    stop_timeout,
+                    shard,
+                    summary,
+                    coalesce_window,
+                )
+                schedulers.append(scheduler)
+                if journal is not None:
+                    scheduler.spawn(journal.flush_periodically())
+                if watch:
+                    watcher = watch_folder(profile.folder)
+                    watchers.append(watcher)
+                    # Start watching before the initial scan so no file added
+                    # in the meantime is missed:
+                    await watcher.start()
+                    scheduler.spawn(
+                        follow_folder(scheduler, watcher, peer_id, useragent, executor)
+                    )
+                torrents = TorrentSpoofer.stream_torrents(
+                    profile.folder, peer_id, useragent, executor, cache
+                )
+                # Torrents are scheduled as they finish parsing while the
+                # scheduler is already announcing the earlier ones:
+                scheduler.spawn(scheduler.add_from(torrents))
+                if admin_socket is not None or admin_port is not None:
+                    api = AdminAPI(
+                        scheduler,
+                        functools.partial(
+                            TorrentSpoofer, peer_id=peer_id, useragent=useragent
+                        ),
+                    )
+                    socket_path = (
+                        profile_path(admin_socket, profile, profiles)
+                        if admin_socket is not None
+                        else None
+                    )
+                    admin_server = await serve_admin(
+                        api,
+                        socket_path,
+                        port=admin_port + index if admin_port is not None else None,
+                    )
+                    admin_servers.append((admin_server, socket_path))
+
+            # Tasks shared by all profiles run as long as the first one:
+            first = schedulers[0]
+            if summary is not None:
+                logs.ANNOUNCES.setLevel(logging.ERROR)
+                first.spawn(summary.run())
+            if metrics_port is not None:
+                metrics_server = await metrics.serve_metrics(metrics_host, metrics_port)
+                metrics.TORRENTS_LOADED.set_function(
+                    lambda: sum(len(scheduler.torrents) for scheduler in schedulers)
+                )
+                metrics.TORRENTS_OVERDUE.set_function(
+                    lambda: sum(scheduler.overdue() for scheduler in schedulers)
+                )
+                first.spawn(metrics.monitor_event_loop())
+
+            def describe() -> str:
+                if len(schedulers) == 1:
+                    return first.describe()
+                return "\n".join(
+                    f"Profile '{profile.name}':\n{scheduler.describe()}"
+                    for profile, scheduler in zip(profiles, schedulers)
+                )
+
+            diagnostics = Diagnostics(
+                profile_duration,
+                profile_dir,
+                tracemalloc_interval,
+                slow_callback_duration,
+            )
+            diagnostics.install_signal_handlers(describe)
+            diagnostics.start()
+            runner = asyncio.create_task(run_schedulers(schedulers))
+            terminated = asyncio.Event()
+
+            def terminate():
+                logging.info("Received SIGTERM, shutting down")
+                terminated.set()
+                runner.cancel()
+
+            # `docker stop` and service managers send SIGTERM, which would
+            # otherwise kill the process before any final announce is sent:
+            loop = asyncio.get_running_loop()
+            try:
+                loop.add_signal_handler(signal.SIGTERM, terminate)
+                handles_sigterm = True
+            except NotImplementedError:
+                # Not supported by the event loop on Windows
+                handles_sigterm = False
+            try:
+                await runner
+            except asyncio.CancelledError:
+                if not terminated.is_set():
+                    raise
+            finally:
+                if handles_sigterm:
+                    loop.remove_signal_handler(signal.SIGTERM)
+                diagnostics.close()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        logs.ANNOUNCES.setLevel(logging.NOTSET)
+        if cache is not None:
+            cache.close()
+        for journal in journals:
+            journal.close()
+        for watcher in watchers:
+            watcher.close()
+        for admin_server, socket_path in admin_servers:
+            admin_server.close()
+            if socket_path is not None:
+                try:
+                    os.unlink(socket_path)
+                except FileNotFoundError:
+                    pass
+        if metrics_server is not None:
+            metrics_server.close()
+            metrics.TORRENTS_LOADED.set_function(None)
+            metrics.TORRENTS_OVERDUE.set_function(None)
@@ -0,0 +1,149 @@
+"""Logging that stays off the event loop and flat as the corpus grows.
+
+`background_logging()` moves the output handlers to a thread fed by a
+queue, so writing log lines never blocks announces. Records are handed over
+as they are and even their messages are formatted in that thread.
+
+Messages about a single torrent are logged to `ANNOUNCES`. With summaries
+on, that logger is silenced below `ERROR` and `AnnounceSummary` logs one
+line per tracker every interval instead, e.g.:
+
+    Announced 1,204 torrents to https://tracker.example in the last 60s, 3 failures
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Iterator, Optional
+
+# Per-torrent messages, logged at least once for every announce:
+ANNOUNCES = logging.getLogger("ghostseeder.announces")
+# Seconds between announce summaries:
+SUMMARY_INTERVAL = 60
+
+# Attributes every record has, anything else was passed in `extra`:
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as compact JSON objects, one per line. Values passed
+    in `extra` are included as fields
+    """
+
+    def __init__(self, datefmt: Optional[str] = "%Y-%m-%dT%H:%M:%S%z"):
+        super().__init__(datefmt=datefmt)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.processName != "MainProcess":
+            entry["process"] = record.processName
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class _ThreadQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The record stays in this process, so unlike `QueueHandler` there
+        # is no need to format it into something picklable first
+        return record
+
+
+def output_handlers() -> list[logging.Handler]:
+    """Returns the handlers that write out log records, wherever they run"""
+    root = logging.getLogger()
+    handlers = []
+    for handler in root.handlers:
+        if isinstance(handler, _ThreadQueueHandler):
+            handlers.extend(handler.listener.handlers)
+        else:
+            handlers.append(handler)
+    return handlers
+
+
+@contextlib.contextmanager
+def background_logging(json_lines: bool = False) -> Iterator[None]:
+    """Writes log records from a background thread while in the context.
+    Records still queued are written out on exit
+
+    json_lines: Format records as JSON lines, see `JSONFormatter`
+    """
+    root = logging.getLogger()
+    handlers = root.handlers
+    formatters = [handler.formatter for handler in handlers]
+    if json_lines:
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _ThreadQueueHandler(records)
+    queue_handler.listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True
+    )
+    root.handlers = [queue_handler]
+    queue_handler.listener.start()
+    try:
+        yield
+    finally:
+        root.handlers = handlers
+        queue_handler.listener.stop()
+        for handler, formatter in zip(handlers, formatters):
+            handler.setFormatter(formatter)
+
+
+class AnnounceSummary:
+    """Counts the announces to each tracker and logs them as one line per
+    tracker every `interval` seconds, in place of a line per announce
+    """
+
+    def __init__(self, interval: float = SUMMARY_INTERVAL):
+        self.interval = interval
+        # Tracker -> [announces, failures, last error]:
+        self._counts: dict[str, list] = {}
+        self._since = time.monotonic()
+
+    def record(self, tracker: str, error: Optional[BaseException] = None) -> None:
+        counts = self._counts.get(tracker)
+        if counts is None:
+            counts = self._counts[tracker] = [0, 0, None]
+        counts[0] += 1
+        if error is not None:
+            counts[1] += 1
+            counts[2] = error
+
+    def flush(self) -> None:
+        """Logs the announces counted since the last flush"""
+        now = time.monotonic()
+        elapsed, self._since = now - self._since, now
+        for tracker, (announced, failed, error) in sorted(self._counts.items()):
+            message = (
+                f"Announced {announced:,} torrents to {tracker} in the last "
+                f"{elapsed:.0f}s, {failed:,} failures"
+            )
+            if error is not None:
+                message += f", last: {error!r}"
+            logging.log(
+                logging.WARNING if failed else logging.INFO,
+                message,
+                extra={"tracker": tracker, "announces": announced, "failures": failed},
+            )
+        self._counts.clear()
+
+    async def run(self) -> None:
+        """Logs summaries until cancelled"""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.flush()
+        finally:
+            self.flush()
@@ -0,0 +1,344 @@
+"""Prometheus metrics for a running ghostseeder.
+
+Metrics are collected in module-level families and can be served in the
+Prometheus text exposition format from a small local HTTP endpoint. Only the
+handful of metric types ghostseeder needs are implemented here, so no client
+library is required.
+
+See: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Iterator, Optional
+
+# Announce latencies range from a few milliseconds to the request timeout:
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Waits on rate limits and scheduling delays can grow to many minutes when
+# announces fall behind:
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+# Seconds between event loop lag samples:
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Returns the child metric for the given label values"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        self._children.clear()
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines) + "\n"
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_total{labels} {_format_value(child.value)}"
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, or that is computed by a function
+    each time metrics are collected
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def set(self, value: float) -> None:
+        self.labels().value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        self._function = function
+
+    def _samples(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f"{self.name} {_format_value(self._function())}"
+            return
+        for values, child in self._children.items():
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(child.value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> Iterator[str]:
+        names = self.labelnames + ("le",)
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(names, values + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+ANNOUNCES = Counter(
+    "ghostseeder_announces",
+    "Announces sent, by tracker and event",
+    ["tracker", "event"],
+)
+ANNOUNCE_FAILURES = Counter(
+    "ghostseeder_announce_failures",
+    "Announces that failed or were rejected, by tracker and event",
+    ["tracker", "event"],
+)
+ANNOUNCE_LATENCY = Histogram(
+    "ghostseeder_announce_duration_seconds",
+    "Time from sending an announce to receiving the tracker's response",
+    ["tracker"],
+)
+LIMITER_WAIT = Histogram(
+    "ghostseeder_limiter_wait_seconds",
+    "Time a due announce waited on its tracker's rate and concurrency limits",
+    ["tracker"],
+    WAIT_BUCKETS,
+)
+SCHEDULER_LAG = Histogram(
+    "ghostseeder_scheduler_lag_seconds",
+    "Time between when an announce was due and when it was sent",
+    buckets=WAIT_BUCKETS,
+)
+EVENT_LOOP_LAG = Histogram(
+    "ghostseeder_event_loop_lag_seconds",
+    "How late the event loop ran a timer callback",
+    buckets=LOOP_LAG_BUCKETS,
+)
+DNS_LOOKUPS = Counter(
+    "ghostseeder_dns_lookups",
+    "Tracker host lookups by the stream transport, by whether they were cached",
+    ["host", "cached"],
+)
+TLS_HANDSHAKE_DURATION = Histogram(
+    "ghostseeder_tls_handshake_duration_seconds",
+    "Time taken by TLS handshakes with trackers, by whether a session was resumed",
+    ["host", "resumed"],
+)
+CONNECT_TIME_SAVED = Counter(
+    "ghostseeder_connect_seconds_saved",
+    "Estimated connection setup time saved by cached DNS lookups and resumed "
+    "TLS sessions",
+    ["host", "kind"],
+)
+CONNECTIONS_OPENED = Counter(
+    "ghostseeder_connections_opened",
+    "Connections opened to trackers by the stream transport. Divided by "
+    "announces, shows how often announces find a warm connection",
+    ["host"],
+)
+TORRENTS_LOADED = Gauge("ghostseeder_torrents_loaded", "Torrents being announced")
+TORRENTS_OVERDUE = Gauge(
+    "ghostseeder_torrents_overdue",
+    "Torrents past the time their next announce was due",
+)
+
+REGISTRY: list[_Metric] = [
+    ANNOUNCES,
+    ANNOUNCE_FAILURES,
+    ANNOUNCE_LATENCY,
+    LIMITER_WAIT,
+    SCHEDULER_LAG,
+    EVENT_LOOP_LAG,
+    DNS_LOOKUPS,
+    TLS_HANDSHAKE_DURATION,
+    CONNECT_TIME_SAVED,
+    CONNECTIONS_OPENED,
+    TORRENTS_LOADED,
+    TORRENTS_OVERDUE,
+]
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text format"""
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+def merge(texts: dict[str, str], label: str) -> str:
+    """Combines the metrics rendered by several processes into one
+    exposition, telling them apart by a `label` set to each one's key
+    """
+    families: dict[str, tuple[list[str], list[str]]] = {}
+    for key, text in texts.items():
+        extra = f'{label}="{key}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = line.split(" ", 3)[2]
+                headers, _ = families.setdefault(family, ([], []))
+                if len(headers) < 2:
+                    headers.append(line)
+            elif line and family is not None:
+                name, brace, rest = line.partition("{")
+                if brace:
+                    line = f"{name}{{{extra},{rest}"
+                else:
+                    name, _, value = line.partition(" ")
+                    line = f"{name}{{{extra}}} {value}"
+                families[family][1].append(line)
+    return "".join(
+        "\n".join(headers + samples) + "\n" for headers, samples in families.values()
+    )
+
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Samples how far behind schedule the event loop runs timers. Sustained
+    lag means announces are delayed by CPU work on the loop itself
+    """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, time.monotonic() - start - interval))
+
+
+async def _handle(
+    collect: Optional[Callable[[], Awaitable[str]]],
+    reader: asyncio.StreamReader,
+    writer,
+) -> None:
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        method, path, _ = request.split(b" ", 2)
+        if method == b"GET" and path.split(b"?")[0] in (b"/", b"/metrics"):
+            body = (render() if collect is None else await collect()).encode()
+            status = b"200 OK"
+        else:
+            body = b"Not found\n"
+            status = b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 %s\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: %d\r\n"
+            b"Connection: close\r\n"
+            b"\r\n" % (status, len(body))
+        )
+        writer.write(body)
+        await writer.drain()
+    except (
+        asyncio.IncompleteReadError,
+        asyncio.LimitOverrunError,
+        ConnectionError,
+        ValueError,
+    ):
+        # Malformed request or the scraper went away:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(
+    host: str, port: int, collect: Optional[Callable[[], Awaitable[str]]] = None
+) -> asyncio.AbstractServer:
+    """Starts serving `/metrics` on `host:port`. The metrics of this process
+    are served unless another `collect` coroutine function is given
+    """
+    server = await asyncio.start_server(functools.partial(_handle, collect), host, port)
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,107 @@
+"""Profiles for serving several identities from one process.
+
+A profile is one identity announcing the torrents of one folder: its own
+port, qBittorrent version (and so peer id and user agent) and rate limit.
+Profiles are declared as sections of an INI file. Values in `[DEFAULT]`, or
+given on the command line, apply to every profile that doesn't set them:
+
+    [DEFAULT]
+    version = 4.3.9
+
+    [main]
+    folder = torrents/
+    port = 6881
+
+    [second-account]
+    folder = other-torrents/
+    port = 51413
+    version = 4.4.5
+    max_requests = 2
+
+Relative folders are relative to the directory of the INI file. A `seed` is
+combined with the profile's name, so profiles sharing one still announce as
+different peers. All profiles run in one event loop and share the connections
+to trackers, the DNS and TLS session caches and the processes and cache
+parsing torrent files, see `ghostseed_profiles()`.
+"""
+
+import configparser
+import os
+import zlib
+from typing import NamedTuple, Optional
+
+# Keys allowed in a profile and how their values are parsed:
+_FIELDS = {
+    "folder": str,
+    "port": int,
+    "version": str,
+    "max_requests": float,
+    "seed": int,
+    "peer_id": str,
+}
+
+
+class Profile(NamedTuple):
+    name: str
+    folder: str
+    port: int
+    version: str
+    # Announces per second to each tracker, defaults to `MAX_REQUESTS_PER_SECOND`:
+    max_requests: Optional[float] = None
+    seed: Optional[int] = None
+    # Announce as this peer id instead of generating one from `version`:
+    peer_id: Optional[str] = None
+
+
+def profile_seed(seed: int, name: str) -> int:
+    """Derives the seed of the profile called `name` from a shared `seed`"""
+    return zlib.crc32(f"{seed}:{name}".encode())
+
+
+def load_profiles(path: str, **defaults) -> list[Profile]:
+    """Reads the profiles declared in the INI file at `path`. Raises
+    `ValueError` if a profile is incomplete or invalid
+
+    defaults: Values used for keys a profile and `[DEFAULT]` don't set
+    """
+    parser = configparser.ConfigParser()
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except configparser.Error as exc:
+        raise ValueError(f"Unable to parse {path}: {exc}")
+
+    profiles = []
+    for name in parser.sections():
+        section = parser[name]
+        unknown = set(section) - set(_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"Unknown settings in profile '{name}' of {path}: "
+                f"{', '.join(sorted(unknown))}"
+            )
+        values = {}
+        for key, convert in _FIELDS.items():
+            if key in section:
+                try:
+                    values[key] = convert(section[key])
+                except ValueError:
+                    raise ValueError(
+                        f"Invalid {key} in profile '{name}' of {path}: "
+                        f"{section[key]!r}"
+                    )
+            elif defaults.get(key) is not None:
+                values[key] = defaults[key]
+        if "seed" in values:
+            values["seed"] = profile_seed(values["seed"], name)
+        if "folder" in values:
+            values["folder"] = os.path.join(os.path.dirname(path), values["folder"])
+        missing = [key for key in ("folder", "port", "version") if key not in values]
+        if missing:
+            raise ValueError(
+                f"Profile '{name}' of {path} is missing {', '.join(missing)}"
+            )
+        profiles.append(Profile(name, **values))
+    if not profiles:
+        raise ValueError(f"No profiles found in {path}")
+    return profiles
@@ -0,0 +1,198 @@
+"""Runtime diagnostics for a running instance.
+
+- CPU profiles recorded with cProfile for a window of time and written out
+  as pstats files, e.g. for `python -m pstats` or snakeviz
+- Periodic `tracemalloc` snapshots, logging the allocations that grew the
+  most since the previous snapshot
+- asyncio's warnings about callbacks that block the event loop for longer
+  than a threshold
+- A dump of the scheduler's state on SIGUSR1: the announce queue, the
+  announces in flight and the backlog waiting on each tracker's limits
+
+Each can be enabled from the command line and toggled while running:
+SIGUSR2 switches every diagnostic off if any is running, or on otherwise,
+using the configured settings or the defaults below.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import signal
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+# Defaults used when diagnostics are switched on at runtime without having
+# been configured:
+PROFILE_DURATION = 60
+TRACEMALLOC_INTERVAL = 300
+SLOW_CALLBACK_DURATION = 0.1
+# Number of allocation sites logged per snapshot diff:
+TRACEMALLOC_TOP = 10
+# Stack frames kept per allocation. More frames make snapshots more
+# informative but tracing slower:
+TRACEMALLOC_FRAMES = 1
+
+
+class Diagnostics:
+    def __init__(
+        self,
+        profile_duration: Optional[float] = None,
+        profile_dir: str = ".",
+        tracemalloc_interval: Optional[float] = None,
+        slow_callback_duration: Optional[float] = None,
+    ):
+        """Settings left as `None` are off until toggled on at runtime"""
+        self.profile_duration = profile_duration
+        self.profile_dir = profile_dir
+        self.tracemalloc_interval = tracemalloc_interval
+        self.slow_callback_duration = slow_callback_duration
+        self._profile_task: Optional[asyncio.Task] = None
+        self._tracemalloc_task: Optional[asyncio.Task] = None
+        self._watching_callbacks = False
+        self._signals: list[int] = []
+
+    @property
+    def active(self) -> bool:
+        return (
+            self._profile_task is not None
+            or self._tracemalloc_task is not None
+            or self._watching_callbacks
+        )
+
+    def start(self) -> None:
+        """Starts the diagnostics that are configured"""
+        if self.profile_duration is not None:
+            self.start_profile(self.profile_duration)
+        if self.tracemalloc_interval is not None:
+            self.start_tracemalloc(self.tracemalloc_interval)
+        if self.slow_callback_duration is not None:
+            self.watch_slow_callbacks(self.slow_callback_duration)
+
+    def stop(self) -> None:
+        self.stop_profile()
+        self.stop_tracemalloc()
+        self.stop_watching_slow_callbacks()
+
+    def toggle(self) -> None:
+        if self.active:
+            logging.info("Stopping diagnostics")
+            self.stop()
+        else:
+            logging.info("Starting diagnostics")
+            self.start_profile(self.profile_duration or PROFILE_DURATION)
+            self.start_tracemalloc(self.tracemalloc_interval or TRACEMALLOC_INTERVAL)
+            self.watch_slow_callbacks(
+                self.slow_callback_duration or SLOW_CALLBACK_DURATION
+            )
+
+    def start_profile(self, duration: float) -> None:
+        """Profiles the process for `duration` seconds, then writes the
+        profile to `profile_dir`
+        """
+        if self._profile_task is not None:
+            return
+        self._profile_task = asyncio.create_task(self._profile(duration))
+
+    def stop_profile(self) -> None:
+        """Ends the current profile early. What was recorded is still written"""
+        if self._profile_task is not None:
+            self._profile_task.cancel()
+
+    async def _profile(self, duration: float) -> None:
+        path = os.path.join(
+            self.profile_dir,
+            f"ghostseeder-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.pstats",
+        )
+        profile = cProfile.Profile()
+        logging.info(f"Recording a CPU profile for {duration} seconds")
+        profile.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profile.disable()
+            self._profile_task = None
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profile.dump_stats(path)
+            except OSError as exc:
+                logging.warning(f"Unable to write CPU profile to '{path}': {exc}")
+            else:
+                logging.info(f"Wrote CPU profile to '{path}'")
+
+    def start_tracemalloc(self, interval: float) -> None:
+        """Logs the allocations that grew the most every `interval` seconds"""
+        if self._tracemalloc_task is not None:
+            return
+        self._tracemalloc_task = asyncio.create_task(self._trace_memory(interval))
+
+    def stop_tracemalloc(self) -> None:
+        if self._tracemalloc_task is not None:
+            self._tracemalloc_task.cancel()
+
+    async def _trace_memory(self, interval: float) -> None:
+        # Tracing makes every allocation slower, so it only runs while this
+        # diagnostic is on:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logging.info(f"Tracing memory allocations, reporting every {interval} seconds")
+        try:
+            previous = tracemalloc.take_snapshot()
+            while True:
+                await asyncio.sleep(interval)
+                snapshot = tracemalloc.take_snapshot()
+                logging.info(format_snapshot_diff(snapshot, previous))
+                previous = snapshot
+        finally:
+            tracemalloc.stop()
+            self._tracemalloc_task = None
+
+    def watch_slow_callbacks(self, duration: float) -> None:
+        """Has asyncio warn about callbacks that run longer than `duration`
+        seconds. Uses asyncio's debug mode, which adds some overhead of its own
+        """
+        loop = asyncio.get_running_loop()
+        loop.slow_callback_duration = duration
+        loop.set_debug(True)
+        self._watching_callbacks = True
+        logging.info(f"Warning about callbacks slower than {duration} seconds")
+
+    def stop_watching_slow_callbacks(self) -> None:
+        if self._watching_callbacks:
+            asyncio.get_running_loop().set_debug(False)
+            self._watching_callbacks = False
+
+    def install_signal_handlers(self, describe: Callable[[], str]) -> None:
+        """SIGUSR1 logs what `describe` returns and SIGUSR2 toggles the
+        diagnostics. Does nothing where these signals aren't supported
+        """
+        loop = asyncio.get_running_loop()
+        handlers = {"SIGUSR1": lambda: logging.info(describe()), "SIGUSR2": self.toggle}
+        for name, handler in handlers.items():
+            signum = getattr(signal, name, None)
+            if signum is None:
+                continue
+            try:
+                loop.add_signal_handler(signum, handler)
+            except (NotImplementedError, RuntimeError):
+                continue
+            self._signals.append(signum)
+
+    def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signum in self._signals:
+            loop.remove_signal_handler(signum)
+        self._signals.clear()
+        self.stop()
+
+
+def format_snapshot_diff(
+    snapshot: tracemalloc.Snapshot,
+    previous: tracemalloc.Snapshot,
+    limit: int = TRACEMALLOC_TOP,
+) -> str:
+    stats = snapshot.compare_to(previous, "lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [f"Traced memory: {total / 2**20:.1f} MiB, largest changes:"]
+    for stat in stats[:limit]:
+        lines.append(f"  {stat}")
+    return "\n".join(lines)
@@ -0,0 +1,504 @@
+"""Simulates announcing a corpus to size limits before deploying.
+
+The `AnnounceScheduler` used by `ghostseed()` runs unchanged, announcing
+synthetic torrents to in-process trackers on an event loop with a virtual
+clock. Whenever every task is waiting on a timer the clock jumps straight to
+the next one, so a day of announces takes only as long as the CPU needs for
+the scheduling work itself.
+
+    $ python -m ghostseeder.simulation --torrents 100000 --interval 1800 -r 20
+
+Reported:
+
+- startup ramp: time until every torrent was announced once
+- backlog: torrents due and waiting on their tracker's limits, per period
+- lateness: how late regular announces were sent, in seconds and relative
+  to the interval the tracker asked for
+- requests/sec per tracker: on average and in the busiest minute
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import math
+import os
+import random
+import time
+from typing import Coroutine, Optional, Union
+
+import flatbencode
+import httpx
+
+from . import logs
+from .bencode import Metainfo
+from .ghostseeder import (
+    MAX_CONCURRENT_ANNOUNCES,
+    MAX_REQUESTS_PER_SECOND,
+    AnnounceScheduler,
+    TorrentSpoofer,
+)
+from .tracker import MAX_CONNECTIONS_PER_TRACKER, Tracker, TrackerPool
+from .transport import StreamResponse
+
+PEER_ID = "-qB4390-SimulatedRun"
+USERAGENT = "qBittorrent/4.3.9"
+# Virtual seconds between backlog samples:
+SAMPLE_INTERVAL = 60
+# Lateness is tallied in buckets of this many seconds:
+LATENESS_RESOLUTION = 0.1
+
+
+class _VirtualSelector:
+    """Wraps an event loop's selector so that waiting for a timer advances
+    the loop's virtual clock instead of blocking
+    """
+
+    def __init__(self, selector, loop: "VirtualClockLoop"):
+        self._selector = selector
+        self._loop = loop
+
+    def __getattr__(self, name: str):
+        return getattr(self._selector, name)
+
+    def select(self, timeout: Optional[float] = None):
+        events = self._selector.select(0)
+        if events or self._loop._ready or self._loop._stopping:
+            return events
+        if timeout is None:
+            # No timers are scheduled, so only real I/O can wake the loop:
+            return self._selector.select(None)
+        # Nothing else to do until the next timer, which is also the case
+        # when it is due right now but the clock needs to be past it:
+        self._loop.advance(timeout)
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock only moves forward when it would otherwise
+    wait for the next timer, and then by exactly that long
+    """
+
+    def __init__(self, start: float = 0.0):
+        super().__init__()
+        self._now = start
+        self._selector = _VirtualSelector(self._selector, self)
+        # Timers run once the clock is past them rather than when they are
+        # close enough, otherwise the clock never moves when code waits for
+        # a time that is still ahead by less than the resolution:
+        self._clock_resolution = 0
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        """Moves the clock forward by `seconds`, and just past the next timer
+        if that is due by then
+        """
+        now = self._now + seconds
+        if self._scheduled:
+            now = max(now, self._scheduled[0].when())
+        self._now = math.nextafter(now, math.inf)
+
+
+def run_virtual(main: Coroutine):
+    """Like `asyncio.run()` but on a `VirtualClockLoop`"""
+    loop = VirtualClockLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class SimulatedTracker:
+    """Stands in for the HTTP client of a tracker. Answers every announce
+    after `latency` plus up to `jitter` seconds, with a 503 at `error_rate`.
+    Up to `interval_jitter` seconds are added to each interval at random,
+    as many trackers do to spread out announces.
+
+    Connections are modeled as a tracker closing them once idle for more
+    than `keepalive` seconds, to count how many announces needed a new one
+    """
+
+    def __init__(
+        self,
+        interval: int = 1800,
+        min_interval: Optional[int] = None,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        interval_jitter: int = 0,
+        keepalive: float = 15.0,
+    ):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.interval_jitter = interval_jitter
+        self.keepalive = keepalive
+        self._body = self._encode(interval)
+        # Requests received in each minute of virtual time:
+        self.requests: collections.Counter = collections.Counter()
+        self.connections = 0
+        # When each idle connection was last used, oldest first:
+        self._idle: collections.deque[float] = collections.deque()
+
+    def _encode(self, interval: int) -> bytes:
+        body = {b"complete": 1965, b"incomplete": 29, b"interval": interval}
+        if self.min_interval is not None:
+            body[b"min interval"] = self.min_interval
+        return flatbencode.encode(body)
+
+    async def get(
+        self, url: Union[httpx.URL, str], headers: Optional[dict] = None
+    ) -> StreamResponse:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.requests[int(now // 60)] += 1
+        while self._idle and now - self._idle[0] > self.keepalive:
+            self._idle.popleft()
+        if self._idle:
+            self._idle.pop()
+        else:
+            self.connections += 1
+        try:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        finally:
+            self._idle.append(loop.time())
+        if self.error_rate and random.random() < self.error_rate:
+            return StreamResponse(url, 503, {}, b"")
+        if self.interval_jitter:
+            interval = self.interval + random.randint(0, self.interval_jitter)
+            return StreamResponse(url, 200, {}, self._encode(interval))
+        return StreamResponse(url, 200, {}, self._body)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SimulatedScheduler(AnnounceScheduler):
+    """Records when each announce was due and how late it was sent"""
+
+    def __init__(self, *args, num_torrents: int, sample_interval: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clock = asyncio.get_running_loop().time
+        self.num_torrents = num_torrents
+        self.sample_interval = sample_interval
+        self.due_at: dict[TorrentSpoofer, float] = {}
+        self.started = 0
+        self.ramp: Optional[float] = None
+        # Regular announces, bucketed by lateness in `LATENESS_RESOLUTION`:
+        self.lateness: collections.Counter = collections.Counter()
+        self.max_lateness = 0.0
+        self.max_relative_lateness = 0.0
+        self.failures = 0
+        # Largest number of torrents waiting on their trackers in each sample
+        # period:
+        self.backlog: list[int] = []
+
+    def schedule(self, torrent: TorrentSpoofer, delay: float = 0) -> None:
+        self.due_at[torrent] = self.clock() + delay
+        super().schedule(torrent, delay)
+
+    async def _announce(self, tracker: Tracker, torrent: TorrentSpoofer) -> None:
+        late = self.clock() - self.due_at[torrent]
+        interval = torrent.last_interval
+        first = torrent.num_announces == 0
+        if not first:
+            self.lateness[round(late / LATENESS_RESOLUTION)] += 1
+            self.max_lateness = max(self.max_lateness, late)
+            if interval:
+                self.max_relative_lateness = max(
+                    self.max_relative_lateness, late / interval
+                )
+        await super()._announce(tracker, torrent)
+        if torrent.last_error is not None:
+            self.failures += 1
+        if first:
+            self.started += 1
+            if self.started == self.num_torrents:
+                self.ramp = self.clock()
+
+    async def sample_backlog(self) -> None:
+        """Records the largest backlog seen in each sample period"""
+        # Sampled every virtual second since waiting torrents come and go
+        # quickly when the limits keep up:
+        samples_per_period = max(1, int(self.sample_interval))
+        while True:
+            peak = 0
+            for _ in range(samples_per_period):
+                await asyncio.sleep(self.sample_interval / samples_per_period)
+                peak = max(peak, sum(len(tracker.due) for tracker in self.trackers))
+            self.backlog.append(peak)
+
+
+def lateness_percentile(lateness: collections.Counter, q: float) -> float:
+    total = sum(lateness.values())
+    if not total:
+        return math.nan
+    seen = 0
+    for bucket in sorted(lateness):
+        seen += lateness[bucket]
+        if seen >= q * total:
+            return bucket * LATENESS_RESOLUTION
+    return max(lateness) * LATENESS_RESOLUTION
+
+
+async def simulate(
+    num_torrents: int,
+    duration: float,
+    num_trackers: int = 1,
+    max_requests: float = MAX_REQUESTS_PER_SECOND,
+    max_workers: int = MAX_CONCURRENT_ANNOUNCES,
+    max_connections: int = MAX_CONNECTIONS_PER_TRACKER,
+    sample_interval: float = SAMPLE_INTERVAL,
+    coalesce_window: Optional[float] = None,
+    **tracker_options,
+) -> dict:
+    """Announces `num_torrents` spread over `num_trackers` for `duration`
+    virtual seconds and returns the report. Must run on a `VirtualClockLoop`
+
+    tracker_options: Arguments for each `SimulatedTracker`
+    """
+    urls = [
+        f"http://tracker{i}.simulated/0123456789abcdef/announce"
+        for i in range(num_trackers)
+    ]
+    started = time.monotonic()
+    # Per-torrent messages would dwarf the simulation itself:
+    logs.ANNOUNCES.setLevel(logging.ERROR)
+    try:
+        async with TrackerPool(max_requests, max_connections) as trackers:
+            simulated = {}
+            for url in urls:
+                tracker = trackers.get(url)
+                await tracker.client.aclose()
+                tracker.client = simulated[tracker.key] = SimulatedTracker(
+                    **tracker_options
+                )
+                trackers.clients.clients[tracker.key] = tracker.client
+            scheduler = SimulatedScheduler(
+                trackers,
+                6881,
+                max_workers,
+                coalesce_window=coalesce_window,
+                num_torrents=num_torrents,
+                sample_interval=sample_interval,
+            )
+            for i in range(num_torrents):
+                metainfo = Metainfo(
+                    os.urandom(20), urls[i % num_trackers], [], f"Simulated {i}"
+                )
+                scheduler.add(
+                    TorrentSpoofer(
+                        f"simulated/{i}.torrent", PEER_ID, USERAGENT, metainfo
+                    )
+                )
+            scheduler.spawn(scheduler.sample_backlog())
+            runner = asyncio.create_task(scheduler.run())
+            await asyncio.wait([runner], timeout=duration)
+            if runner.done():
+                # The scheduler only returns early on an unexpected error:
+                runner.result()
+            # Skip the final `stopped` announces, they aren't part of the report:
+            scheduler.stop_timeout = 0
+            runner.cancel()
+            logging.disable(logging.WARNING)
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+            finally:
+                logging.disable(logging.NOTSET)
+    finally:
+        logs.ANNOUNCES.setLevel(logging.NOTSET)
+
+    requests = {}
+    for key, tracker in simulated.items():
+        minutes = tracker.requests
+        total = sum(minutes.values())
+        requests[key] = {
+            "average": total / duration,
+            "peak": max(minutes.values(), default=0) / 60,
+            "connections_per_announce": tracker.connections / total if total else 0,
+        }
+    return {
+        "torrents": num_torrents,
+        "trackers": num_trackers,
+        "duration": duration,
+        "elapsed": time.monotonic() - started,
+        "ramp": scheduler.ramp,
+        "started": scheduler.started,
+        "announces": sum(scheduler.lateness.values()) + scheduler.started,
+        "failures": scheduler.failures,
+        "lateness_p50": lateness_percentile(scheduler.lateness, 0.50),
+        "lateness_p99": lateness_percentile(scheduler.lateness, 0.99),
+        "lateness_max": scheduler.max_lateness,
+        "relative_lateness_max": scheduler.max_relative_lateness,
+        "backlog": scheduler.backlog,
+        "sample_interval": sample_interval,
+        "requests": requests,
+    }
+
+
+def format_duration(seconds: float) -> str:
+    seconds = round(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_report(report: dict, periods: int = 24) -> str:
+    if report["ramp"] is None:
+        ramp = (
+            f"not finished, {report['started']:,} of {report['torrents']:,} "
+            "torrents were announced"
+        )
+    else:
+        ramp = f"{format_duration(report['ramp'])} until every torrent was announced"
+    lines = [
+        f"Simulated {format_duration(report['duration'])} of {report['torrents']:,} "
+        f"torrents on {report['trackers']} trackers in {report['elapsed']:.1f}s",
+        f"Announces: {report['announces']:,} sent, {report['failures']:,} failed",
+        f"Startup ramp: {ramp}",
+        f"Lateness of regular announces: p50 {report['lateness_p50']:.1f}s, "
+        f"p99 {report['lateness_p99']:.1f}s, max {report['lateness_max']:.1f}s "
+        f"({report['relative_lateness_max']:.1%} of the interval)",
+        "Requests/sec per tracker:",
+    ]
+    for key, requests in report["requests"].items():
+        lines.append(
+            f"  {key}: {requests['average']:.2f} average, "
+            f"{requests['peak']:.2f} in the busiest minute, "
+            f"{requests['connections_per_announce']:.2f} connections opened per "
+            "announce"
+        )
+
+    backlog = report["backlog"]
+    lines.append("Backlog, largest number of torrents waiting on tracker limits:")
+    # Group the samples into at most `periods` rows:
+    size = max(1, math.ceil(len(backlog) / periods))
+    for start in range(0, len(backlog), size):
+        end = min(start + size, len(backlog))
+        lines.append(
+            f"  {format_duration(start * report['sample_interval']):>7} - "
+            f"{format_duration(end * report['sample_interval']):>7}: "
+            f"{max(backlog[start:end]):,}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--torrents", type=int, default=100000, help="Number of torrents"
+    )
+    parser.add_argument(
+        "--trackers", type=int, default=1, help="Trackers to spread them over"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=86400,
+        help="Virtual seconds to simulate. Optional, defaults to a day",
+    )
+    parser.add_argument(
+        "-r",
+        "--max-requests",
+        type=float,
+        default=MAX_REQUESTS_PER_SECOND,
+        help="Announces per second allowed to each tracker, as in ghostseeder",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_CONCURRENT_ANNOUNCES,
+        help="Announces in flight at once, as in ghostseeder",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=MAX_CONNECTIONS_PER_TRACKER,
+        help="Connections per tracker, as in ghostseeder",
+    )
+    parser.add_argument(
+        "--interval", type=int, default=1800, help="Announce interval handed out"
+    )
+    parser.add_argument(
+        "--min-interval", type=int, default=None, help="Minimum announce interval"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds to answer an announce"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Up to this many extra seconds added at random",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of announces answered with 503",
+    )
+    parser.add_argument(
+        "--interval-jitter",
+        type=int,
+        default=0,
+        help="Up to this many seconds added to each interval at random",
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        default=15.0,
+        help="Seconds trackers keep idle connections open",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Coalescing window, as in ghostseeder",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=SAMPLE_INTERVAL,
+        help="Virtual seconds between backlog samples",
+    )
+    args = parser.parse_args()
+
+    report = run_virtual(
+        simulate(
+            args.torrents,
+            args.duration,
+            args.trackers,
+            args.max_requests,
+            args.workers,
+            args.max_connections,
+            args.sample_interval,
+            args.coalesce,
+            interval=args.interval,
+            min_interval=args.min_interval,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            interval_jitter=args.interval_jitter,
+            keepalive=args.keepalive,
+        )
+    )
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
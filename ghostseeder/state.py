@@ -0,0 +1,143 @@
+"""Durable record of each torrent's announce state.
+
+Without it every restart would send `event=started` for every torrent at
+once and the whole folder would queue up behind the rate limiter. Instead
+the time of each torrent's last announce, the interval the tracker handed
+out and the last event sent are journaled to SQLite, and on the next start
+each torrent resumes at its remaining due time.
+
+Writes are buffered in memory and flushed in batches, so the journal costs
+one transaction every few seconds rather than one per announce.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+# Bump whenever the table layout or the meaning of a column changes so stale
+# journals are discarded rather than misread:
+SCHEMA_VERSION = 2
+# Seconds between writes of buffered announce state:
+FLUSH_INTERVAL = 5
+# Entries for torrents that haven't been announced in this long are dropped
+# when the journal is opened (30 days):
+MAX_AGE = 30 * 24 * 3600
+
+
+def default_state_path() -> str:
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "state"
+    )
+    return os.path.join(state_home, "ghostseeder", "announces.sqlite")
+
+
+class AnnounceState(NamedTuple):
+    # Unix time of the last announce and seconds until the next one was due:
+    announced_at: float
+    interval: float
+    num_announces: int
+    # Last event sent: "started", "regular" or "stopped"
+    event: str
+
+    @property
+    def due_at(self) -> float:
+        return self.announced_at + self.interval
+
+
+class AnnounceJournal:
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # Worker processes share the database, so let readers and a writer
+        # proceed concurrently and wait out each other's write locks:
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS announces")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS announces (
+                key BLOB PRIMARY KEY,
+                announced_at REAL NOT NULL,
+                interval REAL NOT NULL,
+                num_announces INTEGER NOT NULL,
+                event TEXT NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            "DELETE FROM announces WHERE announced_at < ?", (time.time() - MAX_AGE,)
+        )
+        self.connection.commit()
+
+        self._entries = {
+            key: AnnounceState(*row)
+            for key, *row in self.connection.execute("SELECT * FROM announces")
+        }
+        # Keyed like `_entries`, `None` for deleted entries:
+        self._pending: dict[bytes, Optional[AnnounceState]] = {}
+        logging.info(
+            f"Loaded announce state of {len(self._entries)} torrents from '{path}'"
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __enter__(self) -> "AnnounceJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+    def get(self, key: bytes) -> Optional[AnnounceState]:
+        return self._entries.get(key)
+
+    def record(
+        self, key: bytes, interval: float, num_announces: int, event: str
+    ) -> None:
+        """Buffers the state of an announce that was just sent. `key`
+        identifies the torrent, see `ghostseeder.torrent_key()`
+        """
+        state = AnnounceState(time.time(), interval, num_announces, event)
+        self._entries[key] = self._pending[key] = state
+
+    def mark_stopped(self, key: bytes) -> None:
+        """Records that the tracker was told we stopped seeding. The time the
+        next announce is due is kept
+        """
+        state = self._entries.get(key)
+        if state is not None:
+            state = state._replace(event="stopped")
+            self._entries[key] = self._pending[key] = state
+
+    def forget(self, key: bytes) -> None:
+        """Drops the state of a torrent that is no longer being seeded"""
+        self._entries.pop(key, None)
+        self._pending[key] = None
+
+    def flush(self) -> None:
+        """Writes buffered changes to disk"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO announces VALUES (?, ?, ?, ?, ?)",
+            ((key, *state) for key, state in pending.items() if state),
+        )
+        self.connection.executemany(
+            "DELETE FROM announces WHERE key = ?",
+            ((key,) for key, state in pending.items() if state is None),
+        )
+        self.connection.commit()
+
+    async def flush_periodically(self, interval: float = FLUSH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
@@ -0,0 +1,321 @@
+"""Runs ghostseeder across several worker processes.
+
+Each worker runs `ghostseed()` on the whole folder but only announces the
+torrents in its shard, chosen by hashing the infohash, so shards stay stable
+across restarts and every torrent is announced by exactly one worker. All
+workers announce with the same peer id.
+
+The per-tracker rate limit, connection limit and in-flight announce limit
+are split evenly between workers, so together they stay within the budget
+a single process would have. Since torrents are spread uniformly across
+shards, each worker's share of every tracker's torrents is about the same.
+
+Worker log records are forwarded to the supervisor and written out from
+there. If metrics are enabled, each worker serves its own on the ports
+following the metrics port and the supervisor serves all of them combined,
+labelled by worker. Workers that exit unexpectedly are restarted with the
+same shard. SIGUSR1 and SIGUSR2 are forwarded to every worker. Each worker
+serves its own admin API, on the admin socket path suffixed with `.<index>`
+or on the admin port + index.
+
+With several profiles, every worker runs all of them on its shard of each
+profile's folder, and each profile's rate limit is split the same way.
+"""
+
+import asyncio
+import logging
+import logging.handlers
+import math
+import multiprocessing
+import os
+import signal
+import time
+from typing import Optional
+
+import httpx
+import semver
+
+from . import metrics
+from .logs import JSONFormatter, output_handlers
+from .ghostseeder import (
+    MAX_CONCURRENT_ANNOUNCES,
+    MAX_REQUESTS_PER_SECOND,
+    STOP_TIMEOUT,
+    TorrentClient,
+    generate_peer_id,
+    ghostseed,
+    ghostseed_profiles,
+)
+from .tracker import MAX_CONNECTIONS_PER_TRACKER
+from .transport import run
+
+# Seconds to wait before restarting a crashed worker. Doubles while the
+# worker keeps crashing, up to `MAX_RESTART_DELAY`:
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+# A worker that ran at least this long before exiting is considered healthy
+# again, resetting its restart delay:
+HEALTHY_UPTIME = 60
+# Seconds between checks on the worker processes:
+MONITOR_INTERVAL = 0.5
+# Extra time given to workers to exit on top of their `stop_timeout`:
+EXIT_GRACE_PERIOD = 5
+
+WORKER_RESTARTS = metrics.Counter(
+    "ghostseeder_worker_restarts",
+    "Worker processes restarted after exiting unexpectedly",
+    ["worker"],
+)
+
+
+def run_worker(index: int, options: dict, log_queue) -> None:
+    """Entry point of a worker process. `options` are the arguments of
+    `ghostseed()`, or of `ghostseed_profiles()` if they include `profiles`, and
+    the `event_loop` to run it on
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    # Ctrl+C reaches every process in the terminal's process group. Only the
+    # supervisor reacts to it and then stops the workers with SIGTERM:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    event_loop = options.pop("event_loop", "asyncio")
+    main = ghostseed_profiles if "profiles" in options else ghostseed
+    run(main(**options), event_loop)
+
+
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at: Optional[float] = None
+
+
+class Supervisor:
+    def __init__(
+        self,
+        num_workers: int,
+        options: dict,
+        metrics_port: Optional[int] = None,
+        metrics_host: str = "127.0.0.1",
+        target=run_worker,
+        event_loop: str = "asyncio",
+    ):
+        """options: Keyword arguments for `ghostseed()` shared by every worker.
+        Limits in them are for all workers combined
+        event_loop: Event loop the workers run on, see `transport.run()`
+        """
+        self.num_workers = num_workers
+        self.options = options
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.target = target
+        self.event_loop = event_loop
+        self.workers = [Worker(index) for index in range(num_workers)]
+        self.stop_timeout = options.get("stop_timeout") or STOP_TIMEOUT
+        self._context = multiprocessing.get_context("spawn")
+        self._log_queue = self._context.Queue()
+
+    def worker_options(self, index: int) -> dict:
+        """Returns the `ghostseed()` arguments of the worker with `index`"""
+        options = dict(self.options)
+        n = self.num_workers
+        options["shard"] = (index, n)
+        if "profiles" in options:
+            options["profiles"] = [
+                profile._replace(
+                    max_requests=(profile.max_requests or MAX_REQUESTS_PER_SECOND) / n
+                )
+                for profile in options["profiles"]
+            ]
+        else:
+            options["max_requests"] = (
+                options.get("max_requests") or MAX_REQUESTS_PER_SECOND
+            ) / n
+        options["max_connections"] = max(
+            1,
+            math.ceil(
+                (options.get("max_connections") or MAX_CONNECTIONS_PER_TRACKER) / n
+            ),
+        )
+        options["max_workers"] = max(
+            1, math.ceil((options.get("max_workers") or MAX_CONCURRENT_ANNOUNCES) / n)
+        )
+        options["parse_processes"] = max(1, (self._context.cpu_count() or 1) // n)
+        if self.metrics_port is not None:
+            options["metrics_host"] = "127.0.0.1"
+            options["metrics_port"] = self.metrics_port + 1 + index
+        # Each worker serves the admin API for the torrents in its shard:
+        if options.get("admin_socket") is not None:
+            options["admin_socket"] = f"{options['admin_socket']}.{index}"
+        if options.get("admin_port") is not None:
+            options["admin_port"] += index
+        return options
+
+    def start(self, worker: Worker) -> None:
+        worker.process = self._context.Process(
+            target=self.target,
+            args=(
+                worker.index,
+                dict(self.worker_options(worker.index), event_loop=self.event_loop),
+                self._log_queue,
+            ),
+            name=f"worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logging.info(
+            f"Started worker {worker.index} (pid {worker.process.pid}) for shard "
+            f"{worker.index + 1} of {self.num_workers}"
+        )
+
+    def check(self, worker: Worker) -> None:
+        """Schedules a restart of `worker` if it exited and restarts it once
+        its delay has passed
+        """
+        now = time.monotonic()
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                WORKER_RESTARTS.labels(str(worker.index)).inc()
+                self.start(worker)
+            return
+        if worker.process.is_alive():
+            return
+        if now - worker.started_at >= HEALTHY_UPTIME:
+            worker.restart_delay = RESTART_DELAY
+        logging.warning(
+            f"Worker {worker.index} exited with code {worker.process.exitcode}, "
+            f"restarting it in {worker.restart_delay} seconds"
+        )
+        worker.restart_at = now + worker.restart_delay
+        worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+
+    async def collect_metrics(self) -> str:
+        """Fetches and combines the metrics of every worker"""
+
+        async def fetch(client: httpx.AsyncClient, index: int) -> str:
+            port = self.metrics_port + 1 + index
+            response = await client.get(f"http://127.0.0.1:{port}/metrics")
+            response.raise_for_status()
+            return response.text
+
+        async with httpx.AsyncClient(timeout=5) as client:
+            results = await asyncio.gather(
+                *(fetch(client, worker.index) for worker in self.workers),
+                return_exceptions=True,
+            )
+        texts = {}
+        for worker, result in zip(self.workers, results):
+            if isinstance(result, Exception):
+                logging.debug(f"Unable to collect metrics of worker {worker.index}")
+                continue
+            texts[str(worker.index)] = result
+        return metrics.merge(texts, "worker") + WORKER_RESTARTS.render()
+
+    async def run(self) -> None:
+        """Runs the workers until cancelled, then stops them"""
+        listener = logging.handlers.QueueListener(
+            self._log_queue, *logging.getLogger().handlers, respect_handler_level=True
+        )
+        listener.start()
+        metrics_server = None
+        try:
+            if self.metrics_port is not None:
+                metrics_server = await metrics.serve_metrics(
+                    self.metrics_host, self.metrics_port, self.collect_metrics
+                )
+            for worker in self.workers:
+                self.start(worker)
+            while True:
+                await asyncio.sleep(MONITOR_INTERVAL)
+                for worker in self.workers:
+                    self.check(worker)
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+            await self.stop()
+            listener.stop()
+
+    def forward(self, signum: int) -> None:
+        """Sends `signum` to every running worker"""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signum)
+
+    async def stop(self) -> None:
+        running = [
+            worker.process
+            for worker in self.workers
+            if worker.process is not None and worker.process.is_alive()
+        ]
+        logging.info(f"Stopping {len(running)} workers")
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + self.stop_timeout + EXIT_GRACE_PERIOD
+        while any(process.is_alive() for process in running):
+            if time.monotonic() > deadline:
+                for process in running:
+                    if process.is_alive():
+                        logging.warning(f"Killing {process.name} (pid {process.pid})")
+                        process.kill()
+                break
+            await asyncio.sleep(0.1)
+        for process in running:
+            process.join()
+
+
+async def supervise(num_workers: int, event_loop: str = "asyncio", **options) -> None:
+    """Like `ghostseed()`, or `ghostseed_profiles()` if `options` include
+    `profiles`, but spreads the torrents over `num_workers` processes, each
+    running on `event_loop`
+    """
+    # Generated once so every worker announces as the same client:
+    if "profiles" in options:
+        options["profiles"] = [
+            profile._replace(
+                peer_id=profile.peer_id
+                or generate_peer_id(
+                    TorrentClient.qBittorrent,
+                    semver.VersionInfo.parse(profile.version),
+                    profile.seed,
+                ),
+                seed=None,
+            )
+            for profile in options["profiles"]
+        ]
+    else:
+        version_info = semver.VersionInfo.parse(options["version"])
+        options["peer_id"] = generate_peer_id(
+            TorrentClient.qBittorrent, version_info, options.pop("seed", None)
+        )
+    for handler in output_handlers():
+        if isinstance(handler.formatter, JSONFormatter):
+            # Already tells processes apart:
+            continue
+        handler.setFormatter(
+            logging.Formatter(
+                "%(asctime)s %(levelname)-8s [%(processName)s] %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
+        )
+    metrics_port = options.pop("metrics_port", None)
+    metrics_host = options.pop("metrics_host", "127.0.0.1")
+    supervisor = Supervisor(
+        num_workers, options, metrics_port, metrics_host, event_loop=event_loop
+    )
+    runner = asyncio.create_task(supervisor.run())
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, runner.cancel)
+        # Diagnostics run in the workers, see `profiling`:
+        for signum in (signal.SIGUSR1, signal.SIGUSR2):
+            loop.add_signal_handler(signum, supervisor.forward, signum)
+    except (NotImplementedError, AttributeError):
+        # Not supported by the event loop on Windows
+        pass
+    try:
+        await runner
+    except asyncio.CancelledError:
+        pass
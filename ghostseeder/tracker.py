@@ -0,0 +1,307 @@
+"""Per-tracker announce state.
+
+Torrents are grouped by the host of their announce url. Each tracker gets
+its own rate limiter, HTTP connection pool and adaptive concurrency limit so
+that a slow or rate limiting tracker only holds back its own torrents.
+`udp://` trackers share a single `UDPTrackerClient` instead of an HTTP pool.
+The HTTP client is created by the chosen transport, see `transport`.
+"""
+import asyncio
+import collections
+import enum
+import logging
+import random
+import ssl
+from typing import Optional, Union
+from urllib.parse import urlsplit
+
+import httpx
+from asynciolimiter import StrictLimiter
+
+from .transport import StreamClient, create_client, create_ssl_context
+from .udp import UDPTrackerClient
+
+MAX_CONNECTIONS_PER_TRACKER = 16
+MAX_KEEPALIVE_PER_TRACKER = 8
+# A request slower than this multiple of the fastest recently observed
+# request is taken as a sign the tracker is saturated:
+LATENCY_TOLERANCE = 2.0
+# Consecutive failed announces after which a tracker is considered down:
+BREAKER_THRESHOLD = 5
+# How long announces to a down tracker are suspended before probing it
+# again. Doubles after every failed probe:
+BREAKER_COOLDOWN = 60
+BREAKER_MAX_COOLDOWN = 3600
+
+
+def tracker_key(announce_url: str) -> str:
+    """Returns the `scheme://host:port` that identifies a tracker"""
+    url = urlsplit(announce_url)
+    return f"{url.scheme}://{url.netloc.rpartition('@')[2]}"
+
+
+class AdaptiveConcurrency:
+    """Limits concurrent requests to a tracker and adapts the limit to the
+    tracker's observed latency: additive increase while requests are fast,
+    multiplicative decrease when they slow down or fail
+    """
+
+    def __init__(self, initial: int = 2, minimum: int = 1, maximum: int = 16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self.min_latency: Optional[float] = None
+        self._released = asyncio.Event()
+
+    async def acquire(self) -> None:
+        while self.in_flight >= int(self.limit):
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, ok: bool = True) -> None:
+        """Frees a slot. The limit is adjusted from the request's `latency`
+        and outcome, or left alone if no request was made
+        """
+        self.in_flight -= 1
+        if latency is None:
+            pass
+        elif not ok:
+            self.limit = max(self.minimum, self.limit / 2)
+        else:
+            if self.min_latency is None:
+                self.min_latency = latency
+            else:
+                # Let the baseline drift upwards so a lasting change in the
+                # network path eventually becomes the new normal:
+                self.min_latency = min(latency, self.min_latency * 1.05)
+            if latency <= self.min_latency * LATENCY_TOLERANCE:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit * 0.9)
+        self._released.set()
+
+
+class BreakerState(enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Suspends announces to a tracker that keeps failing.
+
+    After `threshold` consecutive failures the breaker opens and no announces
+    are sent for a cooldown period. Then a single probe announce is let
+    through: if it succeeds announces resume, otherwise the breaker opens
+    again with twice the cooldown
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = BREAKER_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN,
+        max_cooldown: float = BREAKER_MAX_COOLDOWN,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.reopens_at = 0.0
+        self._changed = asyncio.Event()
+
+    async def acquire(self) -> None:
+        """Waits until an announce may be sent to the tracker"""
+        loop = asyncio.get_running_loop()
+        while self.state is not BreakerState.CLOSED:
+            if self.state is BreakerState.OPEN:
+                timeout = self.reopens_at - loop.time()
+                if timeout <= 0:
+                    # The caller's announce is the probe:
+                    self.state = BreakerState.HALF_OPEN
+                    return
+            else:
+                # A probe is in flight:
+                timeout = None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def cancel_probe(self) -> None:
+        """Lets the next `acquire()` send the probe instead, when the one it
+        was meant for won't be sent after all
+        """
+        if self.state is BreakerState.HALF_OPEN:
+            self.state = BreakerState.OPEN
+            self.reopens_at = asyncio.get_running_loop().time()
+            self._changed.set()
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            if self.state is not BreakerState.CLOSED:
+                logging.info(f"Tracker {self.name} recovered, resuming announces")
+            self.state = BreakerState.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+        else:
+            self.failures += 1
+            if self.state is BreakerState.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state is BreakerState.CLOSED and self.failures >= self.threshold:
+                self._open()
+        self._changed.set()
+
+    def _open(self) -> None:
+        # Jitter keeps many instances from probing a recovering tracker in
+        # lockstep:
+        cooldown = self.cooldown * random.uniform(0.75, 1.25)
+        self.reopens_at = asyncio.get_running_loop().time() + cooldown
+        self.state = BreakerState.OPEN
+        logging.warning(
+            f"Tracker {self.name} failed {self.failures} announces in a row, "
+            f"suspending its announces for {cooldown:.0f} seconds"
+        )
+
+
+class Tracker:
+    def __init__(
+        self,
+        key: str,
+        max_requests: float,
+        client: Union[httpx.AsyncClient, StreamClient, UDPTrackerClient],
+        max_connections: int = MAX_CONNECTIONS_PER_TRACKER,
+    ):
+        self.key = key
+        self.limit = StrictLimiter(max_requests)
+        # Owned by the `TrackerClients` it came from:
+        self.client = client
+        self.concurrency = AdaptiveConcurrency(maximum=max_connections)
+        self.breaker = CircuitBreaker(key)
+        # Cleared while announces to the tracker are paused by the operator:
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        # Torrents that are due and waiting on this tracker's limits:
+        self.due: collections.deque = collections.deque()
+
+    def __repr__(self) -> str:
+        return f"Tracker({self.key!r})"
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    async def aclose(self) -> None:
+        self.limit.close()
+
+
+class TrackerClients:
+    """Lazily creates the HTTP client of each announce host. UDP trackers
+    share one socket, and every client resumes TLS sessions from the same
+    context. Can be shared by several `TrackerPool`s so that they announce
+    over the same connections
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS_PER_TRACKER,
+        max_keepalive: int = MAX_KEEPALIVE_PER_TRACKER,
+        transport: str = "httpx",
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.transport = transport
+        self.clients: dict[str, Union[httpx.AsyncClient, StreamClient]] = {}
+        self.udp_client = UDPTrackerClient()
+        # Remembers the TLS session of every tracker host to resume it later:
+        self.ssl_context = create_ssl_context()
+
+    def get(self, key: str) -> Union[httpx.AsyncClient, StreamClient, UDPTrackerClient]:
+        if key.startswith("udp://"):
+            return self.udp_client
+        client = self.clients.get(key)
+        if client is None:
+            logging.info(f"Creating connection pool for tracker {key}")
+            client = self.clients[key] = create_client(
+                self.transport,
+                self.max_connections,
+                min(self.max_keepalive, self.max_connections),
+                self.ssl_context,
+            )
+        return client
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+        self.udp_client.close()
+
+
+class TrackerPool:
+    """Lazily creates one `Tracker` per announce host. Its clients are
+    created for the pool unless shared `clients` are given, in which case
+    closing the pool leaves them open
+    """
+
+    def __init__(
+        self,
+        max_requests: float,
+        max_connections: int = MAX_CONNECTIONS_PER_TRACKER,
+        max_keepalive: int = MAX_KEEPALIVE_PER_TRACKER,
+        transport: str = "httpx",
+        clients: Optional[TrackerClients] = None,
+    ):
+        self.max_requests = max_requests
+        self.max_connections = max_connections
+        self.trackers: dict[str, Tracker] = {}
+        self._owns_clients = clients is None
+        if clients is None:
+            clients = TrackerClients(max_connections, max_keepalive, transport)
+        self.clients = clients
+
+    def __len__(self) -> int:
+        return len(self.trackers)
+
+    def __iter__(self):
+        return iter(self.trackers.values())
+
+    @property
+    def udp_client(self) -> UDPTrackerClient:
+        return self.clients.udp_client
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        return self.clients.ssl_context
+
+    def set_max_requests(self, max_requests: float) -> None:
+        """Changes the rate limit of every tracker, including those created
+        later
+        """
+        self.max_requests = max_requests
+        for tracker in self:
+            tracker.limit.rate = max_requests
+
+    def get(self, announce_url: str) -> Tracker:
+        key = tracker_key(announce_url)
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            tracker = self.trackers[key] = Tracker(
+                key, self.max_requests, self.clients.get(key), self.max_connections
+            )
+        return tracker
+
+    async def __aenter__(self) -> "TrackerPool":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(tracker.aclose() for tracker in self))
+        if self._owns_clients:
+            await self.clients.aclose()
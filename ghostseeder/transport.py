@@ -0,0 +1,513 @@
+"""HTTP transports for announcing to trackers.
+
+Announces are tiny GET requests, so their cost is almost entirely client
+overhead and connection setup rather than data transfer. Two clients with
+the `get(url, headers=...)` and `aclose()` methods `TorrentSpoofer.announce`
+uses are available:
+
+- `httpx`: `httpx.AsyncClient`, the default
+- `stream`: `StreamClient`, a minimal HTTP/1.1 client on asyncio streams.
+  Requests are pipelined over its keep-alive connections, DNS lookups are
+  cached and idle connections are kept around for as long as the gaps
+  between announces to the tracker call for
+
+Announces to a tracker are often minutes apart, so connections tend to have
+gone idle and closed by the next one. Both clients use `ResumingSSLContext`,
+which resumes the TLS session of the previous connection to a host instead
+of doing a full handshake. `run()` runs the event loop on `uvloop` if asked.
+"""
+
+import asyncio
+import logging
+import socket
+import ssl
+import time
+from typing import Coroutine, Optional, Union
+
+import certifi
+import httpx
+
+from . import metrics
+
+TRANSPORTS = ("httpx", "stream")
+EVENT_LOOPS = ("asyncio", "uvloop")
+# Seconds allowed for connecting and for receiving a response, like httpx:
+TIMEOUT = 5.0
+# Seconds a resolved tracker address is reused. The system resolver doesn't
+# report record TTLs, so this stays well below the usual ones:
+DNS_TTL = 300
+# Idle connections are kept for this multiple of the average gap between
+# requests, within the bounds below:
+KEEPALIVE_GAP_FACTOR = 2.0
+MIN_KEEPALIVE_EXPIRY = 5.0
+MAX_KEEPALIVE_EXPIRY = 300.0
+# Weight of the latest sample in the moving averages of request gaps and
+# full handshake durations:
+SMOOTHING = 0.2
+
+
+def _label(value: bool) -> str:
+    return "true" if value else "false"
+
+
+class _ResumableSSLObject(ssl.SSLObject):
+    """Reports to its `ResumingSSLContext` once the handshake is done"""
+
+    _handshake_started: Optional[float] = None
+
+    def do_handshake(self) -> None:
+        if self._handshake_started is None:
+            self._handshake_started = time.monotonic()
+        # Raises `ssl.SSLWantReadError` until the server's reply has arrived:
+        super().do_handshake()
+        self.context.handshake_done(self, time.monotonic() - self._handshake_started)
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client SSL context that offers the session of the latest connection
+    to a host when connecting to it again, so the server can resume it with
+    an abbreviated handshake instead of a full one. Works with any client
+    that wraps its connections with `wrap_bio()`, like asyncio and httpx do
+    """
+
+    sslobject_class = _ResumableSSLObject
+
+    def __new__(cls, protocol: int = ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT):
+        super().__init__()
+        # TLS 1.3 session tickets arrive after the handshake, so the session
+        # is only taken from the connection once the next one is opened:
+        self._latest: dict[str, ssl.SSLObject] = {}
+        # Moving average of the full handshakes with each host:
+        self._full_handshake: dict[str, float] = {}
+
+    def wrap_bio(
+        self,
+        incoming: ssl.MemoryBIO,
+        outgoing: ssl.MemoryBIO,
+        server_side: bool = False,
+        server_hostname: Union[str, bytes, None] = None,
+        session: Optional[ssl.SSLSession] = None,
+    ) -> ssl.SSLObject:
+        if session is None and not server_side:
+            # httpx passes the host name encoded:
+            host = server_hostname or ""
+            if isinstance(host, bytes):
+                host = host.decode("ascii")
+            latest = self._latest.get(host)
+            if latest is not None:
+                session = latest.session
+        return super().wrap_bio(
+            incoming, outgoing, server_side, server_hostname, session
+        )
+
+    def handshake_done(self, sslobj: ssl.SSLObject, duration: float) -> None:
+        host = sslobj.server_hostname or ""
+        self._latest[host] = sslobj
+        resumed = sslobj.session_reused
+        metrics.TLS_HANDSHAKE_DURATION.labels(host, _label(resumed)).observe(duration)
+        full = self._full_handshake.get(host)
+        if not resumed:
+            self._full_handshake[host] = (
+                duration if full is None else full + SMOOTHING * (duration - full)
+            )
+        elif full is not None:
+            metrics.CONNECT_TIME_SAVED.labels(host, "tls").inc(
+                max(0.0, full - duration)
+            )
+
+
+def create_ssl_context() -> ResumingSSLContext:
+    """Verifies certificates against the CA bundle httpx uses by default"""
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_verify_locations(certifi.where())
+    return context
+
+
+class DNSCache:
+    """Caches the resolved addresses of each host for `ttl` seconds"""
+
+    def __init__(self, ttl: float = DNS_TTL):
+        self.ttl = ttl
+        # (host, port) -> (expiry, addresses, seconds the lookup took):
+        self._entries: dict[tuple[str, int], tuple[float, list, float]] = {}
+
+    async def resolve(self, host: str, port: int) -> list[tuple[int, tuple]]:
+        """Returns the `(family, sockaddr)` of every address of `host`"""
+        entry = self._entries.get((host, port))
+        if entry is not None and entry[0] > time.monotonic():
+            metrics.DNS_LOOKUPS.labels(host, _label(True)).inc()
+            metrics.CONNECT_TIME_SAVED.labels(host, "dns").inc(entry[2])
+            return entry[1]
+        metrics.DNS_LOOKUPS.labels(host, _label(False)).inc()
+        start = time.monotonic()
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+        end = time.monotonic()
+        addresses = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+        self._entries[host, port] = (end + self.ttl, addresses, end - start)
+        return addresses
+
+    def invalidate(self, host: str, port: int) -> None:
+        self._entries.pop((host, port), None)
+
+
+class StreamResponse:
+    __slots__ = ("url", "status_code", "headers", "content")
+
+    def __init__(
+        self, url: httpx.URL, status_code: int, headers: dict[str, str], content: bytes
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def __repr__(self) -> str:
+        return f"<StreamResponse [{self.status_code}]>"
+
+    def raise_for_status(self) -> None:
+        """Raises `httpx.HTTPStatusError` like `httpx.Response` does"""
+        if 200 <= self.status_code < 300:
+            return
+        httpx.Response(
+            self.status_code,
+            headers=self.headers,
+            content=self.content,
+            request=httpx.Request("GET", self.url),
+        ).raise_for_status()
+
+
+class _ConnectionLost(Exception):
+    """The connection closed before the response to a request began, e.g.
+    because the server timed it out while idle. Safe to retry
+    """
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.in_flight = 0
+        self.reusable = True
+        self.idle_since = time.monotonic()
+        # Done once the response to the latest request sent has been read.
+        # Pipelined responses arrive in order, so each request waits for the
+        # one before it:
+        self._last_read: Optional[asyncio.Future] = None
+
+    @property
+    def closed(self) -> bool:
+        return not self.reusable or self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self) -> None:
+        self.reusable = False
+        self.writer.close()
+
+    async def request(
+        self, data: bytes, timeout: float
+    ) -> tuple[int, dict[str, str], bytes]:
+        previous = self._last_read
+        done = self._last_read = asyncio.get_running_loop().create_future()
+        self.in_flight += 1
+        try:
+            self.writer.write(data)
+            if previous is not None:
+                # Shielded so a cancelled request doesn't cancel the wait of
+                # the requests pipelined after it:
+                await asyncio.shield(previous)
+            if not self.reusable:
+                raise _ConnectionLost()
+            return await asyncio.wait_for(self._read_response(), timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            raise httpx.ReadTimeout("Timed out waiting for the tracker's response")
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            self.close()
+            raise httpx.ReadError(f"Connection to the tracker broke: {exc!r}")
+        except (asyncio.LimitOverrunError, ValueError) as exc:
+            self.close()
+            raise httpx.RemoteProtocolError(f"Malformed response: {exc!r}")
+        except BaseException:
+            # Responses to the requests pipelined after this one can't be
+            # told apart from its own anymore:
+            self.close()
+            raise
+        finally:
+            self.in_flight -= 1
+            self.idle_since = time.monotonic()
+            done.set_result(None)
+
+    async def _read_response(self) -> tuple[int, dict[str, str], bytes]:
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as exc:
+            if exc.partial:
+                raise
+            raise _ConnectionLost()
+        except ConnectionError:
+            raise _ConnectionLost()
+        status_line, *lines = head[:-4].decode("latin-1").split("\r\n")
+        version, status, *_ = status_line.split(" ", 2)
+        status_code = int(status)
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        if connection == "close" or (
+            version == "HTTP/1.0" and connection != "keep-alive"
+        ):
+            self.reusable = False
+        if status_code in (204, 304) or status_code < 200:
+            content = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked()
+        elif "content-length" in headers:
+            content = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            # The body ends when the server closes the connection:
+            content = await self.reader.read()
+            self.reusable = False
+        return status_code, headers, content
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Skip any trailers:
+                while await self.reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append((await self.reader.readexactly(size + 2))[:-2])
+
+
+class StreamClient:
+    """Minimal HTTP/1.1 GET client on asyncio streams, a faster alternative
+    to `httpx.AsyncClient` for announces.
+
+    Up to `max_connections` are opened per host. Once they are all busy,
+    further requests are pipelined behind the ones in flight. A request
+    that finds its reused connection closed by the server is retried once
+    on a new connection. Idle connections are closed after a few times the
+    average gap between requests, so a tracker announced to every couple of
+    seconds keeps its connections while one announced to hourly doesn't
+    hold connections the server has long given up on
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 16,
+        max_keepalive: int = 8,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        dns: Optional[DNSCache] = None,
+        timeout: float = TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.ssl_context = ssl_context or create_ssl_context()
+        self.dns = dns or DNSCache()
+        self.timeout = timeout
+        self.keepalive_expiry = MIN_KEEPALIVE_EXPIRY
+        self._pools: dict[tuple[str, str, int], list[_Connection]] = {}
+        # Done once each connection being opened is ready or failed:
+        self._opening: dict[tuple[str, str, int], list[asyncio.Future]] = {}
+        self._last_request: Optional[float] = None
+        self._average_gap: Optional[float] = None
+
+    async def __aenter__(self) -> "StreamClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def get(
+        self,
+        url: Union[httpx.URL, str],
+        headers: Optional[dict[str, str]] = None,
+    ) -> StreamResponse:
+        if not isinstance(url, httpx.URL):
+            url = httpx.URL(url)
+        self._observe_request()
+        request = b"GET %s HTTP/1.1\r\nHost: %s\r\n" % (url.raw_path, url.netloc)
+        if headers:
+            request += "".join(
+                f"{name}: {value}\r\n" for name, value in headers.items()
+            ).encode("latin-1")
+        request += b"\r\n"
+
+        scheme = url.scheme
+        key = (scheme, url.host, url.port or (443 if scheme == "https" else 80))
+        for attempt in range(2):
+            connection = await self._acquire(key, fresh=attempt > 0)
+            try:
+                status_code, response_headers, content = await connection.request(
+                    request, self.timeout
+                )
+            except _ConnectionLost:
+                if attempt > 0:
+                    raise httpx.RemoteProtocolError(
+                        "Server disconnected without sending a response"
+                    )
+                logging.debug("Connection to %s:%d was closed, reconnecting", *key[1:])
+                continue
+            finally:
+                self._release(key, connection)
+            return StreamResponse(url, status_code, response_headers, content)
+        raise AssertionError("unreachable")
+
+    def _observe_request(self) -> None:
+        """Tunes how long idle connections are kept to the request cadence"""
+        now = time.monotonic()
+        if self._last_request is not None:
+            gap = now - self._last_request
+            average = self._average_gap
+            average = self._average_gap = (
+                gap if average is None else average + SMOOTHING * (gap - average)
+            )
+            self.keepalive_expiry = min(
+                MAX_KEEPALIVE_EXPIRY,
+                max(MIN_KEEPALIVE_EXPIRY, KEEPALIVE_GAP_FACTOR * average),
+            )
+        self._last_request = now
+
+    async def _acquire(self, key: tuple[str, str, int], fresh: bool) -> _Connection:
+        """Returns an idle connection, a new one if the limit allows or else
+        the connection with the fewest requests in flight to pipeline on
+        """
+        pool = self._pools.setdefault(key, [])
+        opening = self._opening.setdefault(key, [])
+        while True:
+            now = time.monotonic()
+            for connection in list(pool):
+                if connection.closed or (
+                    connection.in_flight == 0
+                    and now - connection.idle_since > self.keepalive_expiry
+                ):
+                    pool.remove(connection)
+                    connection.close()
+            if not fresh:
+                for connection in pool:
+                    if connection.in_flight == 0:
+                        return connection
+            if fresh or len(pool) + len(opening) < self.max_connections:
+                opened = asyncio.get_running_loop().create_future()
+                opening.append(opened)
+                try:
+                    connection = await self._connect(*key)
+                finally:
+                    opening.remove(opened)
+                    opened.set_result(None)
+                pool.append(connection)
+                return connection
+            if pool:
+                return min(pool, key=lambda connection: connection.in_flight)
+            # Every connection is still being opened:
+            await asyncio.wait(opening)
+
+    def _release(self, key: tuple[str, str, int], connection: _Connection) -> None:
+        pool = self._pools.get(key, [])
+        if connection.closed:
+            if connection in pool:
+                pool.remove(connection)
+            connection.close()
+        elif connection.in_flight == 0:
+            idle = [other for other in pool if other.in_flight == 0]
+            if len(idle) > self.max_keepalive:
+                pool.remove(connection)
+                connection.close()
+
+    async def _connect(self, scheme: str, host: str, port: int) -> _Connection:
+        ssl_context = self.ssl_context if scheme == "https" else None
+        try:
+            addresses = await asyncio.wait_for(
+                self.dns.resolve(host, port), self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise httpx.ConnectTimeout(f"Timed out resolving {host}")
+        except OSError as exc:
+            raise httpx.ConnectError(f"Unable to resolve {host}: {exc}")
+
+        error: Optional[httpx.TransportError] = None
+        for family, sockaddr in addresses:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(
+                        sockaddr[0],
+                        sockaddr[1],
+                        family=family,
+                        ssl=ssl_context,
+                        server_hostname=host if ssl_context is not None else None,
+                    ),
+                    self.timeout,
+                )
+            except ssl.SSLError:
+                raise
+            except asyncio.TimeoutError:
+                error = httpx.ConnectTimeout(f"Timed out connecting to {host}:{port}")
+            except OSError as exc:
+                error = httpx.ConnectError(f"Unable to connect to {host}:{port}: {exc}")
+            else:
+                metrics.CONNECTIONS_OPENED.labels(host).inc()
+                return _Connection(reader, writer)
+        # The host may have moved:
+        self.dns.invalidate(host, port)
+        raise error or httpx.ConnectError(f"No addresses found for {host}")
+
+    async def aclose(self) -> None:
+        connections = [
+            connection for pool in self._pools.values() for connection in pool
+        ]
+        self._pools.clear()
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(
+            *(connection.writer.wait_closed() for connection in connections),
+            return_exceptions=True,
+        )
+
+
+def create_client(
+    transport: str,
+    max_connections: int,
+    max_keepalive: int,
+    ssl_context: Optional[ssl.SSLContext] = None,
+) -> Union[httpx.AsyncClient, StreamClient]:
+    """Creates the HTTP client of one tracker using the named `transport`"""
+    if transport == "stream":
+        return StreamClient(max_connections, max_keepalive, ssl_context)
+    if transport == "httpx":
+        return httpx.AsyncClient(
+            verify=ssl_context if ssl_context is not None else True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+        )
+    raise ValueError(f"Unknown transport '{transport}', expected one of {TRANSPORTS}")
+
+
+def run(main: Coroutine, event_loop: str = "asyncio"):
+    """Like `asyncio.run()` but on the named `event_loop`"""
+    if event_loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            main.close()
+            raise RuntimeError(
+                "uvloop isn't installed, install it with `pip install ghostseeder[uvloop]`"
+            )
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif event_loop != "asyncio":
+        main.close()
+        raise ValueError(
+            f"Unknown event loop '{event_loop}', expected one of {EVENT_LOOPS}"
+        )
+    return asyncio.run(main)
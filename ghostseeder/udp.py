@@ -0,0 +1,258 @@
+"""UDP tracker protocol (BEP 15) announces.
+
+An announce over UDP costs a couple of small datagrams instead of a TCP (and
+usually TLS) handshake plus an HTTP exchange. All UDP trackers share one
+socket per address family; responses are matched to requests by their
+transaction id so any number of announces can be in flight at once.
+
+See: https://www.bittorrent.org/beps/bep_0015.html
+"""
+import asyncio
+import logging
+import random
+import socket
+import struct
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .bencode import AnnounceResponse
+
+PROTOCOL_ID = 0x41727101980
+CONNECT = 0
+ANNOUNCE = 1
+ERROR = 3
+# BEP 15 event codes, keyed by `TrackerRequestEvent.value`:
+EVENTS = {None: 0, "completed": 1, "started": 2, "stopped": 3}
+
+# A client may use a connection id for one minute after receiving it:
+CONNECTION_ID_TTL = 60
+# Retransmit after 15 * 2 ^ n seconds. BEP 15 gives up after n = 8, about two
+# hours, which would hold an announce slot all that time and hide the failure
+# from the tracker's circuit breaker. The announce is retried on the next
+# schedule instead, so give up after 45 seconds:
+BASE_TIMEOUT = 15
+MAX_RETRIES = 1
+ADDRESS_TTL = 300
+
+# BEP 41 option carrying the path and query of the announce url, which is
+# where private trackers put the passkey:
+URL_DATA = 0x2
+
+
+class UDPTrackerError(Exception):
+    pass
+
+
+def encode_url_data(url: str) -> bytes:
+    parsed = urlsplit(url)
+    data = parsed.path.encode()
+    if parsed.query:
+        data += b"?" + parsed.query.encode()
+    options = b""
+    for i in range(0, len(data), 255):
+        chunk = data[i : i + 255]
+        options += bytes((URL_DATA, len(chunk))) + chunk
+    return options
+
+
+class _TrackerProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        # Response futures and the tracker address each is expected from, by
+        # transaction id:
+        self.waiters: dict[int, tuple[asyncio.Future, tuple]] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 8:
+            return
+        action, transaction_id = struct.unpack_from(">II", data)
+        entry = self.waiters.get(transaction_id)
+        # Datagrams from anyone but the tracker are ignored, so they can't
+        # answer in its place:
+        if entry is None or addr[:2] != entry[1][:2]:
+            return
+        waiter, _ = self.waiters.pop(transaction_id)
+        if not waiter.done():
+            waiter.set_result((action, data[8:]))
+
+    def error_received(self, exc):
+        logging.debug(f"UDP tracker socket error: {exc}")
+
+    def connection_lost(self, exc):
+        for waiter, _ in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(UDPTrackerError("UDP socket closed"))
+        self.waiters.clear()
+
+
+class UDPTrackerClient:
+    def __init__(
+        self, base_timeout: float = BASE_TIMEOUT, max_retries: int = MAX_RETRIES
+    ):
+        self.base_timeout = base_timeout
+        self.max_retries = max_retries
+        # Sent with announces that don't pass their own, so the tracker can
+        # tell us apart if our IP address changes:
+        self.key = random.getrandbits(32)
+        self._endpoints: dict[int, _TrackerProtocol] = {}
+        self._addresses: dict[tuple[str, int], tuple[int, tuple, float]] = {}
+        self._connection_ids: dict[tuple, tuple[int, float]] = {}
+        self._connecting: dict[tuple, asyncio.Task] = {}
+
+    async def _endpoint(self, family: int) -> _TrackerProtocol:
+        protocol = self._endpoints.get(family)
+        if protocol is None:
+            loop = asyncio.get_running_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                _TrackerProtocol, family=family
+            )
+            if family in self._endpoints:
+                # Another announce opened the socket while we were waiting:
+                transport.close()
+            protocol = self._endpoints.setdefault(family, protocol)
+        return protocol
+
+    async def _resolve(self, host: str, port: int) -> tuple[int, tuple]:
+        loop = asyncio.get_running_loop()
+        cached = self._addresses.get((host, port))
+        if cached is not None and cached[2] > loop.time():
+            return cached[0], cached[1]
+        try:
+            addresses = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+        except OSError as exc:
+            raise UDPTrackerError(f"Unable to resolve {host}: {exc}") from exc
+        family, _, _, _, address = addresses[0]
+        self._addresses[(host, port)] = (family, address, loop.time() + ADDRESS_TTL)
+        return family, address
+
+    async def _request(
+        self, protocol: _TrackerProtocol, address: tuple, packet: bytes, timeout: float
+    ) -> Optional[tuple[int, bytes]]:
+        """Sends `packet` (with its transaction id at bytes 12:16) and waits
+        for the matching response. Returns None on timeout
+        """
+        (transaction_id,) = struct.unpack_from(">I", packet, 12)
+        waiter = asyncio.get_running_loop().create_future()
+        protocol.waiters[transaction_id] = (waiter, address)
+        try:
+            protocol.transport.sendto(packet, address)
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError as exc:
+            raise UDPTrackerError(str(exc)) from exc
+        finally:
+            protocol.waiters.pop(transaction_id, None)
+
+    def _transaction_id(self, protocol: _TrackerProtocol) -> int:
+        while True:
+            transaction_id = random.getrandbits(32)
+            if transaction_id not in protocol.waiters:
+                return transaction_id
+
+    async def _connect(
+        self, protocol: _TrackerProtocol, address: tuple, timeout: float
+    ) -> Optional[int]:
+        packet = struct.pack(
+            ">QII", PROTOCOL_ID, CONNECT, self._transaction_id(protocol)
+        )
+        response = await self._request(protocol, address, packet, timeout)
+        if response is None:
+            return None
+        action, payload = response
+        if action == ERROR:
+            raise UDPTrackerError(payload.decode(errors="replace"))
+        if action != CONNECT or len(payload) < 8:
+            raise UDPTrackerError(f"Unexpected connect response (action={action})")
+        (connection_id,) = struct.unpack_from(">Q", payload)
+        expires = asyncio.get_running_loop().time() + CONNECTION_ID_TTL
+        self._connection_ids[address] = (connection_id, expires)
+        return connection_id
+
+    async def _connection_id(
+        self, protocol: _TrackerProtocol, address: tuple, timeout: float
+    ) -> Optional[int]:
+        cached = self._connection_ids.get(address)
+        if cached is not None and cached[1] > asyncio.get_running_loop().time():
+            return cached[0]
+        # Announces that need a connection id at the same time share a
+        # single connect request:
+        task = self._connecting.get(address)
+        if task is None:
+            task = asyncio.create_task(self._connect(protocol, address, timeout))
+            self._connecting[address] = task
+            task.add_done_callback(lambda _: self._connecting.pop(address, None))
+        return await asyncio.shield(task)
+
+    async def announce(
+        self,
+        url: str,
+        infohash: bytes,
+        peer_id: str,
+        port: int,
+        uploaded: int = 0,
+        downloaded: int = 0,
+        left: int = 0,
+        event: Optional[str] = None,
+        key: Optional[int] = None,
+    ) -> AnnounceResponse:
+        """key: Identifies the peer announcing, defaults to the client's"""
+        parsed = urlsplit(url)
+        try:
+            tracker_port = parsed.port
+        except ValueError:
+            # Not a number or out of range
+            tracker_port = None
+        if parsed.hostname is None or tracker_port is None:
+            raise UDPTrackerError(f"UDP announce url needs a host and port: {url}")
+        family, address = await self._resolve(parsed.hostname, tracker_port)
+        protocol = await self._endpoint(family)
+        options = encode_url_data(url)
+
+        for attempt in range(self.max_retries + 1):
+            timeout = self.base_timeout * 2**attempt
+            connection_id = await self._connection_id(protocol, address, timeout)
+            if connection_id is None:
+                continue
+            packet = struct.pack(
+                ">QII20s20sQQQIIIiH",
+                connection_id,
+                ANNOUNCE,
+                self._transaction_id(protocol),
+                infohash,
+                peer_id.encode(),
+                downloaded,
+                left,
+                uploaded,
+                EVENTS[event],
+                0,  # Let the tracker use the packet's source address
+                self.key if key is None else key,
+                -1,  # Default number of peers
+                port,
+            )
+            response = await self._request(protocol, address, packet + options, timeout)
+            if response is None:
+                continue
+
+            action, payload = response
+            if action == ERROR:
+                # The tracker may have rejected the connection id itself, so
+                # the next announce connects again:
+                self._connection_ids.pop(address, None)
+                raise UDPTrackerError(payload.decode(errors="replace"))
+            if action != ANNOUNCE or len(payload) < 12:
+                raise UDPTrackerError(f"Unexpected announce response (action={action})")
+            interval, leechers, seeders = struct.unpack_from(">III", payload)
+            return AnnounceResponse(
+                interval=interval, complete=seeders, incomplete=leechers
+            )
+
+        raise UDPTrackerError(f"Timed out announcing to {parsed.hostname}")
+
+    def close(self) -> None:
+        for protocol in self._endpoints.values():
+            protocol.transport.close()
+        self._endpoints.clear()
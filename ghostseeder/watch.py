@@ -0,0 +1,302 @@
+"""Watches the torrent folder for added and removed `.torrent` files.
+
+On Linux the folder tree is watched with inotify (through ctypes, so no extra
+dependency is needed). Elsewhere, if inotify can't be set up, or if the tree
+needs more watches than the system allows, the folder is rescanned
+periodically and compared against the previous scan.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+from typing import AsyncIterator, Iterator, Optional
+
+# Seconds between rescans when inotify isn't available:
+POLL_INTERVAL = 30
+# Events arriving within this many seconds of each other are reported as a
+# single batch of changes:
+DEBOUNCE_INTERVAL = 0.5
+
+# See: inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_EVENT = struct.Struct("iIII")
+
+
+def scan_torrent_files(folderpath: str) -> Iterator[os.DirEntry]:
+    """Recursively yield a directory entry for every `.torrent` file"""
+    folders = [folderpath]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        folders.append(entry.path)
+                elif entry.name.endswith(".torrent"):
+                    yield entry
+
+
+def scan_folder(folderpath: str) -> dict[str, tuple[int, int]]:
+    """Returns `{path: (size, mtime_ns)}` for every torrent file in the folder"""
+    snapshot = {}
+    for entry in scan_torrent_files(folderpath):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class PollingWatcher:
+    """Detects changes by periodically rescanning the whole folder"""
+
+    def __init__(self, folderpath: str, interval: float = POLL_INTERVAL):
+        self.folderpath = folderpath
+        self.interval = interval
+        self._snapshot: Optional[dict[str, tuple[int, int]]] = None
+
+    async def _scan(self) -> dict[str, tuple[int, int]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, scan_folder, self.folderpath
+        )
+
+    async def start(self) -> None:
+        self._snapshot = await self._scan()
+
+    async def changes(self) -> AsyncIterator[tuple[set[str], set[str]]]:
+        """Yields `(added, removed)` sets of torrent file paths. Modified files
+        are reported as added
+        """
+        if self._snapshot is None:
+            await self.start()
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = await self._scan()
+            added = set(
+                path
+                for path, stat in snapshot.items()
+                if self._snapshot.get(path) != stat
+            )
+            removed = self._snapshot.keys() - snapshot.keys()
+            self._snapshot = snapshot
+            if added or removed:
+                yield added, removed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Detects changes from inotify events on every directory in the folder.
+    Switches to polling if a directory can't be watched, e.g. once the
+    `max_user_watches` limit is reached
+    """
+
+    def __init__(self, folderpath: str):
+        self.folderpath = folderpath
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: dict[int, str] = {}
+        self._known: set[str] = set()
+        self._events: Optional[asyncio.Queue] = None
+        self._fallback: Optional[PollingWatcher] = None
+
+    def _add_watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"Unable to watch {path}")
+        self._watches[wd] = path
+
+    def _add_tree(self, folderpath: str) -> set[str]:
+        """Watches `folderpath` and its subdirectories. Returns the torrent
+        files already inside it
+        """
+        found = set()
+        folders = [folderpath]
+        while folders:
+            folder = folders.pop()
+            # Watch before listing so files created in between aren't missed:
+            self._add_watch(folder)
+            try:
+                entries = list(os.scandir(folder))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        folders.append(entry.path)
+                elif entry.name.endswith(".torrent"):
+                    found.add(entry.path)
+        return found
+
+    async def start(self) -> None:
+        self._events = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        try:
+            self._known = await loop.run_in_executor(
+                None, self._add_tree, self.folderpath
+            )
+        except OSError as exc:
+            await self._fall_back(exc, set())
+            return
+        loop.add_reader(self._fd, self._read)
+
+    async def _fall_back(
+        self, exc: OSError, reported: set[str]
+    ) -> tuple[set[str], set[str]]:
+        """Stops using inotify and polls the folder instead. Returns the
+        `(added, removed)` torrent files since `reported` were known
+        """
+        logging.warning(f"Unable to use inotify ({exc}), polling folder instead")
+        self.close()
+        self._fallback = PollingWatcher(self.folderpath, POLL_INTERVAL)
+        await self._fallback.start()
+        found = set(self._fallback._snapshot)
+        return found - reported, reported - found
+
+    async def _scan_tree(self, folderpath: str) -> set[str]:
+        # Walking a large tree would block the event loop:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._add_tree, folderpath
+        )
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            self._events.put_nowait((wd, mask, os.fsdecode(name)))
+
+    async def _handle(
+        self, wd: int, mask: int, name: str, added: set, removed: set
+    ) -> None:
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped, so re-read everything:
+            logging.warning("Too many changes in torrent folder, rescanning it")
+            found = await self._scan_tree(self.folderpath)
+            added.update(found - self._known)
+            removed.update(self._known - found)
+            self._known = found
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        if mask & IN_MOVE_SELF and self._watches.get(wd) != self.folderpath:
+            # The directory was moved elsewhere and reported as removed by its
+            # parent's watch; its own watch now refers to a stale path:
+            self._libc.inotify_rm_watch(self._fd, wd)
+            self._watches.pop(wd, None)
+            return
+
+        folder = self._watches.get(wd)
+        if folder is None or not name:
+            return
+        path = os.path.join(folder, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                found = await self._scan_tree(path)
+                added.update(found)
+                self._known.update(found)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                prefix = os.path.join(path, "")
+                gone = set(known for known in self._known if known.startswith(prefix))
+                removed.update(gone)
+                self._known -= gone
+        elif name.endswith(".torrent"):
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                added.add(path)
+                removed.discard(path)
+                self._known.add(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.add(path)
+                added.discard(path)
+                self._known.discard(path)
+
+    async def changes(self) -> AsyncIterator[tuple[set[str], set[str]]]:
+        """Yields `(added, removed)` sets of torrent file paths. Modified files
+        are reported as added
+        """
+        if self._events is None:
+            await self.start()
+        while self._fallback is None:
+            added: set[str] = set()
+            removed: set[str] = set()
+            try:
+                await self._handle(*await self._events.get(), added, removed)
+                # Wait for a burst of events (e.g. copying in many files) to
+                # settle before reporting it:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(
+                            self._events.get(), DEBOUNCE_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        break
+                    await self._handle(*event, added, removed)
+            except OSError as exc:
+                # The rest of this batch is picked up by the first scan:
+                reported = (self._known - added) | removed
+                added, removed = await self._fall_back(exc, reported)
+            if added or removed:
+                yield added, removed
+        async for change in self._fallback.changes():
+            yield change
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            try:
+                asyncio.get_running_loop().remove_reader(self._fd)
+            except RuntimeError:
+                pass
+            os.close(self._fd)
+            self._fd = -1
+
+
+def watch_folder(folderpath: str):
+    """Returns an inotify watcher for `folderpath` if supported, otherwise
+    one that polls the folder
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folderpath)
+        except (OSError, AttributeError) as exc:
+            logging.warning(f"Unable to use inotify ({exc}), polling folder instead")
+    return PollingWatcher(folderpath)
@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import json
+import os
+
+import pytest
+from pytest_httpx import HTTPXMock
+
+from ghostseeder.admin import AdminAPI, AdminError, serve_admin
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer, shard_of
+from ghostseeder.tracker import TrackerPool
+
+load = functools.partial(
+    TorrentSpoofer, peer_id="-qB4450-McTfgDArNMzY", useragent="qBittorrent/4.4.5"
+)
+
+
+@pytest.mark.asyncio
+async def test_torrents_are_managed_in_memory(valid_torrent: TorrentSpoofer):
+    torrent = load(str(valid_torrent.filepath))
+    async with TrackerPool(1) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        api = AdminAPI(scheduler, load)
+        scheduler.add(torrent, delay=60)
+
+        status, torrents = api.handle("GET", "/torrents", b"")
+        assert status == 200
+        (state,) = torrents
+        assert state["infohash"] == torrent.infohash
+        assert state["tracker"] == "http://localhost"
+        assert state["next_due"] == pytest.approx(60, abs=1)
+
+        status, state = api.handle(
+            "POST", f"/torrents/{torrent.infohash}/announce", b""
+        )
+        assert state["next_due"] == pytest.approx(0, abs=1)
+        # The announce was moved rather than added:
+        assert len(scheduler) == 1
+
+        path = torrent.filepath.replace("/", "%2F")
+        api.handle("DELETE", f"/torrents/{path}", b"")
+        assert not scheduler.torrents
+        with pytest.raises(AdminError) as excinfo:
+            api.handle("GET", f"/torrents/{torrent.infohash}", b"")
+        assert excinfo.value.status == 404
+
+        body = json.dumps({"infohash": torrent.infohash}).encode()
+        status, _ = api.handle("POST", "/torrents", body)
+        assert status == 201
+        assert scheduler.find(torrent.infohash) is torrent
+
+        body = json.dumps({"path": torrent.filepath}).encode()
+        with pytest.raises(AdminError) as excinfo:
+            api.handle("POST", "/torrents", body)
+        assert excinfo.value.status == 409
+
+
+@pytest.mark.asyncio
+async def test_paused_trackers_are_not_announced_to(
+    httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
+):
+    httpx_mock.add_response()
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        api = AdminAPI(scheduler, load)
+        trackers.get(valid_torrent.announce_url)
+        body = json.dumps({"tracker": "http://localhost"}).encode()
+        _, (state,) = api.handle("POST", "/trackers/pause", body)
+        assert state["paused"]
+
+        scheduler.add(valid_torrent)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        assert valid_torrent.num_announces == 0
+        api.handle("POST", "/trackers/resume", body)
+        await asyncio.sleep(0.05)
+        assert valid_torrent.num_announces == 1
+
+        api.handle("POST", "/trackers/rate", json.dumps({"rate": 5}).encode())
+        assert trackers.max_requests == 5
+        _, (state,) = api.handle("GET", "/trackers", b"")
+        assert state["rate"] == 5
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+
+@pytest.mark.asyncio
+async def test_api_is_served_on_unix_socket(tmp_path, valid_torrent: TorrentSpoofer):
+    socket_path = str(tmp_path / "admin.sock")
+    async with TrackerPool(1) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        scheduler.add(valid_torrent, delay=60)
+        server = await serve_admin(AdminAPI(scheduler, load), socket_path)
+        try:
+            assert os.stat(socket_path).st_mode & 0o777 == 0o600
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            body = b'{"rate": -1}'
+            writer.write(
+                b"POST /trackers/rate HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 400 Bad Request")
+    assert json.loads(body) == {"error": "`rate` must be a positive number"}
+
+
+@pytest.mark.asyncio
+async def test_rejected_restore_can_be_retried(valid_torrent: TorrentSpoofer):
+    async with TrackerPool(1) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        api = AdminAPI(scheduler, load)
+        scheduler.add(valid_torrent, delay=60)
+        api.handle("DELETE", f"/torrents/{valid_torrent.infohash}", b"")
+
+        # Restoring into a shard the torrent doesn't belong to:
+        index = shard_of(valid_torrent.encoded_infohash, 2)
+        scheduler.shard = (1 - index, 2)
+        body = json.dumps({"infohash": valid_torrent.infohash}).encode()
+        with pytest.raises(AdminError) as excinfo:
+            api.handle("POST", "/torrents", body)
+        assert excinfo.value.status == 409
+
+        scheduler.shard = (index, 2)
+        status, _ = api.handle("POST", "/torrents", body)
+        assert status == 201
+        assert scheduler.find(valid_torrent.infohash) is valid_torrent
+        assert not api.removed
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "headers,status",
+    [
+        (b"Host: attacker.example:8080\r\nContent-Type: application/json", 403),
+        (b"Host: 127.0.0.1:8080\r\nOrigin: http://localhost", 403),
+        (b"Host: localhost:8080\r\nContent-Type: text/plain", 415),
+        (b"Host: [::1]:8080", 415),
+        (b"Host: 127.0.0.1:8080\r\nContent-Type: application/json", 200),
+    ],
+)
+async def test_requests_browsers_could_make_are_rejected(headers: bytes, status: int):
+    async with TrackerPool(1) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        server = await serve_admin(AdminAPI(scheduler, load), port=0)
+        try:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = b'{"rate": 5}'
+            writer.write(
+                b"POST /trackers/rate HTTP/1.1\r\n%s\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (headers, len(body), body)
+            )
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    assert response.startswith(b"HTTP/1.1 %d " % status)
+    assert trackers.max_requests == (5 if status == 200 else 1)
@@ -0,0 +1,128 @@
+import hashlib
+
+import flatbencode
+import pytest
+
+from ghostseeder.bencode import (
+    AnnounceResponse,
+    read_metainfo,
+    scan_announce_response,
+    scan_metainfo,
+    skip,
+)
+
+
+def test_scan_matches_full_decode(valid_metainfo):
+    contents = flatbencode.encode(valid_metainfo)
+    metainfo = scan_metainfo(contents)
+
+    assert metainfo.announce == valid_metainfo[b"announce"].decode()
+    assert metainfo.name == valid_metainfo[b"info"][b"name"].decode()
+    assert (
+        metainfo.infohash
+        == hashlib.sha1(flatbencode.encode(valid_metainfo[b"info"])).digest()
+    )
+    assert metainfo.announce_list == []
+
+
+def test_infohash_uses_raw_bytes_of_non_canonical_info():
+    # Keys aren't sorted, so re-encoding a decoded copy changes the bytes:
+    info = b"d4:name4:test6:lengthi5e12:piece lengthi16384e6:pieces20:" + b"\x00" * 20
+    info += b"e"
+    contents = b"d8:announce16:http://localhost4:info" + info + b"e"
+
+    metainfo = scan_metainfo(contents)
+    assert metainfo.infohash == hashlib.sha1(info).digest()
+    assert (
+        metainfo.infohash
+        != hashlib.sha1(flatbencode.encode(flatbencode.decode(info))).digest()
+    )
+
+
+def test_announce_list_is_read(valid_singlefile_metainfo):
+    announce_list = [[b"http://a", b"http://b"], [b"udp://c"]]
+    valid_singlefile_metainfo[b"announce-list"] = announce_list
+    metainfo = scan_metainfo(flatbencode.encode(valid_singlefile_metainfo))
+    assert metainfo.announce_list == [["http://a", "http://b"], ["udp://c"]]
+
+    del valid_singlefile_metainfo[b"announce"]
+    metainfo = scan_metainfo(flatbencode.encode(valid_singlefile_metainfo))
+    assert metainfo.announce == "http://a"
+
+
+def test_skip_jumps_over_values():
+    value = b"li1e3:abcd1:xl1:yeee"
+    assert skip(value + b"4:spam", 0) == len(value)
+    assert skip(b"i-42e", 0) == 5
+    # Any depth, without running out of stack:
+    value = b"l" * 3000 + b"e" * 3000
+    assert skip(value + b"4:spam", 0) == len(value)
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        b"not bencode",
+        b"d8:announce16:http://localhoste",
+        b"d8:announce16:http://localhost4:infod4:name",
+        b"d4:infod4:name4:testee",
+        # Not UTF-8:
+        b"d8:announce16:http://localhost4:infod4:name4:caf\xe9ee",
+        b"d8:announce16:http://l\xe9calhost4:infod4:name4:testee",
+        # Nested too deeply:
+        b"d13:announce-list" + b"l" * 3000 + b"e" * 3000 + b"4:infod4:name4:testee",
+    ],
+)
+def test_malformed_metainfo_raises(contents):
+    with pytest.raises(flatbencode.DecodingError):
+        scan_metainfo(contents)
+
+
+def test_read_metainfo_from_file(tmp_path, valid_metainfo):
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_metainfo))
+    assert read_metainfo(filepath) == scan_metainfo(flatbencode.encode(valid_metainfo))
+
+    empty = tmp_path / "empty.torrent"
+    empty.touch()
+    with pytest.raises(flatbencode.DecodingError):
+        read_metainfo(empty)
+
+
+def test_scan_announce_response(successful_tracker_response):
+    successful_tracker_response[b"min interval"] = 900
+    successful_tracker_response[b"peers"] = b"\x7f\x00\x00\x01\x1a\xe1" * 50
+    response = scan_announce_response(flatbencode.encode(successful_tracker_response))
+    assert response == AnnounceResponse(
+        interval=1800, min_interval=900, complete=1965, incomplete=29
+    )
+
+
+def test_scan_announce_response_skips_dictionary_peers():
+    peers = [{b"ip": b"127.0.0.1", b"peer id": b"x" * 20, b"port": 6881}] * 3
+    contents = flatbencode.encode(
+        {
+            b"failure reason": b"Unregistered torrent",
+            b"peers": peers,
+            b"warning message": b"Slow down",
+        }
+    )
+    response = scan_announce_response(contents)
+    assert response.failure_reason == "Unregistered torrent"
+    assert response.warning_message == "Slow down"
+    assert response.interval is None
+
+
+def test_scan_announce_response_skips_deeply_nested_values():
+    nested = b"l" * 5000 + b"e" * 5000
+    response = scan_announce_response(b"d1:a" + nested + b"8:intervali1800ee")
+    assert response.interval == 1800
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [b"i5e", b"d8:intervali1800e", b"<html>", b"d1:a" + b"l" * 5000, b"d1:ale1:ae"],
+)
+def test_malformed_announce_response_raises(contents):
+    with pytest.raises(flatbencode.DecodingError):
+        scan_announce_response(contents)
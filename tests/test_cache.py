@@ -0,0 +1,92 @@
+import flatbencode
+import pytest
+
+from ghostseeder.bencode import read_metainfo, scan_metainfo
+from ghostseeder.cache import MetainfoCache
+from ghostseeder.ghostseeder import TorrentSpoofer
+
+
+def write_torrent(filepath, metainfo):
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    filepath.write_bytes(flatbencode.encode(metainfo))
+    stat = filepath.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def test_cache_roundtrip(tmp_path, valid_metainfo):
+    valid_metainfo[b"announce-list"] = [[b"http://a"], [b"http://b"]]
+    filepath = tmp_path / "test.torrent"
+    size, mtime_ns = write_torrent(filepath, valid_metainfo)
+    metainfo = read_metainfo(filepath)
+
+    with MetainfoCache(tmp_path / "cache.sqlite") as cache:
+        assert cache.get(str(filepath), size, mtime_ns) is None
+        cache.put_many([(str(filepath), size, mtime_ns, metainfo)])
+
+    with MetainfoCache(tmp_path / "cache.sqlite") as cache:
+        assert len(cache) == 1
+        assert cache.get(str(filepath), size, mtime_ns) == metainfo
+        # Modified files miss the cache:
+        assert cache.get(str(filepath), size + 1, mtime_ns) is None
+        assert cache.get(str(filepath), size, mtime_ns + 1) is None
+
+
+def test_evict_missing_only_touches_scanned_folder(tmp_path, valid_metainfo):
+    metainfo = scan_metainfo(flatbencode.encode(valid_metainfo))
+    entries = [
+        (str(tmp_path / name), 1, 1, metainfo)
+        for name in ("a/kept.torrent", "a/deleted.torrent", "b/other.torrent")
+    ]
+
+    with MetainfoCache(":memory:") as cache:
+        cache.put_many(entries)
+        evicted = cache.evict_missing(tmp_path / "a", [tmp_path / "a/kept.torrent"])
+        assert evicted == 1
+        assert cache.get(str(tmp_path / "a/kept.torrent"), 1, 1) is not None
+        assert cache.get(str(tmp_path / "a/deleted.torrent"), 1, 1) is None
+        assert cache.get(str(tmp_path / "b/other.torrent"), 1, 1) is not None
+
+
+@pytest.mark.asyncio
+async def test_stream_torrents_uses_cache(tmp_path, valid_metainfo, monkeypatch):
+    folder = tmp_path / "torrents"
+    original_name = valid_metainfo[b"info"][b"name"].decode()
+    for name in ("a.torrent", "b/c.torrent", "d.torrent"):
+        write_torrent(folder / name, valid_metainfo)
+
+    async def load(cache):
+        return [
+            torrent
+            async for torrent in TorrentSpoofer.stream_torrents(
+                folder, "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5", cache=cache
+            )
+        ]
+
+    with MetainfoCache(tmp_path / "cache.sqlite") as cache:
+        first = await load(cache)
+        assert len(cache) == 3
+
+    (folder / "d.torrent").unlink()
+    valid_metainfo[b"info"][b"name"] = b"Changed"
+    write_torrent(folder / "b/c.torrent", valid_metainfo)
+
+    parsed = []
+
+    def read_metainfo_batch(filepaths):
+        parsed.extend(filepaths)
+        return [(filepath, read_metainfo(filepath), None) for filepath in filepaths]
+
+    monkeypatch.setattr(
+        "ghostseeder.ghostseeder.read_metainfo_batch", read_metainfo_batch
+    )
+    with MetainfoCache(tmp_path / "cache.sqlite") as cache:
+        second = await load(cache)
+        assert len(cache) == 2
+
+    assert len(first) == 3
+    assert parsed == [str(folder / "b/c.torrent")]
+    names = {torrent.filepath: torrent.name for torrent in second}
+    assert names == {
+        str(folder / "a.torrent"): original_name,
+        str(folder / "b/c.torrent"): "Changed",
+    }
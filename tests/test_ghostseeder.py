@@ -1,6 +1,9 @@
 import asyncio
+import concurrent.futures
 import hashlib
 import random
+import re
+import unittest.mock
 
 from urllib.parse import urlparse, parse_qs, urlencode
 
@@ -13,14 +16,18 @@ from asynciolimiter import StrictLimiter
 from pytest_httpx import HTTPXMock
 
 from ghostseeder.ghostseeder import (
+    AnnounceScheduler,
     DEFAULT_SLEEP_INTERVAL,
+    MIN_RETRY_INTERVAL,
     generate_peer_id,
     generate_useragent,
     parse_interval,
     TorrentClient,
     TorrentSpoofer,
+    TrackerFailure,
     TrackerRequestEvent,
 )
+from ghostseeder.tracker import BreakerState, TrackerPool
 
 
 def test_parse_interval(successful_tracker_response):
@@ -36,6 +43,24 @@ def test_parse_interval_uses_default_interval_on_failure():
     assert parse_interval(bad_tracker_response, "dummy") == DEFAULT_SLEEP_INTERVAL
 
 
+def test_parse_interval_honors_min_interval(successful_tracker_response):
+    successful_tracker_response[b"min interval"] = 2700
+    bytestring = flatbencode.encode(successful_tracker_response)
+    assert parse_interval(bytestring, "dummy") == 2700
+
+
+def test_parse_interval_raises_on_failure_reason(caplog):
+    bytestring = flatbencode.encode({b"failure reason": b"Unregistered torrent"})
+    with pytest.raises(TrackerFailure, match="Unregistered torrent"):
+        parse_interval(bytestring, "dummy")
+
+    bytestring = flatbencode.encode(
+        {b"interval": 1800, b"warning message": b"Slow down"}
+    )
+    assert parse_interval(bytestring, "dummy") == 1800
+    assert "Slow down" in caplog.text
+
+
 @pytest.mark.parametrize(
     "client,version,user_agent",
     [
@@ -75,6 +100,10 @@ def test_peer_id_with_and_without_random_seed():
     assert generate_peer_id(client, version, seed) == generate_peer_id(
         client, version, seed
     )
+    # The global generator isn't seeded along with it:
+    state = random.getstate()
+    generate_peer_id(client, version, seed)
+    assert random.getstate() == state
 
 
 @pytest.mark.parametrize(
@@ -120,6 +149,36 @@ class TestLoadingTorrents:
         )
         assert spoof.name == valid_metainfo[b"info"][b"name"].decode()
 
+    def test_torrents_share_tracker_state(self, tmp_path, valid_metainfo):
+        files = self.generate_directory_tree(
+            tmp_path, ["apple.torrent", "banana.torrent"], valid_metainfo
+        )
+        apple, banana = (
+            TorrentSpoofer(
+                filepath, peer_id="-qB4450-McTfgDArNMzY", useragent="qBittorrent/4.4.5"
+            )
+            for filepath in files
+        )
+
+        assert not hasattr(apple, "__dict__")
+        assert apple.target is banana.target
+        assert apple.headers is banana.headers
+        assert apple.tiers is banana.tiers
+        assert apple.quoted_peer_id is banana.quoted_peer_id
+
+    def test_name_falls_back_to_file_name(self, tmp_path, valid_metainfo):
+        filepath = tmp_path / "gone.torrent"
+        with open(filepath, "wb") as f:
+            f.write(flatbencode.encode(valid_metainfo))
+        spoof = TorrentSpoofer(
+            str(filepath), peer_id="-qB4450-McTfgDArNMzY", useragent="qBittorrent/4.4.5"
+        )
+        filepath.unlink()
+
+        # Names are only read when needed, so the file is already gone:
+        assert spoof.name == "gone.torrent"
+        assert str(spoof) == "gone.torrent"
+
     def test_load_subdirectories(self, tmp_path, valid_metainfo):
         files = [
             "a/apple.torrent",
@@ -154,6 +213,42 @@ class TestLoadingTorrents:
         for torrent in torrents:
             assert torrent.filepath in files
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "executor_cls",
+        [concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor],
+    )
+    async def test_stream_torrents(self, tmp_path, valid_metainfo, executor_cls):
+        files = [f"a/{i}.torrent" for i in range(100)] + ["b/c/d.torrent", "e.txt"]
+        files = self.generate_directory_tree(tmp_path, files, valid_metainfo)
+        (tmp_path / "broken.torrent").write_bytes(b"garbage")
+        (tmp_path / "latin1.torrent").write_bytes(
+            b"d8:announce16:http://localhost4:infod4:name4:caf\xe9ee"
+        )
+        (tmp_path / "nested.torrent").write_bytes(
+            b"d13:announce-list"
+            + b"l" * 3000
+            + b"e" * 3000
+            + b"4:infod4:name4:testee"
+        )
+
+        with executor_cls() as executor:
+            torrents = [
+                torrent
+                async for torrent in TorrentSpoofer.stream_torrents(
+                    tmp_path,
+                    peer_id="-qB4450-McTfgDArNMzY",
+                    useragent="qBittorrent/4.4.5",
+                    executor=executor,
+                )
+            ]
+
+        files = set(f.as_posix() for f in files if f.suffix == ".torrent")
+        assert set(torrent.filepath for torrent in torrents) == files
+        expected = hashlib.sha1(flatbencode.encode(valid_metainfo[b"info"])).hexdigest()
+        for torrent in torrents:
+            assert torrent.infohash == expected
+
 
 @pytest.mark.asyncio
 async def test_url_and_query_params_constructed_correctly(
@@ -190,6 +285,25 @@ async def test_url_and_query_params_constructed_correctly(
     assert valid_torrent.peer_id == parsed_params["peer_id"][0]
 
 
+@pytest.mark.asyncio
+async def test_announce_url_with_existing_query(
+    httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+):
+    valid_singlefile_metainfo[b"announce"] = b"http://localhost/announce?passkey=abc"
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    torrent = TorrentSpoofer(filepath, "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+
+    httpx_mock.add_response()
+    async with httpx.AsyncClient() as client:
+        response = await torrent.announce(client, port=6881)
+
+    parsed_params = parse_qs(urlparse(str(response.url)).query)
+    assert parsed_params["passkey"] == ["abc"]
+    assert parsed_params["peer_id"] == [torrent.peer_id]
+    assert parsed_params["port"] == ["6881"]
+
+
 @pytest.mark.asyncio
 async def test_user_agent_string_in_header(
     httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
@@ -210,6 +324,36 @@ async def test_announce_counting(httpx_mock: HTTPXMock, valid_torrent: TorrentSp
             assert i + 1 == valid_torrent.num_announces
 
 
+@pytest.mark.asyncio
+async def test_failed_announces_back_off(
+    httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
+):
+    httpx_mock.add_response(status_code=503)
+    async with httpx.AsyncClient() as client:
+        for failures in range(1, 10):
+            sleep = await valid_torrent.announce_once(client, port=6881)
+            backoff = min(
+                MIN_RETRY_INTERVAL * 2 ** (failures - 1), DEFAULT_SLEEP_INTERVAL
+            )
+            assert backoff / 2 <= sleep <= backoff
+            assert valid_torrent.failures == failures
+            assert valid_torrent.tracker_unreachable
+
+    httpx_mock.reset(assert_all_responses_were_requested=False)
+    httpx_mock.add_response(content=flatbencode.encode({b"failure reason": b"No"}))
+    async with httpx.AsyncClient() as client:
+        await valid_torrent.announce_once(client, port=6881)
+    assert isinstance(valid_torrent.last_error, TrackerFailure)
+    assert not valid_torrent.tracker_unreachable
+
+    httpx_mock.reset(assert_all_responses_were_requested=False)
+    httpx_mock.add_response(content=flatbencode.encode({b"interval": 1800}))
+    async with httpx.AsyncClient() as client:
+        assert await valid_torrent.announce_once(client, port=6881) == 1800
+    assert valid_torrent.failures == 0
+    assert valid_torrent.last_error is None
+
+
 @pytest.mark.asyncio
 async def test_infohash_url_encoded_correctly(
     httpx_mock: HTTPXMock, valid_torrents: TorrentSpoofer
@@ -263,3 +407,265 @@ async def test_spoofer_sends_final_stop_announce(
     # to even reach logging output:
     await asyncio.sleep(0.1)
     assert "&event=stopped" in caplog.text
+
+
+class TestAnnounceScheduler:
+    def make_torrents(self, tmp_path, metainfo, n):
+        tmp_path.mkdir(exist_ok=True)
+        torrents = []
+        for i in range(n):
+            filepath = tmp_path / f"{i}.torrent"
+            metainfo[b"info"][b"name"] = f"Torrent {i}".encode()
+            with open(filepath, "wb") as f:
+                f.write(flatbencode.encode(metainfo))
+            torrents.append(
+                TorrentSpoofer(
+                    filepath,
+                    peer_id="-qB4450-McTfgDArNMzY",
+                    useragent="qBittorrent/4.4.5",
+                )
+            )
+        return torrents
+
+    @pytest.mark.asyncio
+    async def test_scheduler_announces_every_torrent(
+        self,
+        httpx_mock: HTTPXMock,
+        tmp_path,
+        valid_singlefile_metainfo,
+        successful_tracker_response,
+    ):
+        httpx_mock.add_response(content=flatbencode.encode(successful_tracker_response))
+        torrents = self.make_torrents(tmp_path, valid_singlefile_metainfo, 5)
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881, 2)
+            for torrent in torrents:
+                scheduler.add(torrent)
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        requests = httpx_mock.get_requests()
+        started = [r for r in requests if "event=started" in str(r.url)]
+        stopped = [r for r in requests if "event=stopped" in str(r.url)]
+        assert len(started) == len(torrents)
+        assert len(stopped) == len(torrents)
+        for torrent in torrents:
+            assert torrent.num_announces == 2
+        # Every torrent is rescheduled at the tracker provided interval:
+        assert len(scheduler) == len(torrents)
+
+    @pytest.mark.asyncio
+    async def test_trackers_are_rate_limited_separately(
+        self, httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+    ):
+        httpx_mock.add_response()
+        slow = self.make_torrents(tmp_path / "slow", valid_singlefile_metainfo, 3)
+        valid_singlefile_metainfo[b"announce"] = b"http://other-tracker"
+        fast = self.make_torrents(tmp_path / "fast", valid_singlefile_metainfo, 3)
+
+        async with TrackerPool(1) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881)
+            for torrent in slow + fast:
+                scheduler.add(torrent)
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0.2)
+            assert len(trackers) == 2
+            # One announce per tracker per second, each tracker independently:
+            assert sum(torrent.num_announces for torrent in slow) == 1
+            assert sum(torrent.num_announces for torrent in fast) == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    @pytest.mark.asyncio
+    async def test_scheduler_orders_by_due_time(
+        self, httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+    ):
+        httpx_mock.add_response()
+        late, early = self.make_torrents(tmp_path, valid_singlefile_metainfo, 2)
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881, 1)
+            scheduler.add(late, delay=0.05)
+            scheduler.add(early)
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0.02)
+            assert early.num_announces == 1
+            assert late.num_announces == 0
+            await asyncio.sleep(0.1)
+            assert late.num_announces == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    @pytest.mark.asyncio
+    async def test_stop_is_bounded_per_tracker_and_in_time(
+        self, httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo, caplog
+    ):
+        in_flight = []
+        most_in_flight = 0
+
+        async def slow_tracker(request: httpx.Request):
+            nonlocal most_in_flight
+            in_flight.append(request)
+            most_in_flight = max(most_in_flight, len(in_flight))
+            await asyncio.sleep(0.1)
+            in_flight.remove(request)
+            if request.url.host == "failing-tracker":
+                return httpx.Response(503)
+            return httpx.Response(200)
+
+        httpx_mock.add_callback(slow_tracker)
+        slow = self.make_torrents(tmp_path / "slow", valid_singlefile_metainfo, 20)
+        valid_singlefile_metainfo[b"announce"] = b"http://failing-tracker"
+        failing = self.make_torrents(tmp_path / "failing", valid_singlefile_metainfo, 2)
+
+        async with TrackerPool(1000, max_connections=4) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881, stop_timeout=0.25)
+            for torrent in slow + failing:
+                scheduler.add(torrent)
+                torrent.num_announces = 1
+            await scheduler.stop()
+
+        # 4 connections per tracker, so at most 2 rounds of 4 make the
+        # deadline. Only bounds are checked, a slow machine may fit in fewer:
+        assert most_in_flight <= 4 + 2
+        match = re.search(
+            r"Final announces to http://localhost: (\d+) sent, 0 failed, (\d+) not sent",
+            caplog.text,
+        )
+        assert match is not None
+        sent, not_sent = map(int, match.groups())
+        assert sent + not_sent == 20
+        assert sent <= 8
+        assert "Final announces to http://failing-tracker: 0 sent, 2 failed" in (
+            caplog.text
+        )
+
+    @pytest.mark.asyncio
+    async def test_unreachable_trackers_fail_over_to_next_tier(
+        self,
+        httpx_mock: HTTPXMock,
+        tmp_path,
+        valid_singlefile_metainfo,
+        successful_tracker_response,
+    ):
+        def tracker(request: httpx.Request):
+            if request.url.host == "primary.failover":
+                raise httpx.ConnectError("Connection refused", request=request)
+            return httpx.Response(
+                200, content=flatbencode.encode(successful_tracker_response)
+            )
+
+        httpx_mock.add_callback(tracker)
+        valid_singlefile_metainfo[b"announce-list"] = [
+            [b"http://primary.failover/announce"],
+            [b"http://backup.failover/announce"],
+        ]
+        first, second = self.make_torrents(tmp_path, valid_singlefile_metainfo, 2)
+        assert first.announce_url == "http://primary.failover/announce"
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881)
+            scheduler.add(first)
+            scheduler.add(second, delay=0.05)
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        hosts = [request.url.host for request in httpx_mock.get_requests()]
+        # The first torrent fails over right away and the second one skips
+        # the tracker that is known to be down:
+        assert hosts.count("primary.failover") == 1
+        assert hosts.count("backup.failover") == 4
+        assert first.announce_url == second.announce_url
+        assert second.announce_url == "http://backup.failover/announce"
+        assert first.failures == 0
+
+    @pytest.mark.asyncio
+    async def test_announces_are_coalesced_into_tracker_windows(
+        self, tmp_path, valid_singlefile_metainfo
+    ):
+        (torrent,) = self.make_torrents(tmp_path, valid_singlefile_metainfo, 1)
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881, coalesce_window=300)
+            due_times = []
+            for now in (1000.0, 1234.5, 1299.0):
+                scheduler.clock = lambda: now
+                sleep = scheduler._coalesce(torrent, 1800)
+                # Moved earlier by less than a window:
+                assert 1500 < sleep <= 1800
+                due_times.append(now + sleep)
+            # All land on window starts, 300 seconds apart:
+            assert [round(due - due_times[0]) % 300 for due in due_times] == [0] * 3
+
+            # Never sooner than the tracker's `min interval`:
+            torrent.min_interval = 1799
+            assert scheduler._coalesce(torrent, 1800) == 1800
+
+    @pytest.mark.asyncio
+    async def test_duplicate_torrent_files_are_announced_once(
+        self, httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+    ):
+        (original,) = self.make_torrents(tmp_path / "a", valid_singlefile_metainfo, 1)
+        (copy,) = self.make_torrents(tmp_path / "b", valid_singlefile_metainfo, 1)
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881)
+            scheduler.add(original, 600)
+            scheduler.add(copy)
+            assert len(scheduler.torrents) == 1
+
+            # The copy takes over without telling the tracker we stopped:
+            scheduler.remove(original.filepath)
+            assert list(scheduler.torrents) == [copy.filepath]
+            assert not httpx_mock.get_requests()
+            # And keeps its place in the schedule:
+            (due,) = [due for due, _, queued in scheduler._queue if queued is copy]
+            assert due - scheduler.clock() > 590
+
+            # Removing the last copy stops announcing the torrent:
+            scheduler.remove(copy.filepath)
+            assert len(scheduler.torrents) == 0
+
+    @pytest.mark.asyncio
+    async def test_removing_the_breaker_probe_lets_another_torrent_probe(
+        self, httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+    ):
+        httpx_mock.add_response()
+        probe, other = self.make_torrents(tmp_path, valid_singlefile_metainfo, 2)
+
+        async with TrackerPool(1000) as trackers:
+            scheduler = AnnounceScheduler(trackers, 6881)
+            tracker = trackers.get(probe.announce_url)
+            for _ in range(tracker.breaker.threshold):
+                tracker.breaker.record(ok=False)
+            # The cooldown is over, so the next announce is the probe:
+            tracker.breaker.reopens_at = 0
+            limit, gate = tracker.limit, asyncio.Event()
+            tracker.limit = unittest.mock.Mock(wait=gate.wait)
+            scheduler.add(probe)
+            task = asyncio.create_task(scheduler.run())
+            await asyncio.sleep(0.05)
+            assert tracker.breaker.state is BreakerState.HALF_OPEN
+
+            scheduler.remove(probe.filepath)
+            gate.set()
+            await asyncio.sleep(0.05)
+            assert tracker.breaker.state is BreakerState.OPEN
+            scheduler.add(other)
+            await asyncio.sleep(0.05)
+            assert other.num_announces == 1
+            assert tracker.breaker.state is BreakerState.CLOSED
+            tracker.limit = limit
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert probe.num_announces == 0
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import logging
+import threading
+
+import pytest
+
+from ghostseeder.logs import AnnounceSummary, JSONFormatter, background_logging
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines: list[str] = []
+        self.threads: set[str] = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+@pytest.fixture
+def handler():
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    handler = RecordingHandler()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    yield handler
+    root.handlers = handlers
+    root.setLevel(level)
+
+
+def test_records_are_written_from_a_background_thread(handler: RecordingHandler):
+    handlers = list(logging.getLogger().handlers)
+    with background_logging(json_lines=True):
+        logging.info("Announcing %s", "torrent", extra={"tracker": "http://a"})
+    assert threading.current_thread().name not in handler.threads
+    (line,) = handler.lines
+    entry = json.loads(line)
+    assert entry["level"] == "INFO"
+    assert entry["message"] == "Announcing torrent"
+    assert entry["tracker"] == "http://a"
+    assert logging.getLogger().handlers == handlers
+
+
+def test_json_formatter_includes_exceptions():
+    try:
+        raise ValueError("bad")
+    except ValueError as exc:
+        record = logging.makeLogRecord(
+            {"msg": "failed", "levelname": "ERROR", "exc_info": (ValueError, exc, None)}
+        )
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["message"] == "failed"
+    assert "ValueError: bad" in entry["exception"]
+
+
+@pytest.mark.asyncio
+async def test_summary_counts_announces_per_tracker(handler: RecordingHandler):
+    summary = AnnounceSummary(interval=0.05)
+    task = asyncio.create_task(summary.run())
+    await asyncio.sleep(0)
+    for _ in range(1203):
+        summary.record("http://a")
+    summary.record("http://a", ConnectionError("refused"))
+    summary.record("http://b")
+    await asyncio.sleep(0.08)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert len(handler.lines) == 2
+    assert handler.lines[0].startswith("Announced 1,204 torrents to http://a in")
+    assert handler.lines[0].endswith("1 failures, last: ConnectionError('refused')")
+    assert handler.lines[1].startswith("Announced 1 torrents to http://b")
@@ -0,0 +1,128 @@
+import asyncio
+
+import flatbencode
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+
+from ghostseeder import metrics
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer
+from ghostseeder.tracker import TrackerPool
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    for metric in metrics.REGISTRY:
+        metric.clear()
+    yield
+    for metric in metrics.REGISTRY:
+        metric.clear()
+
+
+def test_counter_rendering():
+    counter = metrics.Counter("requests", "Requests sent", ["tracker"])
+    counter.labels('http://a"b').inc()
+    counter.labels('http://a"b').inc(2)
+    assert counter.render() == (
+        "# HELP requests Requests sent\n"
+        "# TYPE requests counter\n"
+        'requests_total{tracker="http://a\\"b"} 3\n'
+    )
+
+
+def test_histogram_rendering():
+    histogram = metrics.Histogram("latency", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.render().splitlines()[2:] == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        "latency_sum 2.65",
+        "latency_count 4",
+    ]
+
+
+def test_gauge_function():
+    gauge = metrics.Gauge("loaded", "Torrents loaded")
+    gauge.set_function(lambda: 42)
+    assert gauge.render().endswith("loaded 42\n")
+
+
+@pytest.mark.asyncio
+async def test_announces_are_counted(
+    httpx_mock: HTTPXMock,
+    valid_torrent: TorrentSpoofer,
+    successful_tracker_response,
+):
+    httpx_mock.add_response(content=flatbencode.encode(successful_tracker_response))
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        scheduler.add(valid_torrent)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        assert scheduler.overdue() == 0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    tracker = "http://localhost"
+    assert metrics.ANNOUNCES.labels(tracker, "started").value == 1
+    assert metrics.ANNOUNCES.labels(tracker, "stopped").value == 1
+    assert sum(metrics.ANNOUNCE_LATENCY.labels(tracker).counts) == 2
+    assert sum(metrics.LIMITER_WAIT.labels(tracker).counts) == 1
+    assert sum(metrics.SCHEDULER_LAG.labels().counts) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_announces_are_counted(
+    httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
+):
+    httpx_mock.add_response(status_code=503)
+    async with httpx.AsyncClient() as client:
+        await valid_torrent.announce_once(client, 6881)
+    assert metrics.ANNOUNCES.labels("http://localhost", "started").value == 1
+    assert metrics.ANNOUNCE_FAILURES.labels("http://localhost", "started").value == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    metrics.ANNOUNCES.labels("http://localhost", "regular").inc()
+    server = await metrics.serve_metrics("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{port}/metrics")
+            missing = await client.get(f"http://127.0.0.1:{port}/other")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'ghostseeder_announces_total{tracker="http://localhost",event="regular"} 1'
+        in response.text
+    )
+    assert "# TYPE ghostseeder_event_loop_lag_seconds histogram" in response.text
+    assert missing.status_code == 404
+
+
+def test_merge_labels_each_process():
+    counter = metrics.Counter("announces", "Announces", ["tracker"])
+    counter.labels("http://a").inc()
+    gauge = metrics.Gauge("loaded", "Loaded")
+    gauge.set(3)
+    text = counter.render() + gauge.render()
+
+    merged = metrics.merge({"0": text, "1": text}, "worker")
+    assert merged == (
+        "# HELP announces Announces\n"
+        "# TYPE announces counter\n"
+        'announces_total{worker="0",tracker="http://a"} 1\n'
+        'announces_total{worker="1",tracker="http://a"} 1\n'
+        "# HELP loaded Loaded\n"
+        "# TYPE loaded gauge\n"
+        'loaded{worker="0"} 3\n'
+        'loaded{worker="1"} 3\n'
+    )
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+import semver
+
+from ghostseeder.ghostseeder import TorrentClient, generate_peer_id
+from ghostseeder.profiles import Profile, load_profiles, profile_seed
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / "profiles.ini"
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_profiles(tmp_path):
+    path = write_config(
+        tmp_path,
+        """
+[DEFAULT]
+version = 4.3.9
+
+[main]
+folder = torrents/
+port = 6881
+
+[second-account]
+folder = other-torrents/
+port = 51413
+version = 4.4.5
+max_requests = 2
+""",
+    )
+    assert load_profiles(path, port=1, version="4.0.0", seed=7) == [
+        Profile(
+            "main",
+            os.path.join(tmp_path, "torrents/"),
+            6881,
+            "4.3.9",
+            seed=profile_seed(7, "main"),
+        ),
+        Profile(
+            "second-account",
+            os.path.join(tmp_path, "other-torrents/"),
+            51413,
+            "4.4.5",
+            2,
+            seed=profile_seed(7, "second-account"),
+        ),
+    ]
+
+
+def test_profiles_sharing_a_seed_get_different_peer_ids(tmp_path):
+    path = write_config(
+        tmp_path,
+        "[DEFAULT]\nversion = 4.3.9\nport = 6881\nseed = 7\n"
+        "[main]\nfolder = a\n[other]\nfolder = b\n",
+    )
+    version = semver.VersionInfo.parse("4.3.9")
+    peer_ids = [
+        generate_peer_id(TorrentClient.qBittorrent, version, profile.seed)
+        for profile in load_profiles(path) + load_profiles(path)
+    ]
+    # Different for each profile, but the same every time they're loaded:
+    assert peer_ids[0] != peer_ids[1]
+    assert peer_ids[:2] == peer_ids[2:]
+
+
+@pytest.mark.parametrize(
+    "text,error",
+    [
+        ("", "No profiles"),
+        ("[main]\nfolder = a\n", "missing port, version"),
+        ("[main]\nfolder = a\nport = x\nversion = 4.3.9\n", "Invalid port"),
+        ("[main]\nfolder = a\nport = 1\nversion = 4.3.9\nfoo = 1\n", "Unknown"),
+        ("folder = a\n", "Unable to parse"),
+    ],
+)
+def test_invalid_profiles_raise(tmp_path, text, error):
+    with pytest.raises(ValueError, match=error):
+        load_profiles(write_config(tmp_path, text))
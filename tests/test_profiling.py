@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import pstats
+import signal
+import tracemalloc
+
+import pytest
+
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer
+from ghostseeder.profiling import Diagnostics
+from ghostseeder.tracker import TrackerPool
+
+
+@pytest.mark.asyncio
+async def test_profile_is_written_after_its_window(tmp_path):
+    diagnostics = Diagnostics(profile_duration=0.05, profile_dir=str(tmp_path))
+    diagnostics.start()
+    assert diagnostics.active
+    await asyncio.sleep(0.1)
+    assert not diagnostics.active
+
+    (path,) = tmp_path.glob("*.pstats")
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+@pytest.mark.asyncio
+async def test_memory_diffs_are_logged(caplog):
+    caplog.set_level(logging.INFO)
+    diagnostics = Diagnostics(tracemalloc_interval=0.02)
+    diagnostics.start()
+    await asyncio.sleep(0.05)
+    assert tracemalloc.is_tracing()
+    diagnostics.stop()
+    await asyncio.sleep(0)
+
+    assert not tracemalloc.is_tracing()
+    assert "Traced memory:" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_diagnostics_toggle_at_runtime(tmp_path):
+    loop = asyncio.get_running_loop()
+    diagnostics = Diagnostics(profile_dir=str(tmp_path), slow_callback_duration=0.5)
+    assert not diagnostics.active
+
+    diagnostics.toggle()
+    assert diagnostics.active
+    assert loop.get_debug()
+    assert loop.slow_callback_duration == 0.5
+    await asyncio.sleep(0.01)
+
+    diagnostics.toggle()
+    await asyncio.sleep(0)
+    assert not diagnostics.active
+    assert not loop.get_debug()
+    # Profiles stopped early are still written:
+    assert len(list(tmp_path.glob("*.pstats"))) == 1
+
+
+@pytest.mark.asyncio
+async def test_sigusr1_dumps_scheduler_state(valid_torrent: TorrentSpoofer, caplog):
+    caplog.set_level(logging.INFO)
+    async with TrackerPool(1) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        scheduler.add(valid_torrent, delay=60)
+        trackers.get(valid_torrent.announce_url)
+        diagnostics = Diagnostics()
+        diagnostics.install_signal_handlers(scheduler.describe)
+        try:
+            os.kill(os.getpid(), signal.SIGUSR1)
+            await asyncio.sleep(0.05)
+        finally:
+            diagnostics.close()
+
+    assert "Torrents: 1 loaded, 1 scheduled, 0 overdue" in caplog.text
+    assert "Announces in flight: 0 of 64" in caplog.text
+    assert "Tracker http://localhost: 0 waiting, 0 in flight" in caplog.text
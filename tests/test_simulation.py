@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import pytest
+
+from ghostseeder.simulation import format_report, run_virtual, simulate
+
+
+def test_virtual_clock_skips_waiting():
+    async def main():
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(asyncio.sleep(3600), asyncio.sleep(1800))
+        return loop.time()
+
+    start = time.monotonic()
+    assert run_virtual(main()) == pytest.approx(3600)
+    assert time.monotonic() - start < 1
+
+
+def test_simulation_reports_ramp_and_request_rate():
+    report = run_virtual(
+        simulate(100, 600, num_trackers=2, max_requests=5, interval=60, latency=0.1)
+    )
+    # 50 torrents per tracker at 5 announces per second:
+    assert report["ramp"] == pytest.approx(10, abs=0.5)
+    assert report["started"] == 100
+    assert report["failures"] == 0
+    assert report["announces"] == pytest.approx(1000, abs=100)
+    assert report["lateness_max"] < 1
+    assert len(report["requests"]) == 2
+    for requests in report["requests"].values():
+        assert requests["peak"] <= 5
+    # Only the first announces had to wait:
+    assert report["backlog"][0] > 0
+    assert max(report["backlog"][1:]) <= 2
+    assert "Startup ramp: 10s" in format_report(report)
+
+
+def test_simulation_counts_failures_and_lateness():
+    report = run_virtual(
+        simulate(50, 3600, max_requests=1, interval=30, error_rate=1.0)
+    )
+    assert report["failures"] == report["announces"]
+    # One announce per second can't keep up with 50 torrents every 30s:
+    report = run_virtual(simulate(50, 3600, max_requests=1, interval=30))
+    assert report["lateness_max"] > 10
+    assert report["relative_lateness_max"] > 0.5
+
+
+def test_coalescing_reuses_connections():
+    options = dict(max_requests=5, interval=1800, interval_jitter=600, keepalive=5)
+    spread = run_virtual(simulate(100, 43200, **options))
+    coalesced = run_virtual(simulate(100, 43200, coalesce_window=300, **options))
+    (before,) = spread["requests"].values()
+    (after,) = coalesced["requests"].values()
+    assert after["connections_per_announce"] < before["connections_per_announce"] / 4
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import flatbencode
+import httpx
+import pytest
+from pytest_httpx import HTTPXMock
+
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer, torrent_key
+from ghostseeder.state import AnnounceJournal
+from ghostseeder.tracker import TrackerPool
+
+
+def test_journal_roundtrip(tmp_path):
+    with AnnounceJournal(tmp_path / "state.sqlite") as journal:
+        journal.record(b"a" * 20, 1800, 3, "regular")
+        journal.record(b"b" * 20, 1800, 1, "started")
+        journal.record(b"c" * 20, 1800, 1, "started")
+        journal.mark_stopped(b"b" * 20)
+        journal.forget(b"c" * 20)
+
+    with AnnounceJournal(tmp_path / "state.sqlite") as journal:
+        assert len(journal) == 2
+        state = journal.get(b"a" * 20)
+        assert state.num_announces == 3
+        assert state.event == "regular"
+        assert state.due_at == pytest.approx(time.time() + 1800, abs=5)
+        assert journal.get(b"b" * 20).event == "stopped"
+        assert journal.get(b"c" * 20) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_resumes_from_journal(
+    httpx_mock: HTTPXMock,
+    valid_torrent: TorrentSpoofer,
+    successful_tracker_response,
+):
+    httpx_mock.add_response(content=flatbencode.encode(successful_tracker_response))
+    journal = AnnounceJournal(":memory:")
+    # Last announced 1790 seconds into an 1800 second interval:
+    key = torrent_key(valid_torrent)
+    journal.record(key, 1800, 5, "regular")
+    journal._entries[key] = journal.get(key)._replace(announced_at=time.time() - 1799.9)
+
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881, journal=journal)
+        scheduler.add(valid_torrent)
+        assert valid_torrent.num_announces == 5
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        assert not httpx_mock.get_requests()
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    announce, stop = httpx_mock.get_requests()
+    # Picks up with a regular announce rather than starting over:
+    assert "event=" not in str(announce.url)
+    assert "event=stopped" in str(stop.url)
+    state = journal.get(key)
+    assert state.num_announces == 6
+    assert state.event == "stopped"
+    assert state.interval == 1800
+
+
+@pytest.mark.asyncio
+async def test_stopped_torrents_start_again(
+    httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
+):
+    httpx_mock.add_response()
+    journal = AnnounceJournal(":memory:")
+    journal.record(torrent_key(valid_torrent), 0, 5, "regular")
+    journal.mark_stopped(torrent_key(valid_torrent))
+
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881, journal=journal)
+        scheduler.add(valid_torrent)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert "event=started" in str(httpx_mock.get_requests()[0].url)
+
+
+@pytest.mark.asyncio
+async def test_cross_seeded_copies_are_journaled_separately(
+    httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo
+):
+    httpx_mock.add_response()
+    torrents = []
+    for tracker in ("http://localhost", "http://other-tracker"):
+        valid_singlefile_metainfo[b"announce"] = tracker.encode()
+        filepath = tmp_path / f"{len(torrents)}.torrent"
+        filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+        torrents.append(TorrentSpoofer(str(filepath), "-qB4450-McTfgDArNMzY", "qB"))
+    first, second = torrents
+    assert first.encoded_infohash == second.encoded_infohash
+    journal = AnnounceJournal(":memory:")
+
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881, journal=journal)
+        scheduler.add(first)
+        scheduler.add(second)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        assert len(journal) == 2
+        # Removing one copy keeps the state of the other:
+        scheduler.remove(first.filepath)
+        assert journal.get(torrent_key(first)) is None
+        assert journal.get(torrent_key(second)).num_announces == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+
+@pytest.mark.asyncio
+async def test_torrents_removed_mid_announce_stay_forgotten(
+    httpx_mock: HTTPXMock, valid_torrent: TorrentSpoofer
+):
+    journal = AnnounceJournal(":memory:")
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881, journal=journal)
+
+        def remove_while_announcing(request):
+            if "event=started" in str(request.url):
+                scheduler.remove(valid_torrent.filepath)
+            return httpx.Response(200)
+
+        httpx_mock.add_callback(remove_while_announcing)
+        scheduler.add(valid_torrent)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert journal.get(torrent_key(valid_torrent)) is None
@@ -0,0 +1,77 @@
+import hashlib
+import time
+
+import pytest
+
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer, shard_of
+from ghostseeder.profiles import Profile
+from ghostseeder.supervisor import WORKER_RESTARTS, Supervisor
+from ghostseeder.tracker import TrackerPool
+
+
+def crash(index, options, log_queue):
+    raise SystemExit(3)
+
+
+def test_shards_are_stable_and_balanced():
+    infohashes = [hashlib.sha1(str(i).encode()).digest() for i in range(4000)]
+    shards = [shard_of(infohash, 4) for infohash in infohashes]
+    assert shards == [shard_of(infohash, 4) for infohash in infohashes]
+    for shard in range(4):
+        assert 900 < shards.count(shard) < 1100
+
+
+@pytest.mark.asyncio
+async def test_scheduler_only_adds_its_shard(valid_torrent: TorrentSpoofer):
+    shard = shard_of(valid_torrent.encoded_infohash, 2)
+    async with TrackerPool(1) as trackers:
+        mine = AnnounceScheduler(trackers, 6881, shard=(shard, 2))
+        other = AnnounceScheduler(trackers, 6881, shard=(1 - shard, 2))
+        mine.add(valid_torrent)
+        other.add(valid_torrent)
+    assert len(mine.torrents) == 1
+    assert len(other.torrents) == 0
+
+
+def test_limits_are_split_between_workers():
+    supervisor = Supervisor(
+        3,
+        {"max_requests": 3, "max_connections": 16, "peer_id": "-qB4450-abc"},
+        metrics_port=9000,
+    )
+    options = supervisor.worker_options(2)
+    assert options["shard"] == (2, 3)
+    assert options["max_requests"] == 1
+    assert options["max_connections"] == 6
+    assert options["max_workers"] == 22
+    assert options["metrics_port"] == 9003
+    assert options["peer_id"] == "-qB4450-abc"
+
+
+def test_profile_limits_are_split_between_workers():
+    profiles = [
+        Profile("main", "a", 6881, "4.3.9", 4),
+        Profile("other", "b", 51413, "4.4.5"),
+    ]
+    supervisor = Supervisor(2, {"profiles": profiles})
+    options = supervisor.worker_options(1)
+    assert [profile.max_requests for profile in options["profiles"]] == [2, 0.5]
+    assert "max_requests" not in options
+    assert supervisor.options["profiles"] == profiles
+
+
+def test_crashed_worker_is_restarted():
+    supervisor = Supervisor(1, {}, target=crash)
+    (worker,) = supervisor.workers
+    supervisor.start(worker)
+    worker.process.join(30)
+    first = worker.process
+
+    supervisor.check(worker)
+    assert worker.restart_at is not None
+    worker.restart_at = time.monotonic()
+    supervisor.check(worker)
+    assert worker.process is not first
+    assert WORKER_RESTARTS.labels("0").value == 1
+    worker.process.join(30)
+    assert worker.process.exitcode == 3
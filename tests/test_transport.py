@@ -0,0 +1,189 @@
+import asyncio
+import shutil
+import ssl
+import subprocess
+
+import httpx
+import pytest
+
+from ghostseeder import metrics
+from ghostseeder.transport import (
+    MAX_KEEPALIVE_EXPIRY,
+    MIN_KEEPALIVE_EXPIRY,
+    DNSCache,
+    ResumingSSLContext,
+    StreamClient,
+    create_client,
+    run,
+)
+
+OK = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+
+
+class Server:
+    """Answers every request on a connection with the next of `responses`"""
+
+    def __init__(self, *responses: bytes, close_after: int = 0):
+        self.responses = responses
+        self.close_after = close_after
+        self.connections = 0
+        self.requests: list[bytes] = []
+        self.handlers: list[asyncio.Task] = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer) -> None:
+        self.connections += 1
+        self.handlers.append(asyncio.current_task())
+        try:
+            for i, response in enumerate(self.responses):
+                self.requests.append(await reader.readuntil(b"\r\n\r\n"))
+                writer.write(response)
+                await writer.drain()
+                if self.close_after and i + 1 == self.close_after:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self) -> str:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/announce"
+
+    async def __aexit__(self, *exc_info) -> None:
+        await asyncio.wait_for(asyncio.gather(*self.handlers), 1)
+        self.server.close()
+        await self.server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_requests_are_pipelined_when_connections_are_busy():
+    server = Server(*[OK] * 10)
+    opened = metrics.CONNECTIONS_OPENED.labels("127.0.0.1")
+    before = opened.value
+    async with server as url, StreamClient(max_connections=1) as client:
+        responses = await asyncio.gather(
+            *(
+                client.get(f"{url}?n={i}", headers={"User-Agent": "test"})
+                for i in range(5)
+            )
+        )
+    assert [response.content for response in responses] == [b"ok"] * 5
+    assert server.connections == 1
+    assert opened.value == before + 1
+    assert server.requests[0].startswith(b"GET /announce?n=0 HTTP/1.1\r\n")
+    assert b"User-Agent: test\r\n" in server.requests[0]
+
+
+@pytest.mark.asyncio
+async def test_request_is_retried_when_idle_connection_was_closed():
+    server = Server(OK, OK, close_after=1)
+    async with server as url, StreamClient() as client:
+        await client.get(url)
+        # Let the server's close reach the client unnoticed:
+        await asyncio.sleep(0.05)
+        response = await client.get(url)
+    assert response.content == b"ok"
+    assert server.connections == 2
+
+
+@pytest.mark.asyncio
+async def test_chunked_responses_and_status_errors():
+    chunked = (
+        b"HTTP/1.1 503 Service Unavailable\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"4\r\ndown\r\n0\r\n\r\n"
+    )
+    async with Server(chunked) as url, StreamClient() as client:
+        response = await client.get(url)
+    assert response.content == b"down"
+    with pytest.raises(httpx.HTTPStatusError):
+        response.raise_for_status()
+
+
+@pytest.mark.asyncio
+async def test_connection_errors_are_raised_as_httpx_errors():
+    async with Server() as url:
+        pass
+    async with StreamClient() as client:
+        with pytest.raises(httpx.ConnectError):
+            await client.get(url)
+
+
+def test_keepalive_follows_request_cadence(monkeypatch):
+    client = StreamClient()
+    now = 1000.0
+    monkeypatch.setattr("time.monotonic", lambda: now)
+    for _ in range(20):
+        client._observe_request()
+        now += 60
+    assert client.keepalive_expiry == pytest.approx(120)
+    for _ in range(20):
+        client._observe_request()
+        now += 3600
+    assert client.keepalive_expiry == MAX_KEEPALIVE_EXPIRY
+    for _ in range(40):
+        client._observe_request()
+        now += 0.1
+    assert client.keepalive_expiry == MIN_KEEPALIVE_EXPIRY
+
+
+@pytest.mark.asyncio
+async def test_dns_lookups_are_cached():
+    dns = DNSCache(ttl=60)
+    lookups = metrics.DNS_LOOKUPS.labels("localhost", "true")
+    before = lookups.value
+    first = await dns.resolve("localhost", 80)
+    assert await dns.resolve("localhost", 80) == first
+    assert lookups.value == before + 1
+
+
+def test_unknown_transport_or_event_loop():
+    with pytest.raises(ValueError):
+        create_client("curl", 1, 1)
+
+    async def main():
+        pass
+
+    with pytest.raises(ValueError):
+        run(main(), "trio")
+
+
+@pytest.fixture
+def certificate(tmp_path):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to create a certificate")
+    cert, key = str(tmp_path / "cert.pem"), str(tmp_path / "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-keyout", key, "-out", cert, "-subj", "/CN=localhost"]
+        + ["-addext", "subjectAltName=DNS:localhost"],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("transport", ["httpx", "stream"])
+async def test_tls_sessions_are_resumed(certificate, transport):
+    cert, key = certificate
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert, key)
+    server = Server(
+        b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok"
+    )
+    server.server = await asyncio.start_server(
+        server.handle, "127.0.0.1", 0, ssl=server_context
+    )
+    port = server.server.sockets[0].getsockname()[1]
+    context = ResumingSSLContext()
+    context.load_verify_locations(cert)
+    handshakes = metrics.TLS_HANDSHAKE_DURATION.labels("localhost", "true")
+    before = sum(handshakes.counts)
+    async with create_client(transport, 1, 1, context) as client:
+        for _ in range(3):
+            response = await client.get(f"https://localhost:{port}/announce")
+            response.raise_for_status()
+    await server.__aexit__()
+    assert server.connections == 3
+    assert sum(handshakes.counts) == before + 2
@@ -0,0 +1,211 @@
+import asyncio
+import struct
+
+import flatbencode
+import pytest
+import pytest_asyncio
+
+from ghostseeder.ghostseeder import TorrentSpoofer, TrackerRequestEvent
+from ghostseeder.tracker import TrackerPool
+from ghostseeder.udp import (
+    ANNOUNCE,
+    CONNECT,
+    ERROR,
+    PROTOCOL_ID,
+    UDPTrackerClient,
+    UDPTrackerError,
+    _TrackerProtocol,
+)
+
+
+class StandInTracker(asyncio.DatagramProtocol):
+    """Minimal BEP 15 tracker that records the requests it receives"""
+
+    def __init__(self, interval=1800, drop=0, error=None):
+        self.interval = interval
+        self.drop = drop
+        self.error = error
+        self.connects = 0
+        self.announces = []
+        self.connection_id = 0x1234567890
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.drop:
+            self.drop -= 1
+            return
+        connection_id, action, transaction_id = struct.unpack_from(">QII", data)
+        if action == CONNECT:
+            assert connection_id == PROTOCOL_ID
+            self.connects += 1
+            response = struct.pack(">IIQ", CONNECT, transaction_id, self.connection_id)
+        elif self.error is not None:
+            response = struct.pack(">II", ERROR, transaction_id) + self.error
+        else:
+            assert action == ANNOUNCE
+            assert connection_id == self.connection_id
+            fields = struct.unpack_from(">20s20sQQQIIIiH", data, 16)
+            self.announces.append((fields, data[98:]))
+            response = struct.pack(
+                ">IIIII", ANNOUNCE, transaction_id, self.interval, 3, 7
+            )
+        self.transport.sendto(response, addr)
+
+
+@pytest_asyncio.fixture
+async def udp_tracker():
+    loop = asyncio.get_running_loop()
+    transport, tracker = await loop.create_datagram_endpoint(
+        StandInTracker, local_addr=("127.0.0.1", 0)
+    )
+    tracker.url = "udp://127.0.0.1:{}/passkey/announce".format(
+        transport.get_extra_info("sockname")[1]
+    )
+    yield tracker
+    transport.close()
+
+
+@pytest.mark.asyncio
+async def test_udp_announce(udp_tracker):
+    client = UDPTrackerClient()
+    infohash = b"\x01" * 20
+    response = await client.announce(
+        udp_tracker.url, infohash, "-qB4450-McTfgDArNMzY", 6881, event="started"
+    )
+    client.close()
+
+    assert response.interval == 1800
+    assert (response.incomplete, response.complete) == (3, 7)
+    ((fields, options),) = udp_tracker.announces
+    assert fields[0] == infohash
+    assert fields[1] == b"-qB4450-McTfgDArNMzY"
+    assert fields[5] == 2  # started
+    assert fields[-1] == 6881
+    # The passkey in the url path is sent as a BEP 41 option:
+    assert options == b"\x02\x11/passkey/announce"
+
+
+@pytest.mark.asyncio
+async def test_udp_connection_id_is_reused(udp_tracker):
+    client = UDPTrackerClient()
+    await asyncio.gather(
+        *(
+            client.announce(udp_tracker.url, bytes([i]) * 20, "-qB4450-McTfgDArNMzY", 1)
+            for i in range(10)
+        )
+    )
+    client.close()
+
+    assert udp_tracker.connects == 1
+    assert len(udp_tracker.announces) == 10
+
+
+@pytest.mark.asyncio
+async def test_udp_retransmits_lost_packets(udp_tracker):
+    udp_tracker.drop = 2
+    client = UDPTrackerClient(base_timeout=0.01, max_retries=3)
+    response = await client.announce(
+        udp_tracker.url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 6881
+    )
+    client.close()
+    assert response.interval == 1800
+
+
+@pytest.mark.asyncio
+async def test_udp_timeout_and_error_raise(udp_tracker):
+    client = UDPTrackerClient(base_timeout=0.01, max_retries=1)
+    udp_tracker.drop = 100
+    with pytest.raises(UDPTrackerError):
+        await client.announce(udp_tracker.url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 1)
+
+    udp_tracker.drop = 0
+    udp_tracker.error = b"unregistered torrent"
+    with pytest.raises(UDPTrackerError, match="unregistered torrent"):
+        await client.announce(udp_tracker.url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 1)
+    # The connection id isn't reused after an error:
+    udp_tracker.error = None
+    await client.announce(udp_tracker.url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 1)
+    assert udp_tracker.connects == 2
+    client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "url",
+    [
+        "udp://tracker.example/announce",
+        "udp://tracker.example:abc/announce",
+        "udp://tracker.example:70000/announce",
+    ],
+)
+async def test_udp_invalid_url_raises(url):
+    client = UDPTrackerClient()
+    with pytest.raises(UDPTrackerError, match="needs a host and port"):
+        await client.announce(url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 1)
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_udp_gives_up_after_a_few_attempts(udp_tracker):
+    client = UDPTrackerClient(base_timeout=0.01)
+    udp_tracker.drop = 100
+    with pytest.raises(UDPTrackerError):
+        await client.announce(udp_tracker.url, b"\x01" * 20, "-qB4450-McTfgDArNMzY", 1)
+    client.close()
+    # One connect request and one retransmission:
+    assert 100 - udp_tracker.drop == 2
+
+
+@pytest.mark.asyncio
+async def test_udp_ignores_datagrams_from_other_addresses():
+    protocol = _TrackerProtocol()
+    waiter = asyncio.get_running_loop().create_future()
+    protocol.waiters[7] = (waiter, ("127.0.0.1", 6969))
+    response = struct.pack(">IIQ", CONNECT, 7, 1)
+
+    protocol.datagram_received(response, ("127.0.0.2", 6969))
+    protocol.datagram_received(response, ("127.0.0.1", 6970))
+    assert not waiter.done()
+    protocol.datagram_received(response, ("127.0.0.1", 6969))
+    assert waiter.result() == (CONNECT, struct.pack(">Q", 1))
+
+
+@pytest.mark.asyncio
+async def test_udp_tracker_selected_by_scheme(
+    udp_tracker, tmp_path, valid_singlefile_metainfo
+):
+    udp_tracker.interval = 900
+    valid_singlefile_metainfo[b"announce"] = udp_tracker.url.encode()
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    torrent = TorrentSpoofer(filepath, "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+
+    async with TrackerPool(1) as trackers:
+        tracker = trackers.get(torrent.announce_url)
+        assert tracker.client is trackers.udp_client
+        assert await torrent.announce_once(tracker.client, 6881) == 900
+        await torrent.announce(tracker.client, 6881, event=TrackerRequestEvent.STOPPED)
+
+    assert [fields[5] for fields, _ in udp_tracker.announces] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_udp_key_differs_per_peer_id(
+    udp_tracker, tmp_path, valid_singlefile_metainfo
+):
+    valid_singlefile_metainfo[b"announce"] = udp_tracker.url.encode()
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    peer_ids = ["-qB4450-McTfgDArNMzY", "-qB4450-McTfgDArNMzY", "-qB4350-OcPetHlvbFeW"]
+
+    async with TrackerPool(1) as trackers:
+        for peer_id in peer_ids:
+            torrent = TorrentSpoofer(filepath, peer_id, "qBittorrent/4.4.5")
+            await torrent.announce(trackers.udp_client, 6881)
+
+    # Profiles sharing the UDP client still announce with keys of their own:
+    first, again, other = [fields[-3] for fields, _ in udp_tracker.announces]
+    assert first == again
+    assert first != other
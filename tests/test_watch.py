@@ -0,0 +1,190 @@
+import asyncio
+import errno
+
+import flatbencode
+import pytest
+from pytest_httpx import HTTPXMock
+
+from ghostseeder import watch
+from ghostseeder.ghostseeder import AnnounceScheduler, TorrentSpoofer, follow_folder
+from ghostseeder.tracker import TrackerPool
+from ghostseeder.watch import InotifyWatcher, PollingWatcher
+
+
+@pytest.fixture(params=[InotifyWatcher, PollingWatcher])
+def make_watcher(request, monkeypatch):
+    monkeypatch.setattr(watch, "DEBOUNCE_INTERVAL", 0.05)
+
+    def make_watcher(folderpath):
+        if request.param is PollingWatcher:
+            return PollingWatcher(folderpath, interval=0.05)
+        return InotifyWatcher(folderpath)
+
+    return make_watcher
+
+
+async def next_change(changes):
+    return await asyncio.wait_for(changes.__anext__(), 2)
+
+
+@pytest.mark.asyncio
+async def test_watcher_reports_added_and_removed_files(
+    tmp_path, valid_singlefile_metainfo, make_watcher
+):
+    contents = flatbencode.encode(valid_singlefile_metainfo)
+    (tmp_path / "existing.torrent").write_bytes(contents)
+    watcher = make_watcher(str(tmp_path))
+    await watcher.start()
+    changes = watcher.changes()
+
+    (tmp_path / "new.torrent").write_bytes(contents)
+    (tmp_path / "notes.txt").write_text("not a torrent")
+    assert await next_change(changes) == ({str(tmp_path / "new.torrent")}, set())
+
+    (tmp_path / "sub" / "dir").mkdir(parents=True)
+    (tmp_path / "sub" / "dir" / "nested.torrent").write_bytes(contents)
+    nested = str(tmp_path / "sub" / "dir" / "nested.torrent")
+    added = set()
+    while nested not in added:
+        added |= (await next_change(changes))[0]
+
+    (tmp_path / "existing.torrent").unlink()
+    assert await next_change(changes) == (
+        set(),
+        {str(tmp_path / "existing.torrent")},
+    )
+    await changes.aclose()
+    watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_inotify_falls_back_to_polling_when_out_of_watches(
+    tmp_path, valid_singlefile_metainfo, monkeypatch
+):
+    monkeypatch.setattr(watch, "DEBOUNCE_INTERVAL", 0.05)
+    monkeypatch.setattr(watch, "POLL_INTERVAL", 0.05)
+    contents = flatbencode.encode(valid_singlefile_metainfo)
+    add_watch = InotifyWatcher._add_watch
+
+    def limited_add_watch(self, path):
+        # Only the top folder fits within `max_user_watches`:
+        if self._watches:
+            raise OSError(errno.ENOSPC, f"Unable to watch {path}")
+        add_watch(self, path)
+
+    monkeypatch.setattr(InotifyWatcher, "_add_watch", limited_add_watch)
+    watcher = InotifyWatcher(str(tmp_path))
+    await watcher.start()
+    changes = watcher.changes()
+
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "nested.torrent").write_bytes(contents)
+    nested = str(tmp_path / "sub" / "nested.torrent")
+    added = set()
+    while nested not in added:
+        added |= (await next_change(changes))[0]
+    assert watcher._fallback is not None
+
+    # Still sees changes once polling:
+    (tmp_path / "sub" / "nested.torrent").unlink()
+    assert await next_change(changes) == (set(), {nested})
+    await changes.aclose()
+    watcher.close()
+
+    # Subdirectories that can't be watched on startup:
+    watcher = InotifyWatcher(str(tmp_path))
+    await watcher.start()
+    assert watcher._fallback is not None
+    changes = watcher.changes()
+    (tmp_path / "sub" / "new.torrent").write_bytes(contents)
+    assert await next_change(changes) == (
+        {str(tmp_path / "sub" / "new.torrent")},
+        set(),
+    )
+    await changes.aclose()
+    watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_follow_folder_adds_and_removes_torrents(
+    httpx_mock: HTTPXMock, tmp_path, valid_singlefile_metainfo, make_watcher
+):
+    httpx_mock.add_response()
+    watcher = make_watcher(str(tmp_path))
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        await watcher.start()
+        scheduler.spawn(
+            follow_folder(
+                scheduler, watcher, "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5"
+            )
+        )
+        run = asyncio.create_task(scheduler.run())
+
+        filepath = tmp_path / "new.torrent"
+        filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if str(filepath) in scheduler.torrents:
+                break
+        torrent = scheduler.torrents[str(filepath)]
+        await asyncio.sleep(0.05)
+        assert torrent.num_announces == 1
+
+        filepath.unlink()
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if torrent.num_announces == 2:
+                break
+        assert str(filepath) not in scheduler.torrents
+
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+    watcher.close()
+
+    events = [str(request.url) for request in httpx_mock.get_requests()]
+    assert "event=started" in events[0]
+    assert "event=stopped" in events[1]
+    assert len(events) == 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_ignores_reloading_the_same_torrent(
+    tmp_path, valid_singlefile_metainfo
+):
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    first = TorrentSpoofer(str(filepath), "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+    second = TorrentSpoofer(str(filepath), "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        scheduler.add(first)
+        scheduler.add(second)
+        assert scheduler.torrents[str(filepath)] is first
+        assert len(scheduler) == 1
+
+
+@pytest.mark.asyncio
+async def test_rewritten_announce_urls_replace_the_torrent(
+    tmp_path, valid_singlefile_metainfo
+):
+    filepath = tmp_path / "test.torrent"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    old = TorrentSpoofer(str(filepath), "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+    valid_singlefile_metainfo[b"announce"] = b"http://localhost/newpasskey"
+    filepath.write_bytes(flatbencode.encode(valid_singlefile_metainfo))
+    new = TorrentSpoofer(str(filepath), "-qB4450-McTfgDArNMzY", "qBittorrent/4.4.5")
+
+    async with TrackerPool(1000) as trackers:
+        scheduler = AnnounceScheduler(trackers, 6881)
+        scheduler.add(old, 600)
+        old.num_announces = 3
+        scheduler.add(new)
+        assert scheduler.torrents[str(filepath)] is new
+        assert new.announce_url == "http://localhost/newpasskey"
+        # Keeps its place in the schedule:
+        assert new.num_announces == 3
+        assert scheduler.due_times()[new] - scheduler.clock() > 590
+        assert old not in scheduler.due_times()